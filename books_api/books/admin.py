@@ -4,12 +4,28 @@ from books.models import (
     Libraries, BookLibraryAvailable, UserBookSession,
     UserBookRelation, UserBookOffer
 )
+from books.services import set_book_values, get_relation_values
+
+
+@admin.register(Books)
+class BooksAdmin(admin.ModelAdmin):
+    """Счётчики книги поддерживаются сервисами и сигналами, поэтому в админке только для чтения"""
+    readonly_fields = ('rating', 'rating_sum', 'rating_count', 'likes', 'bookmarks', 'reading_now')
+
+
+@admin.register(UserBookRelation)
+class UserBookRelationAdmin(admin.ModelAdmin):
+    """Изменение отношения в админке обновляет рейтинг, лайки и закладки книги так же, как API"""
+
+    def save_model(self, request, obj, form, change):
+        old_values = get_relation_values(UserBookRelation.objects.get(pk=obj.pk)) if change else None
+        super().save_model(request, obj, form, change)
+        set_book_values(obj, old_values)
+
 
-admin.site.register(Books)
 admin.site.register(Authors)
 admin.site.register(Categories)
 admin.site.register(Libraries)
 admin.site.register(BookLibraryAvailable)
 admin.site.register(UserBookSession)
-admin.site.register(UserBookRelation)
 admin.site.register(UserBookOffer)
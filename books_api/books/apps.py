@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BooksConfig(AppConfig):
     name = 'books'
+
+    def ready(self):
+        import books.checks  # noqa: F401
+        import books.signals  # noqa: F401
@@ -0,0 +1,162 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, HASH_SESSION_KEY
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import salted_hmac
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication, TokenAuthentication
+
+from books.cache import get_version, bump_versions, is_cache_shared
+
+
+DEFAULT_AUTH_CACHE_SETTINGS = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,
+    'TIMEOUT': 300,
+}
+
+KEY_SALT = 'books.authentication.credentials'
+
+
+def get_auth_cache_settings():
+    return {**DEFAULT_AUTH_CACHE_SETTINGS, **getattr(settings, 'BOOKS_AUTH_CACHE', {})}
+
+
+def is_auth_cache_enabled():
+    """
+    Включён ли кэш учётных данных (ENABLED). Инвалидация записей других процессов идёт через версии
+    в кэше BOOKS_DETAIL_CACHE['CACHE'], поэтому без общего кэша (is_cache_shared) включение запрещено:
+    иначе удалённый токен или старый пароль принимались бы другими процессами до TIMEOUT
+    """
+    if not get_auth_cache_settings()['ENABLED']:
+        return False
+    if not is_cache_shared():
+        raise ImproperlyConfigured('BOOKS_AUTH_CACHE требует общего кэша версий (BOOKS_DETAIL_CACHE["CACHE"]) '
+                                   'или BOOKS_DETAIL_CACHE["SINGLE_PROCESS"]')
+    return True
+
+
+def credentials_key(*parts):
+    """Ключ записи кэша - HMAC-SHA256 частей учётных данных с ключом из SECRET_KEY (сами данные не хранятся)"""
+    return salted_hmac(KEY_SALT, '\0'.join(str(part) for part in parts), algorithm='sha256').hexdigest()
+
+
+def invalidate_credentials(user_ids):
+    """
+    Инвалидация всех проверенных учётных данных пользователей с переданными id: новая версия пользователя
+    в кэше версий, который при включённом кэше учётных данных общий для всех процессов (is_auth_cache_enabled)
+    """
+    bump_versions([('auth', user_id) for user_id in set(user_ids)])
+
+
+class CredentialCache:
+    """
+    Кэш проверенных учётных данных в памяти процесса: ключ - credentials_key, значение - результат
+    аутентификации (пользователь, auth), версия ('auth', id пользователя) на момент сохранения и срок жизни.
+    Записи у каждого процесса свои, а версии - в общем кэше версий, поэтому запись действительна
+    до истечения TIMEOUT и смены версии пользователя в любом процессе, а попадание стоит
+    одного обращения к кэшу версий. При превышении MAX_SIZE вытесняются давно не использованные записи.
+    Результат отдаётся копией, чтобы изменения пользователя в одном запросе не попали в другие
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None:
+            return None
+        result, version, expires = entry
+        if expires <= time.monotonic() or version != get_version('auth', result[0].pk):
+            self.discard(key)
+            return None
+        return copy.deepcopy(result)
+
+    def set(self, key, result, version):
+        conf = get_auth_cache_settings()
+        entry = (copy.deepcopy(result), version, time.monotonic() + conf['TIMEOUT'])
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > conf['MAX_SIZE']:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_credentials = CredentialCache()
+
+
+class CachedCredentialsMixin:
+    """
+    Примесь к классам аутентификации DRF: успешный результат проверки учётных данных сохраняется в CredentialCache,
+    ошибки не кэшируются. Версия пользователя читается сразу после проверки, поэтому изменение
+    пользователя, совпавшее с проверкой, может продержаться в кэше не дольше TIMEOUT
+    """
+
+    def cached_authenticate(self, parts, authenticate):
+        """Результат authenticate() из кэша по учётным данным parts, при промахе - проверка и сохранение"""
+        if not is_auth_cache_enabled():
+            return authenticate()
+        key = credentials_key(*parts)
+        result = _credentials.get(key)
+        if result is None:
+            result = authenticate()
+            if result is not None:
+                _credentials.set(key, result, get_version('auth', result[0].pk))
+        return result
+
+
+class CachedBasicAuthentication(CachedCredentialsMixin, BasicAuthentication):
+    """BasicAuthentication без вычисления хэша пароля (PBKDF2) и запроса пользователя при повторных запросах"""
+
+    def authenticate_credentials(self, userid, password, request=None):
+        return self.cached_authenticate(
+            ('basic', userid, password), partial(super().authenticate_credentials, userid, password, request))
+
+
+class CachedTokenAuthentication(CachedCredentialsMixin, TokenAuthentication):
+    """TokenAuthentication без запроса токена и пользователя при повторных запросах"""
+
+    def authenticate_credentials(self, key):
+        return self.cached_authenticate(('token', key), partial(super().authenticate_credentials, key))
+
+
+class CachedSessionAuthentication(CachedCredentialsMixin, SessionAuthentication):
+    """
+    SessionAuthentication без запроса пользователя при повторных запросах: ключ записи - ключ сессии,
+    id пользователя и хэш пароля из сессии. Сама сессия читается движком SESSION_ENGINE
+    (с движком на кэше - без запроса к django_session). CSRF проверяется при каждом запросе
+    """
+
+    def authenticate(self, request):
+        session = getattr(request._request, 'session', None)
+        user_id = session.get(SESSION_KEY) if session is not None else None
+        if user_id is None:
+            return None
+        parts = ('session', session.session_key, user_id, session.get(HASH_SESSION_KEY, ''))
+        result = self.cached_authenticate(parts, partial(self.authenticate_session, request))
+        if result is not None:
+            self.enforce_csrf(request)
+        return result
+
+    def authenticate_session(self, request):
+        """Пользователь сессии из AuthenticationMiddleware (как в SessionAuthentication)"""
+        user = getattr(request._request, 'user', None)
+        if not user or not user.is_active:
+            return None
+        return user, None
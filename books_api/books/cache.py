@@ -0,0 +1,180 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+DEFAULT_DETAIL_CACHE_SETTINGS = {
+    'CACHE': 'default',
+    'TIMEOUT': 300,
+    'STALE_WHILE_REVALIDATE': 5,
+    'LOCK_TIMEOUT': 10,
+    'WAIT_TIMEOUT': 3,
+    'SINGLE_PROCESS': False,
+}
+
+# Кэши, содержимое которых видно только одному процессу
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+POLL_INTERVAL = 0.05
+
+_table_ids = {}
+
+
+def get_detail_cache_settings():
+    return {**DEFAULT_DETAIL_CACHE_SETTINGS, **getattr(settings, 'BOOKS_DETAIL_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_detail_cache_settings()['CACHE']]
+
+
+def is_cache_shared():
+    """
+    Видят ли все процессы одни и те же версии: кэш CACHE общий (не в памяти процесса)
+    либо проект запущен одним процессом (SINGLE_PROCESS). Иначе инвалидация bump_versions
+    доходит только до изменившего данные процесса, поэтому кэширование по версиям отключается
+    """
+    conf = get_detail_cache_settings()
+    return conf['SINGLE_PROCESS'] or settings.CACHES[conf['CACHE']]['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def version_key(*parts):
+    return 'books:version:' + ':'.join(str(part) for part in parts)
+
+
+def get_version(*parts):
+    """
+    Получение версии объекта (или таблицы) по ключу из частей parts.
+    Версия - время последнего изменения в наносекундах, при отсутствии в кэше создаётся новая
+    """
+    cache = get_cache()
+    key = version_key(*parts)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _set_versions(keys):
+    version = time.time_ns()
+    get_cache().set_many({key: version for key in keys}, None)
+
+
+def bump_versions(keys):
+    """
+    Увеличение версий по списку ключей (кортежей частей).
+    Версия обновляется сразу и ещё раз после фиксации транзакции, чтобы ответ,
+    посчитанный по незафиксированным данным, не остался в кэше под новой версией
+    """
+    keys = [version_key(*parts) for parts in keys]
+    if not keys:
+        return
+    _set_versions(keys)
+    transaction.on_commit(lambda: _set_versions(keys))
+
+
+def bump_table_versions(table, item, pks):
+    """
+    Увеличение версии таблицы (ключ (table,)) и версий её записей (ключи (item, pk)).
+    Версия таблицы меняется при любом изменении её записей и используется для списков
+    """
+    pks = set(pks)
+    if pks:
+        bump_versions([(table,), *((item, pk) for pk in pks)])
+
+
+def bump_book_versions(book_ids):
+    """Инвалидация закэшированных ответов для книг с переданными id и списков книг"""
+    bump_table_versions('books', 'book', book_ids)
+
+
+def get_table_ids(table, queryset):
+    """
+    Множество pk записей таблицы (ключ версии (table,) из bump_table_versions) для проверки id без запроса.
+    Множество хранится в кэше с ключом по версии таблицы и в памяти процесса до смены версии,
+    поэтому при совпадении версии стоит одного обращения к кэшу
+    """
+    version = get_version(table)
+    local = _table_ids.get(table)
+    if local is not None and local[0] == version:
+        return local[1]
+    cache = get_cache()
+    key = f'books:ids:{table}:{version}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(queryset.order_by().values_list('pk', flat=True))
+        cache.set(key, ids, get_detail_cache_settings()['TIMEOUT'])
+    _table_ids[table] = (version, ids)
+    return ids
+
+
+def get_books_facets(params, compute):
+    """
+    Получение фасетов списка книг из кэша с ключом по версии списков книг и нормализованным параметрам
+    (фильтры и поиск), compute - функция, вычисляющая фасеты при промахе (без общего кэша - всегда)
+    """
+    if not is_cache_shared():
+        return compute()
+    cache = get_cache()
+    digest = hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    key = f'books:facets:{get_version("books")}:{digest}'
+    data = cache.get(key)
+    if data is None:
+        data = compute()
+        cache.set(key, data, get_detail_cache_settings()['TIMEOUT'])
+    return data
+
+
+def get_book_detail(book_id, request, compute):
+    """
+    Получение данных экземпляра книги из кэша с ключом по версии книги.
+    compute - функция, вычисляющая данные при промахе.
+    Одновременные промахи объединяются: вычисляет только получивший блокировку запрос,
+    остальные в течение STALE_WHILE_REVALIDATE отдают устаревшие данные,
+    либо ждут результата до WAIT_TIMEOUT секунд. Без общего кэша (is_cache_shared) данные не кэшируются
+    """
+    if not is_cache_shared():
+        return compute()
+    conf = get_detail_cache_settings()
+    cache = get_cache()
+    base = hashlib.md5(request.build_absolute_uri('/').encode()).hexdigest()
+    key = f'books:detail:{book_id}:{base}'
+    lock_key = f'{key}:lock'
+
+    version = get_version('book', book_id)
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None:
+        entry_version, computed_at, data = entry
+        if entry_version == version and now - computed_at < conf['TIMEOUT']:
+            return data
+        stale_since = computed_at + conf['TIMEOUT'] if entry_version == version else version / 1e9
+        stale_data = data if now - stale_since <= conf['STALE_WHILE_REVALIDATE'] else None
+    else:
+        stale_data = None
+
+    if not cache.add(lock_key, 1, conf['LOCK_TIMEOUT']):
+        if stale_data is not None:
+            return stale_data
+        deadline = time.monotonic() + conf['WAIT_TIMEOUT']
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None and entry[0] == version:
+                return entry[2]
+        return compute()
+
+    try:
+        data = compute()
+        cache.set(key, (version, time.time(), data), conf['TIMEOUT'] + conf['STALE_WHILE_REVALIDATE'])
+        return data
+    finally:
+        cache.delete(lock_key)
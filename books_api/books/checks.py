@@ -0,0 +1,30 @@
+from django.core import checks
+
+from books.authentication import get_auth_cache_settings
+from books.cache import is_cache_shared
+
+
+@checks.register()
+def cache_shared_check(app_configs, **kwargs):
+    """Предупреждение об отключённом кэшировании по версиям при кэше в памяти процесса"""
+    if is_cache_shared():
+        return []
+    return [checks.Warning(
+        'Кэш версий (BOOKS_DETAIL_CACHE["CACHE"]) хранится в памяти процесса, '
+        'поэтому кэширование экземпляров и фасетов книг отключено',
+        hint='Укажите общий кэш (Memcached, Redis) в CACHES или BOOKS_DETAIL_CACHE["SINGLE_PROCESS"] = True, '
+             'если проект запущен одним процессом',
+        id='books.W001',
+    )]
+
+
+@checks.register()
+def auth_cache_check(app_configs, **kwargs):
+    """Кэш учётных данных без общего кэша версий не инвалидируется в других процессах"""
+    if not get_auth_cache_settings()['ENABLED'] or is_cache_shared():
+        return []
+    return [checks.Error(
+        'BOOKS_AUTH_CACHE["ENABLED"] требует общего кэша версий (BOOKS_DETAIL_CACHE["CACHE"])',
+        hint='Укажите общий кэш (Memcached, Redis) в CACHES или выключите BOOKS_AUTH_CACHE',
+        id='books.E001',
+    )]
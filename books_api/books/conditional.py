@@ -0,0 +1,61 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from books.cache import get_version, is_cache_shared
+
+
+class NotModified(Exception):
+    """Ответ на условный запрос готов до выполнения действия (304 или 412)"""
+
+    def __init__(self, response):
+        self.response = response
+
+
+class ConditionalGetMixin:
+    """
+    Примесь для ViewSet: условные GET-запросы (If-None-Match, If-Modified-Since) по версиям из books.cache.
+    Представление возвращает в get_version_keys ключи версий, от которых зависит ответ действия
+    (например, [('authors',)] для списка или [('author', pk)] для экземпляра), либо None.
+    ETag строится из версий, URL запроса и выбранного формата ответа, Last-Modified - из последней версии
+    (время последней инвалидации, а если версии в кэше не было - время её создания, т.е. не раньше изменения данных).
+    Совпадающий запрос получает 304 сразу после проверки прав, без запросов к базе и сериализации.
+    Версии должны быть общими для всех процессов (is_cache_shared), иначе процесс, не получивший инвалидацию,
+    ответил бы 304 на изменённые данные, а ETag различались бы между процессами, поэтому без общего кэша
+    валидаторы не выдаются
+    """
+    conditional_validators = None
+
+    def get_version_keys(self):
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.conditional_validators = None
+        if request.method not in ('GET', 'HEAD') or not is_cache_shared():
+            return
+        keys = self.get_version_keys()
+        if not keys:
+            return
+        versions = [get_version(*key) for key in keys]
+        fingerprint = '|'.join([*map(str, versions), request.build_absolute_uri(), request.accepted_media_type])
+        etag = f'"{hashlib.md5(fingerprint.encode()).hexdigest()}"'
+        last_modified = max(versions) // 10 ** 9
+        self.conditional_validators = (etag, last_modified)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.conditional_validators and response.status_code in (200, 304):
+            etag, last_modified = self.conditional_validators
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
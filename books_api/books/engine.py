@@ -0,0 +1,607 @@
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+from heapq import merge
+from itertools import islice
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: блокировка только между потоками процесса
+    fcntl = None
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+from books.models import BookCatalog
+
+
+DEFAULT_CATALOG_ENGINE_SETTINGS = {
+    'ENABLED': False,
+    'PATH': None,
+    'COMPACT_ROWS': 1000,
+}
+
+MAGIC = b'BKCATENG'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<8sIQ')
+
+# Поля упорядочивания и их позиции в строке снимка
+# (pk, author_id, created_at, rating, likes, категории, библиотеки)
+KEYS = {'created_at': 2, 'rating': 3, 'likes': 4}
+NULL = -2 ** 63
+
+# Множества строк для фильтров и фасетов: категории, автор, библиотеки (связь наличия в любой библиотеке)
+# и целая часть рейтинга
+SETS = ('categories', 'author', 'libraries', 'rating')
+
+# Фасеты с большим количеством значений считаются по подходящим строкам, а не пересечением с каждым множеством
+FACET_MASKS_LIMIT = 256
+
+# Если фильтру соответствует не больше SORT_LIMIT строк, их позиции сортируются,
+# иначе порядок сортировки просматривается до заполнения страницы
+SORT_LIMIT = 2048
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_catalog_engine_settings():
+    return {**DEFAULT_CATALOG_ENGINE_SETTINGS, **getattr(settings, 'BOOKS_CATALOG_ENGINE', {})}
+
+
+def get_catalog_engine():
+    """
+    Движок каталога для файла снимка из BOOKS_CATALOG_ENGINE['PATH']
+    (по умолчанию - во временной директории с именем по базе данных), один на процесс
+    """
+    conf = get_catalog_engine_settings()
+    path = conf['PATH']
+    if not path:
+        name = hashlib.md5(str(connection.settings_dict['NAME']).encode()).hexdigest()[:12]
+        path = os.path.join(tempfile.gettempdir(), f'books-catalog-{name}.bin')
+    with _engines_lock:
+        if path not in _engines:
+            _engines[path] = CatalogEngine(path, conf['COMPACT_ROWS'])
+        return _engines[path]
+
+
+def catalog_changed(book_ids):
+    """Обновление снимка каталога для книг с переданными id после фиксации транзакции"""
+    if not get_catalog_engine_settings()['ENABLED']:
+        return
+    book_ids = set(book_ids)
+    if book_ids:
+        engine = get_catalog_engine()
+        transaction.on_commit(lambda: engine.update(book_ids))
+
+
+def to_key(field, value):
+    """Значение поля упорядочивания в виде целого числа снимка (None - NULL)"""
+    if value is None:
+        return None
+    if field == 'created_at':
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return (value - EPOCH) // datetime.timedelta(microseconds=1)
+    if field == 'rating':
+        return int(Decimal(str(value)) * 100)
+    return int(value)
+
+
+def sort_key(value, pk, descending):
+    """Ключ строки в порядке пагинации: NULL всегда в конце, при равенстве значений - по pk"""
+    if value is None:
+        return True, 0, -pk if descending else pk
+    return False, -value if descending else value, -pk if descending else pk
+
+
+def row_set_values(name, row):
+    """Значения множеств SETS для строки снимка"""
+    if name == 'categories':
+        return row[5]
+    if name == 'libraries':
+        return row[6]
+    if name == 'author':
+        return row[1],
+    return None if row[3] is None else row[3] // 100,
+
+
+def parse_set_value(value):
+    return None if value == 'None' else int(value)
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def iter_bits(mask, size):
+    """Номера установленных битов маски по возрастанию"""
+    data = mask.to_bytes((size + 63) // 64 * 8, 'little')
+    for index, word in enumerate(array('Q', data) if size else ()):
+        while word:
+            low = word & -word
+            yield index * 64 + low.bit_length() - 1
+            word ^= low
+
+
+def bitmap(indexes, size):
+    data = bytearray((size + 7) // 8)
+    for index in indexes:
+        data[index >> 3] |= 1 << (index & 7)
+    return bytes(data)
+
+
+def load_rows(book_ids=None):
+    """Строки снимка из каталога (книги в наличии), упорядоченные по pk; book_ids - только эти книги"""
+    catalog = BookCatalog.objects.filter(available=True)
+    if book_ids is not None:
+        catalog = catalog.filter(pk__in=book_ids)
+    return [
+        (pk, author_id, to_key('created_at', created_at), to_key('rating', rating), likes,
+         tuple(sorted(category_ids)), tuple(sorted(library_ids)))
+        for pk, author_id, created_at, rating, likes, category_ids, library_ids in catalog.order_by('pk').values_list(
+            'pk', 'author_id', 'created_at', 'rating', 'likes', 'category_ids', 'library_ids').iterator()
+    ]
+
+
+def write_snapshot(path, rows):
+    """
+    Запись снимка (строки упорядочены по pk) в файл: заголовок JSON и массивы, выровненные по 8 байт.
+    Файл заменяется целиком (os.replace), поэтому процессы, открывшие прежний снимок, продолжают его читать
+    """
+    size = len(rows)
+    blobs, arrays, sets = [], {}, {}
+    offset = 0
+
+    def add(data):
+        nonlocal offset
+        data = bytes(data)
+        start = offset
+        blobs.append(data + b'\0' * (-len(data) % 8))
+        offset += len(blobs[-1])
+        return start
+
+    def add_array(name, typecode, values):
+        values = array(typecode, values)
+        arrays[name] = [add(values.tobytes()), typecode, len(values)]
+
+    add_array('pk', 'q', (row[0] for row in rows))
+    nulls = {}
+    for key, position in KEYS.items():
+        values = [row[position] for row in rows]
+        add_array(key, 'q', (NULL if value is None else value for value in values))
+        order = sorted(range(size), key=lambda i: sort_key(values[i], rows[i][0], True))
+        rank = array('i', bytes(4 * size))
+        for index, row in enumerate(order):
+            rank[row] = index
+        add_array(f'order_{key}', 'i', order)
+        add_array(f'rank_{key}', 'i', rank)
+        nulls[key] = values.count(None)
+    add_array('author', 'q', (row[1] for row in rows))
+    for name, position in (('categories', 5), ('libraries', 6)):
+        offsets = [0]
+        for row in rows:
+            offsets.append(offsets[-1] + len(row[position]))
+        add_array(f'{name}_offsets', 'i', offsets)
+        add_array(f'{name}_values', 'q', (value for row in rows for value in row[position]))
+    for name in SETS:
+        members = defaultdict(list)
+        for index, row in enumerate(rows):
+            for value in row_set_values(name, row):
+                members[value].append(index)
+        sets[name] = {}
+        for value, indexes in members.items():
+            # плотные множества хранятся битовой картой, редкие - списком номеров строк
+            if len(indexes) * 32 >= size:
+                sets[name][str(value)] = ['b', add(bitmap(indexes, size)), (size + 7) // 8]
+            else:
+                sets[name][str(value)] = ['l', add(array('i', indexes).tobytes()), len(indexes)]
+
+    header = json.dumps({
+        'generation': time.time_ns(), 'rows': size, 'nulls': nulls, 'arrays': arrays, 'sets': sets,
+    }).encode()
+    header += b' ' * (-(HEADER.size + len(header)) % 8)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(header)))
+        file.write(header)
+        for blob in blobs:
+            file.write(blob)
+    os.replace(tmp_path, path)
+
+
+class CatalogSnapshot:
+    """Снимок каталога в файле, отображённом в память (mmap): массивы читаются без копирования"""
+
+    def __init__(self, file):
+        self.stat = stat_key(os.fstat(file.fileno()))
+        self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, length = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Неизвестный формат снимка каталога')
+        header = json.loads(self.mmap[HEADER.size:HEADER.size + length])
+        self.base = HEADER.size + length
+        self.view = memoryview(self.mmap)
+        self.generation = header['generation']
+        self.size = header['rows']
+        self.nulls = header['nulls']
+        self.sets = header['sets']
+        self.arrays = {name: self.slice(offset, typecode, length)
+                       for name, (offset, typecode, length) in header['arrays'].items()}
+        self.pks = self.arrays['pk']
+        self.masks = {}
+
+    def slice(self, offset, typecode, length):
+        itemsize = array(typecode).itemsize
+        start = self.base + offset
+        return self.view[start:start + length * itemsize].cast(typecode)
+
+    def mask(self, name, value):
+        """Множество строк со значением value (категории, автора, библиотеки, рейтинга) в виде битовой маски"""
+        key = (name, value)
+        if key not in self.masks:
+            entry = self.sets[name].get(str(value))
+            if entry is None:
+                mask = 0
+            elif entry[0] == 'b':
+                mask = int.from_bytes(self.slice(entry[1], 'B', entry[2]), 'little')
+            else:
+                mask = int.from_bytes(bitmap(self.slice(entry[1], 'i', entry[2]), self.size), 'little')
+            self.masks[key] = mask
+        return self.masks[key]
+
+    def find(self, pk):
+        index = bisect(self.pks, pk)
+        if index < self.size and self.pks[index] == pk:
+            return index
+        return None
+
+    def value(self, key, index):
+        value = self.arrays[key][index]
+        return None if value == NULL else value
+
+    def row_key(self, key, descending, index):
+        return sort_key(self.value(key, index), self.pks[index], descending)
+
+    def row_at(self, key, descending, position):
+        """Номер строки на позиции position в порядке пагинации (хранится только порядок по убыванию)"""
+        order = self.arrays[f'order_{key}']
+        if descending:
+            return order[position]
+        filled = self.size - self.nulls[key]
+        if position < filled:
+            return order[filled - 1 - position]
+        return order[self.size - 1 - (position - filled)]
+
+    def position_of(self, key, descending, index):
+        rank = self.arrays[f'rank_{key}'][index]
+        if descending:
+            return rank
+        filled = self.size - self.nulls[key]
+        return filled - 1 - rank if rank < filled else filled + self.size - 1 - rank
+
+    def bound(self, key, descending, target, upper):
+        """Первая позиция с ключом больше (upper) или не меньше target в порядке пагинации"""
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            row_key = self.row_key(key, descending, self.row_at(key, descending, middle))
+            if row_key < target or (upper and row_key == target):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def related(self, name, index):
+        offsets = self.arrays[f'{name}_offsets']
+        return tuple(self.arrays[f'{name}_values'][offsets[index]:offsets[index + 1]])
+
+    def row(self, index):
+        return (
+            self.pks[index], self.arrays['author'][index], self.value('created_at', index),
+            self.value('rating', index), self.value('likes', index),
+            self.related('categories', index), self.related('libraries', index),
+        )
+
+    def rows(self):
+        """Строки снимка в исходном виде (для слияния с дельтой)"""
+        return (self.row(index) for index in range(self.size))
+
+
+def bisect(values, value):
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def stat_key(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class CatalogState:
+    """
+    Снимок с дельтой: изменённые после построения снимка книги (pk -> строка, None - книги нет в списке)
+    исключаются из снимка маской и просматриваются отдельно
+    """
+
+    def __init__(self, snapshot, delta):
+        self.snapshot = snapshot
+        self.delta = delta
+        self.delta_rows = [row for row in delta.values() if row is not None]
+        alive = bytearray(b'\xff' * ((snapshot.size + 7) // 8))
+        if snapshot.size % 8:
+            alive[-1] = (1 << snapshot.size % 8) - 1
+        for pk in delta:
+            index = snapshot.find(pk)
+            if index is not None:
+                alive[index >> 3] &= ~(1 << (index & 7))
+        self.alive = int.from_bytes(alive, 'little')
+
+    def match(self, filters):
+        """Маска строк снимка и строки дельты, подходящие под фильтры"""
+        snapshot, mask = self.snapshot, self.alive
+        rows = self.delta_rows
+        if filters.get('categories'):
+            union = 0
+            for category in filters['categories']:
+                union |= snapshot.mask('categories', category)
+            mask &= union
+            categories = set(filters['categories'])
+            rows = [row for row in rows if categories.intersection(row[5])]
+        if filters.get('author') is not None:
+            mask &= snapshot.mask('author', filters['author'])
+            rows = [row for row in rows if row[1] == filters['author']]
+        if filters.get('library') is not None:
+            mask &= snapshot.mask('libraries', filters['library'])
+            rows = [row for row in rows if filters['library'] in row[6]]
+        return mask, rows
+
+    def iter_positions(self, mask, count, key, descending, start, backward):
+        """Номера строк снимка из маски в порядке пагинации, начиная с позиции start (назад - до неё)"""
+        snapshot = self.snapshot
+        if count <= SORT_LIMIT:
+            positions = sorted(snapshot.position_of(key, descending, index)
+                               for index in iter_bits(mask, snapshot.size))
+            split = bisect(positions, start)
+            positions = reversed(positions[:split]) if backward else positions[split:]
+            for position in positions:
+                yield snapshot.row_at(key, descending, position)
+            return
+        bits = mask.to_bytes((snapshot.size + 7) // 8, 'little')
+        for position in (range(start - 1, -1, -1) if backward else range(start, snapshot.size)):
+            index = snapshot.row_at(key, descending, position)
+            if bits[index >> 3] >> (index & 7) & 1:
+                yield index
+
+    def iter_keys(self, filters, key, descending, after=None, backward=False):
+        """
+        (ключ, pk) подходящих книг в порядке пагинации, after - ключ позиции курсора,
+        после которого (или, при backward, до которого) начинается выборка
+        """
+        snapshot = self.snapshot
+        mask, rows = self.match(filters)
+        if after is None:
+            start = snapshot.size if backward else 0
+        else:
+            start = snapshot.bound(key, descending, after, upper=not backward)
+        position = KEYS[key]
+        delta = sorted(((sort_key(row[position], row[0], descending), row[0]) for row in rows), reverse=backward)
+        if after is not None:
+            delta = [item for item in delta if (item[0] < after if backward else item[0] > after)]
+        base = ((snapshot.row_key(key, descending, index), snapshot.pks[index])
+                for index in self.iter_positions(mask, popcount(mask), key, descending, start, backward))
+        return merge(base, delta, reverse=backward)
+
+    def count(self, filters):
+        mask, rows = self.match(filters)
+        return popcount(mask) + len(rows)
+
+    def facets(self, filters):
+        """
+        Количество подходящих книг по значениям множеств: (фасет, значение, количество) для books.services.build_facets.
+        Для фасетов с небольшим количеством значений - пересечение маски фильтров с каждым множеством,
+        иначе подсчёт по подходящим строкам
+        """
+        snapshot = self.snapshot
+        mask, rows = self.match(filters)
+        yield 'count', None, popcount(mask) + len(rows)
+        matched = None
+        for facet, name in (('categories', 'categories'), ('authors', 'author'), ('libraries', 'libraries'),
+                            ('rating', 'rating')):
+            counts = defaultdict(int)
+            if len(snapshot.sets[name]) <= FACET_MASKS_LIMIT:
+                for value in map(parse_set_value, snapshot.sets[name]):
+                    counts[value] = popcount(mask & snapshot.mask(name, value))
+            else:
+                if matched is None:
+                    matched = [snapshot.row(index) for index in iter_bits(mask, snapshot.size)]
+                for row in matched:
+                    for value in row_set_values(name, row):
+                        counts[value] += 1
+            for row in rows:
+                for value in row_set_values(name, row):
+                    counts[value] += 1
+            for value, count in counts.items():
+                if count:
+                    yield facet, value, count
+
+    def page(self, filters, key, descending, offset, limit):
+        """pk книг страницы при упорядочивании по key"""
+        return [pk for _, pk in islice(self.iter_keys(filters, key, descending), offset, offset + limit)]
+
+    def after(self, filters, key, descending, value, pk, backward, limit):
+        """pk книг строго после позиции курсора (value, pk) или, при backward, строго до неё (ближние первыми)"""
+        target = sort_key(to_key(key, value), pk, descending)
+        return [pk for _, pk in islice(self.iter_keys(filters, key, descending, target, backward), limit)]
+
+
+class CatalogEngine:
+    """
+    Списки книг каталога по снимку в файле, общем для всех процессов (mmap):
+    номера строк по pk, столбцы created_at, rating и likes с порядками сортировки,
+    множества строк категорий, авторов и библиотек (битовые карты или списки номеров).
+    Изменения книг после фиксации транзакции записываются в небольшой файл дельты,
+    а при накоплении COMPACT_ROWS изменений снимок перестраивается слиянием с дельтой без запросов к базе.
+    Каждый процесс перечитывает файлы, когда их заменил другой процесс (проверка os.stat на запрос)
+    """
+
+    def __init__(self, path, compact_rows=DEFAULT_CATALOG_ENGINE_SETTINGS['COMPACT_ROWS']):
+        self.path = path
+        self.delta_path = path + '.delta'
+        self.compact_rows = compact_rows
+        self.lock = threading.Lock()
+        self.current = None
+
+    @contextmanager
+    def write_lock(self):
+        """Блокировка записи снимка между потоками и процессами"""
+        with self.lock, open(self.path + '.lock', 'a') as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def open_snapshot(self):
+        try:
+            with open(self.path, 'rb') as file:
+                return CatalogSnapshot(file)
+        except (OSError, ValueError):
+            return None
+
+    def read_delta(self, snapshot):
+        """Дельта текущего снимка (дельта другого поколения снимка не учитывается)"""
+        try:
+            with open(self.delta_path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if data.get('generation') != snapshot.generation:
+            return {}
+        return {int(pk): row and (*row[:5], tuple(row[5]), tuple(row[6])) for pk, row in data['rows'].items()}
+
+    def write_delta(self, snapshot, delta):
+        tmp_path = f'{self.delta_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'generation': snapshot.generation, 'rows': delta}, file)
+        os.replace(tmp_path, self.delta_path)
+
+    def remove_delta(self):
+        try:
+            os.remove(self.delta_path)
+        except FileNotFoundError:
+            pass
+
+    def build(self):
+        """Полное построение снимка по каталогу в базе"""
+        with self.write_lock():
+            write_snapshot(self.path, load_rows())
+            self.remove_delta()
+
+    def update(self, book_ids):
+        """Перечитывание книг с переданными id из базы в дельту (снимок ещё не построен - ничего не делается)"""
+        book_ids = set(book_ids)
+        if not book_ids or not os.path.exists(self.path):
+            return
+        rows = {row[0]: row for row in load_rows(book_ids)}
+        with self.write_lock():
+            snapshot = self.open_snapshot()
+            if snapshot is None:
+                return
+            delta = self.read_delta(snapshot)
+            for pk in book_ids:
+                if pk in rows or snapshot.find(pk) is not None:
+                    delta[pk] = rows.get(pk)
+                else:
+                    delta.pop(pk, None)
+            if len(delta) > self.compact_rows:
+                merged = [row for row in snapshot.rows() if row[0] not in delta]
+                merged.extend(row for row in delta.values() if row is not None)
+                merged.sort(key=lambda row: row[0])
+                write_snapshot(self.path, merged)
+                self.remove_delta()
+            else:
+                self.write_delta(snapshot, delta)
+
+    def state(self):
+        """Текущие снимок и дельта (при отсутствии снимка он строится)"""
+        try:
+            stats = stat_key(os.stat(self.path))
+        except FileNotFoundError:
+            self.build()
+            stats = None
+        try:
+            delta_stats = stat_key(os.stat(self.delta_path))
+        except FileNotFoundError:
+            delta_stats = None
+        current = self.current
+        if current is not None and current[0] == (stats, delta_stats):
+            return current[1]
+        snapshot = self.open_snapshot()
+        if snapshot is None:
+            # снимок другого формата (например, после обновления кода) строится заново
+            self.build()
+            snapshot = self.open_snapshot()
+        with self.lock:
+            if current is not None and current[1].snapshot.stat == snapshot.stat:
+                snapshot = current[1].snapshot
+            state = CatalogState(snapshot, self.read_delta(snapshot))
+            self.current = ((snapshot.stat, delta_stats), state)
+        return state
+
+
+class CatalogEngineResult:
+    """
+    Последовательность книг страницы для django Paginator: длина - количество подходящих книг,
+    срез - строки книг из fetch по pk страницы в порядке снимка
+    """
+
+    def __init__(self, state, filters, key, descending, fetch):
+        self.state = state
+        self.filters = filters
+        self.key = key
+        self.descending = descending
+        self.fetch = fetch
+
+    def __len__(self):
+        return self.state.count(self.filters)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop = item.start or 0, item.stop
+        return self.fetch(self.state.page(self.filters, self.key, self.descending, start, stop - start))
+
+
+def get_engine_filters(view, request):
+    """
+    Фильтры списка книг для снимка каталога или None, если запрос снимку не подходит
+    (поиск по названию или некорректные параметры фильтрации, которые обработает обычный путь)
+    """
+    if request.query_params.get(api_settings.SEARCH_PARAM):
+        return None
+    filterset = view.filterset_class(request.query_params, queryset=view.get_queryset(), request=request)
+    if not filterset.is_valid():
+        return None
+    return filterset.get_values()
@@ -0,0 +1,216 @@
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from books.models import Books, BookLibraryAvailable, format_author_name
+from books.processes import spawn_pool
+
+
+# Поля записи книги в выгрузке
+EXPORT_FIELDS = (
+    'id', 'title', 'description', 'author_id', 'author', 'categories', 'created_at', 'updated_at',
+    'rating', 'rating_count', 'likes', 'bookmarks', 'reading_now', 'available', 'libraries',
+)
+
+# Поля-списки, которые в CSV записываются как JSON
+CSV_JSON_FIELDS = ('categories', 'libraries')
+
+BOOK_COLUMNS = (
+    'pk', 'title', 'description', 'author_id', 'author__first_name', 'author__middle_name', 'author__last_name',
+    'created_at', 'updated_at', 'rating', 'rating_count', 'likes', 'bookmarks', 'reading_now',
+)
+
+EXTENSIONS = {'ndjson': 'ndjson', 'csv': 'csv'}
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+
+class ExportError(Exception):
+    """Выгрузку нельзя выполнить с переданными параметрами"""
+
+
+def open_output(path, compression):
+    """Текстовый поток для записи файла с выбранным сжатием (zstd - при установленном пакете zstandard)"""
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=6)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ExportError('Для сжатия zstd установите пакет zstandard')
+        writer = zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'), closefd=True)
+        return io.TextIOWrapper(writer, encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def shard_name(index, fmt, compression):
+    return f'catalog-{index:04d}.{EXTENSIONS[fmt]}{COMPRESSION_EXTENSIONS[compression]}'
+
+
+def get_shard_ranges(shards):
+    """
+    Разбиение книг на диапазоны id [id_from, id_to) с примерно равным количеством книг,
+    None - открытая граница. Границы берутся по позициям в упорядоченном по id списке (по запросу на границу)
+    """
+    ids = Books.objects.order_by('pk').values_list('pk', flat=True)
+    total = ids.count()
+    shards = max(min(shards, total), 1)
+    bounds = [None, *(ids[total * i // shards] for i in range(1, shards)), None]
+    return [(bounds[i], bounds[i + 1]) for i in range(shards)]
+
+
+def iter_book_chunks(id_from, id_to, chunk_size):
+    """
+    Записи книг диапазона пачками по chunk_size: книги читаются одним запросом через iterator
+    (в PostgreSQL - серверный курсор), категории и наличие в библиотеках - по запросу на пачку
+    """
+    books = Books.objects.order_by('pk')
+    if id_from is not None:
+        books = books.filter(pk__gte=id_from)
+    if id_to is not None:
+        books = books.filter(pk__lt=id_to)
+    chunk = []
+    for row in books.values_list(*BOOK_COLUMNS).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield build_records(chunk)
+            chunk = []
+    if chunk:
+        yield build_records(chunk)
+
+
+def build_records(rows):
+    ids = [row[0] for row in rows]
+    categories = defaultdict(list)
+    for book_id, title in Books.categories.through.objects.filter(books_id__in=ids).order_by(
+            'categories__title').values_list('books_id', 'categories__title'):
+        categories[book_id].append(title)
+    libraries = defaultdict(list)
+    for book_id, *values in BookLibraryAvailable.objects.filter(book_id__in=ids).order_by('library_id').values_list(
+            'book_id', 'library_id', 'library__title', 'available', 'copies', 'reserved'):
+        libraries[book_id].append(dict(zip(('library', 'title', 'available', 'copies', 'reserved'), values)))
+    records = []
+    for (pk, title, description, author_id, first_name, middle_name, last_name, created_at, updated_at,
+         rating, rating_count, likes, bookmarks, reading_now) in rows:
+        records.append({
+            'id': pk, 'title': title, 'description': description, 'author_id': author_id,
+            'author': format_author_name(first_name, middle_name, last_name),
+            'categories': categories[pk], 'created_at': created_at, 'updated_at': updated_at,
+            'rating': rating, 'rating_count': rating_count, 'likes': likes, 'bookmarks': bookmarks,
+            'reading_now': reading_now, 'available': any(entry['available'] for entry in libraries[pk]),
+            'libraries': libraries[pk],
+        })
+    return records
+
+
+def csv_value(encoder, field, value):
+    if field in CSV_JSON_FIELDS:
+        return encoder.encode(value)
+    if isinstance(value, datetime.datetime):
+        # даты в том же виде, что и в NDJSON
+        return encoder.default(value)
+    return value
+
+
+def write_records(output, fmt, chunks):
+    """Запись пачек записей в NDJSON или CSV, возвращает количество записей"""
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    rows = 0
+    if fmt == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(EXPORT_FIELDS)
+    for records in chunks:
+        for record in records:
+            if fmt == 'csv':
+                writer.writerow([csv_value(encoder, field, record[field]) for field in EXPORT_FIELDS])
+            else:
+                output.write(encoder.encode(record))
+                output.write('\n')
+        rows += len(records)
+    return rows
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_shard(shard):
+    """
+    Выгрузка одного диапазона книг в файл, возвращает описание файла для манифеста.
+    shard - словарь с index, id_from, id_to, directory, format, compression, chunk_size и snapshot
+    (снимок PostgreSQL, в котором читают все процессы, чтобы файлы были согласованы между собой)
+    """
+    path = os.path.join(shard['directory'], shard_name(shard['index'], shard['format'], shard['compression']))
+    with transaction.atomic():
+        if shard.get('snapshot'):
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                cursor.execute('SET TRANSACTION SNAPSHOT %s', [shard['snapshot']])
+        with open_output(path, shard['compression']) as output:
+            rows = write_records(output, shard['format'], iter_book_chunks(
+                shard['id_from'], shard['id_to'], shard['chunk_size']))
+    return {
+        'file': os.path.basename(path), 'id_from': shard['id_from'], 'id_to': shard['id_to'], 'rows': rows,
+        'bytes': os.path.getsize(path), 'sha256': file_sha256(path),
+    }
+
+
+def export_catalog(directory, fmt='ndjson', compression='gzip', workers=1, shards=None, chunk_size=2000):
+    """
+    Выгрузка каталога книг в файлы-шарды по диапазонам id и манифест manifest.json в directory.
+    Шарды выгружаются параллельно пулом из workers процессов (при workers=1 - в текущем процессе).
+    В PostgreSQL выгрузка идёт в одной транзакции REPEATABLE READ, а процессы пула читают её
+    экспортированный снимок (pg_export_snapshot), поэтому шарды согласованы между собой при любом workers.
+    При вызове внутри уже открытой транзакции уровень изоляции задаёт вызывающий код.
+    Память каждого процесса ограничена пачкой из chunk_size книг. Возвращает манифест
+    """
+    if fmt not in EXTENSIONS or compression not in COMPRESSION_EXTENSIONS:
+        raise ExportError(f'Неизвестный формат {fmt} или сжатие {compression}')
+    if compression == 'zstd':
+        open_output(os.devnull, compression).close()
+    os.makedirs(directory, exist_ok=True)
+    started_at = timezone.now()
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        snapshot = None
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                if outermost:
+                    # до первого запроса транзакции: диапазоны и все шарды читаются в одном снимке
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                if workers > 1:
+                    cursor.execute('SELECT pg_export_snapshot()')
+                    snapshot = cursor.fetchone()[0]
+        ranges = get_shard_ranges(shards or workers)
+        specs = [{
+            'index': index, 'id_from': id_from, 'id_to': id_to, 'directory': directory, 'format': fmt,
+            'compression': compression, 'chunk_size': chunk_size, 'snapshot': snapshot,
+        } for index, (id_from, id_to) in enumerate(ranges)]
+        if workers > 1:
+            with spawn_pool(workers) as pool:
+                files = list(pool.map(export_shard, specs))
+        else:
+            files = [export_shard(spec) for spec in specs]
+    manifest = {
+        'format': fmt, 'compression': compression, 'fields': EXPORT_FIELDS,
+        'started_at': started_at.isoformat(), 'finished_at': timezone.now().isoformat(),
+        'rows': sum(file['rows'] for file in files), 'shards': files,
+    }
+    # манифест появляется целиком и последним: по нему можно понять, что выгрузка завершена
+    path = os.path.join(directory, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+    return manifest
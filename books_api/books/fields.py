@@ -0,0 +1,37 @@
+from rest_framework import serializers
+
+
+# Значение для построения шаблона URL: только цифры, поэтому подходит к любому шаблону pk в маршрутах
+URL_TEMPLATE_SENTINEL = 9182736450918273
+
+
+class HyperlinkedIdentityField(serializers.HyperlinkedIdentityField):
+    """
+    HyperlinkedIdentityField, который вызывает reverse() и build_absolute_uri() один раз
+    на view_name и формат за запрос: полученный URL запоминается в запросе как шаблон,
+    а для каждой строки в него подставляется значение lookup_field (для целых значений).
+    Для остальных значений и без запроса в контексте URL строится как обычно
+    """
+
+    def get_url(self, obj, view_name, request, format):
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        return self.format_url(getattr(obj, self.lookup_field), view_name, request, format)
+
+    def format_url(self, value, view_name, request, format):
+        """URL экземпляра по значению lookup_field"""
+        if request is None or not isinstance(value, int) or isinstance(value, bool):
+            return self.reverse(view_name, kwargs={self.lookup_url_kwarg: value}, request=request, format=format)
+        templates = getattr(request, '_url_templates', None)
+        if templates is None:
+            templates = request._url_templates = {}
+        key = (view_name, self.lookup_url_kwarg, format)
+        template = templates.get(key)
+        if template is None:
+            url = self.reverse(view_name, kwargs={self.lookup_url_kwarg: URL_TEMPLATE_SENTINEL},
+                               request=request, format=format)
+            parts = url.split(str(URL_TEMPLATE_SENTINEL))
+            template = templates[key] = tuple(parts) if len(parts) == 2 else False
+        if template is False:
+            return self.reverse(view_name, kwargs={self.lookup_url_kwarg: value}, request=request, format=format)
+        return f'{template[0]}{value}{template[1]}'
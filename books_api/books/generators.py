@@ -0,0 +1,328 @@
+import csv
+import datetime
+import io
+import math
+import random
+from collections import Counter
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from books.models import (
+    Authors, Books, Categories,
+    Libraries, BookLibraryAvailable, User,
+    UserBookRelation, UserBookSession
+)
+from books.processes import spawn_pool
+
+
+# Таблицы с id, которые назначает генератор (на них ссылаются другие таблицы), в порядке загрузки
+ID_MODELS = {
+    'authors': Authors,
+    'categories': Categories,
+    'libraries': Libraries,
+    'users': User,
+    'books': Books,
+    'sessions': UserBookSession,
+}
+
+# Группы загрузки: группа генерирует строки нескольких таблиц для диапазона строк главной таблицы
+# (например, книги вместе с их категориями и наличием); группы одного этапа загружаются параллельно
+PHASES = (
+    ('authors', 'categories', 'libraries', 'users'),
+    ('books',),
+    ('relations', 'sessions'),
+)
+
+# Показатели закона Ципфа: популярность книг, плодовитость авторов, размер категорий и библиотек
+SKEW = {
+    'books': 1.1,
+    'authors': 1.0,
+    'categories': 1.2,
+    'libraries': 0.8,
+}
+
+DEFAULT_DATE = datetime.date(2021, 1, 1)
+
+FIRST_NAMES = ('Александр', 'Анна', 'Борис', 'Вера', 'Григорий', 'Дарья', 'Евгений', 'Елена', 'Иван', 'Ирина',
+               'Константин', 'Мария', 'Николай', 'Ольга', 'Павел', 'Светлана', 'Сергей', 'Татьяна', 'Фёдор', 'Юлия')
+MIDDLE_NAMES = ('Александрович', 'Борисович', 'Иванович', 'Михайлович', 'Николаевич', 'Петрович', 'Сергеевич')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков',
+              'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров', 'Павлов', 'Козлов')
+WORDS = ('тайна', 'дорога', 'город', 'море', 'время', 'память', 'север', 'огонь', 'сад', 'ветер', 'история',
+         'дом', 'путь', 'свет', 'тень', 'река', 'остров', 'письмо', 'зима', 'звезда', 'лес', 'мир', 'сон')
+RATE_WEIGHTS = (1, 2, 4, 6, 5)
+# множитель для перестановки мест популярности (простое число больше количества записей)
+PERMUTATION_PRIME = 2654435761
+NULL = r'\N'
+
+
+class GenerationError(Exception):
+    """Данные нельзя сгенерировать с переданными параметрами"""
+
+
+def get_counts(books, authors=None, categories=None, libraries=None, users=None, relations=None, sessions=None):
+    """Количество записей каждой таблицы: не переданные считаются по количеству книг"""
+    counts = {
+        'books': books,
+        'authors': authors if authors is not None else max(books // 20, 1),
+        'categories': categories if categories is not None else max(min(books // 200, 2000), 20),
+        'libraries': libraries if libraries is not None else max(min(books // 1000, 500), 5),
+        'users': users if users is not None else max(books // 2, 1),
+        'relations': relations if relations is not None else books * 10,
+    }
+    counts['sessions'] = sessions if sessions is not None else counts['users'] // 2
+    if any(value < 1 for key, value in counts.items() if key not in ('relations', 'sessions')):
+        raise GenerationError('Количество книг, авторов, категорий, библиотек и пользователей должно быть больше 0')
+    return counts
+
+
+class ZipfSampler:
+    """
+    Выбор индекса 0..n-1 с вероятностью, примерно пропорциональной 1 / (индекс + 1) ** exponent (закон Ципфа):
+    обратная функция распределения непрерывного степенного закона, без таблицы весов на каждую запись
+    """
+
+    def __init__(self, n, exponent):
+        self.n = n
+        self.exponent = exponent
+        self.total = math.log(n + 1) if exponent == 1 else ((n + 1) ** (1 - exponent) - 1) / (1 - exponent)
+
+    def sample(self, rng):
+        u = rng.random() * self.total
+        if self.exponent == 1:
+            x = math.exp(u)
+        else:
+            x = (1 + (1 - self.exponent) * u) ** (1 / (1 - self.exponent))
+        return min(max(int(x) - 1, 0), self.n - 1)
+
+
+def popular(spec, table, rng):
+    """
+    id записи таблицы с популярностью по закону Ципфа. Места популярности переставлены (rank * простое mod n),
+    чтобы популярные записи не были все подряд в начале таблицы
+    """
+    n = spec['counts'][table]
+    rank = ZipfSampler(n, SKEW[table]).sample(rng)
+    return spec['first_ids'][table] + rank * PERMUTATION_PRIME % n
+
+
+def distinct_popular(spec, table, rng, size):
+    """Не больше size разных id по популярности (с ограничением количества попыток для длинного хвоста)"""
+    ids = {}
+    for _ in range(size * 4):
+        ids.setdefault(popular(spec, table, rng), None)
+        if len(ids) == size:
+            break
+    return list(ids)
+
+
+def book_libraries(spec, book_id):
+    """
+    Библиотеки с книгой: определяются только seed и id книги, поэтому генераторы сессий получают
+    тот же результат, что и генератор наличия
+    """
+    rng = random.Random(f'{spec["seed"]}:libraries:{book_id}')
+    size = min(1 + int(rng.expovariate(0.7)), spec['counts']['libraries'])
+    return sorted(distinct_popular(spec, 'libraries', rng, size))
+
+
+def moment(spec, rng, days):
+    """Случайное время за days дней до опорной даты"""
+    base = datetime.datetime.combine(spec['date'], datetime.time(), tzinfo=datetime.timezone.utc)
+    return base - datetime.timedelta(seconds=rng.randrange(days * 86400))
+
+
+def generate_authors(spec, ids, rng):
+    for author_id in ids:
+        middle_name = rng.choice(MIDDLE_NAMES) if rng.random() < 0.6 else None
+        yield 'authors', (author_id, rng.choice(FIRST_NAMES), middle_name, f'{rng.choice(LAST_NAMES)}-{author_id}',
+                          None, moment(spec, rng, 3650))
+
+
+def generate_categories(spec, ids, rng):
+    for category_id in ids:
+        yield 'categories', (category_id, f'{rng.choice(WORDS).capitalize()} {category_id}', None,
+                             moment(spec, rng, 3650))
+
+
+def generate_libraries(spec, ids, rng):
+    for library_id in ids:
+        yield 'libraries', (library_id, f'Библиотека {library_id}', f'ул. {rng.choice(LAST_NAMES)}, '
+                            f'{rng.randint(1, 200)}', f'+7 495 {rng.randrange(10 ** 7):07d}', moment(spec, rng, 3650))
+
+
+def generate_users(spec, ids, rng):
+    for user_id in ids:
+        yield 'users', (user_id, '!', None, False, f'user{user_id}', rng.choice(FIRST_NAMES), '', '', False, True,
+                        moment(spec, rng, 1825))
+
+
+def generate_books(spec, ids, rng):
+    """Книги с автором по популярности авторов, категориями из длинного хвоста и наличием в библиотеках"""
+    for book_id in ids:
+        created_at = moment(spec, rng, 3650)
+        title = f'{rng.choice(WORDS).capitalize()} {" ".join(rng.sample(WORDS, 2))} {book_id}'
+        yield 'books', (book_id, title, ' '.join(rng.choices(WORDS, k=20)), popular(spec, 'authors', rng),
+                        created_at, created_at, None, 0, 0, 0, 0, 0)
+        for category_id in distinct_popular(spec, 'categories', rng, rng.randint(1, 3)):
+            yield 'book_categories', (book_id, category_id)
+        for library_id in book_libraries(spec, book_id):
+            yield 'available', (book_id, library_id, rng.random() < 0.9, rng.randint(1, 10), 0)
+
+
+def generate_relations(spec, ids, rng):
+    """
+    Отношения пользователей: количество у пользователя - по распределению Парето (немного активных читателей
+    с большим количеством отношений), книги - по популярности, оценки смещены к высоким
+    """
+    mean = spec['counts']['relations'] / spec['counts']['users']
+    limit = min(spec['counts']['books'], max(int(mean * 50), 1))
+    for user_id in ids:
+        # среднее распределения Парето с показателем 1.5 равно 3
+        size = min(max(round(rng.paretovariate(1.5) * mean / 3), 1), limit)
+        for book_id in distinct_popular(spec, 'books', rng, size):
+            rate = rng.choices(range(1, 6), RATE_WEIGHTS)[0] if rng.random() < 0.5 else None
+            yield 'relations', (book_id, user_id, rng.random() < 0.4, rng.random() < 0.2, rate)
+
+
+def generate_sessions(spec, ids, rng):
+    """
+    Сессии с книгами по популярности в библиотеке первой книги: давние сессии приняты и закрыты,
+    последние - ожидают обработки или активны
+    """
+    first_user, users = spec['first_ids']['users'], spec['counts']['users']
+    for session_id in ids:
+        books = distinct_popular(spec, 'books', rng, rng.randint(1, 3))
+        library_id = rng.choice(book_libraries(spec, books[0]))
+        books = [book_id for book_id in books if library_id in book_libraries(spec, book_id)]
+        created_at = moment(spec, rng, 730)
+        start_date = created_at.date() + datetime.timedelta(days=rng.randint(0, 7))
+        recent = (spec['date'] - start_date).days < 30
+        is_accepted = not recent or rng.random() < 0.5
+        is_closed = not recent and rng.random() < 0.95
+        yield 'sessions', (session_id, first_user + rng.randrange(users), library_id, start_date,
+                           start_date + datetime.timedelta(days=rng.randint(7, 30)), is_accepted, is_closed, '-',
+                           created_at, False)
+        for book_id in books:
+            yield 'session_books', (session_id, book_id)
+
+
+GROUPS = {
+    'authors': generate_authors,
+    'categories': generate_categories,
+    'libraries': generate_libraries,
+    'users': generate_users,
+    'books': generate_books,
+    'relations': generate_relations,
+    'sessions': generate_sessions,
+}
+
+# Таблицы, в которые пишут генераторы: модель и поля в порядке значений строки
+TABLES = {
+    'authors': (Authors, ('id', 'first_name', 'middle_name', 'last_name', 'description', 'updated_at')),
+    'categories': (Categories, ('id', 'title', 'description', 'updated_at')),
+    'libraries': (Libraries, ('id', 'title', 'location', 'phone', 'updated_at')),
+    'users': (User, ('id', 'password', 'last_login', 'is_superuser', 'username', 'first_name', 'last_name',
+                     'email', 'is_staff', 'is_active', 'date_joined')),
+    'books': (Books, ('id', 'title', 'description', 'author', 'created_at', 'updated_at', 'rating', 'rating_sum',
+                      'rating_count', 'likes', 'bookmarks', 'reading_now')),
+    'book_categories': (Books.categories.through, ('books', 'categories')),
+    'available': (BookLibraryAvailable, ('book', 'library', 'available', 'copies', 'reserved')),
+    'relations': (UserBookRelation, ('book', 'user', 'like', 'in_bookmarks', 'rate')),
+    'sessions': (UserBookSession, ('id', 'user', 'library', 'start_date', 'end_date', 'is_accepted', 'is_closed',
+                                   'message', 'created_at', 'holds_copies')),
+    'session_books': (UserBookSession.books.through, ('userbooksession', 'books')),
+}
+
+
+def generate_rows(spec, group, index):
+    """
+    Строки таблиц для пачки index группы: {таблица: [строки]}. Генератор пачки получает свой seed
+    (seed, группа, номер пачки), поэтому строки не зависят от количества процессов и порядка пачек
+    """
+    start = spec['first_ids'][group] if group in ID_MODELS else spec['first_ids']['users']
+    size = spec['counts'][group] if group in ID_MODELS else spec['counts']['users']
+    ids = range(start + index * spec['chunk_size'], start + min((index + 1) * spec['chunk_size'], size))
+    rng = random.Random(f'{spec["seed"]}:{group}:{index}')
+    tables = {}
+    for table, row in GROUPS[group](spec, ids, rng):
+        tables.setdefault(table, []).append(row)
+    return tables
+
+
+def copy_rows(cursor, table, rows):
+    """
+    Загрузка строк таблицы: в PostgreSQL - одной командой COPY из CSV в памяти, в остальных СУБД - executemany
+    """
+    model, names = TABLES[table]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in names)
+    if connection.vendor == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([NULL if value is None else value for value in row] for row in rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                           buffer)
+    else:
+        placeholders = ', '.join(['%s'] * len(names))
+        cursor.executemany(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+
+def load_chunk(task):
+    """Генерация и загрузка пачки группы в одной транзакции, возвращает количество строк по таблицам"""
+    spec, group, index = task
+    tables = generate_rows(spec, group, index)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # таблицы пачки загружаются в порядке TABLES: сначала записи, на которые ссылаются остальные
+        for table in TABLES:
+            if tables.get(table):
+                copy_rows(cursor, table, tables[table])
+    return Counter({table: len(rows) for table, rows in tables.items()})
+
+
+def get_spec(counts, seed, chunk_size=50000, date=DEFAULT_DATE):
+    """Параметры генерации: количество записей, seed, размер пачки, опорная дата и первые id таблиц"""
+    first_ids = {}
+    for table, model in ID_MODELS.items():
+        first_ids[table] = (model.objects.aggregate(value=Max('pk'))['value'] or 0) + 1
+    return {'counts': counts, 'seed': seed, 'chunk_size': chunk_size, 'date': date, 'first_ids': first_ids}
+
+
+def generate_data(counts, seed, workers=1, chunk_size=50000, date=DEFAULT_DATE, progress=None):
+    """
+    Генерация синтетических данных: авторы, категории, библиотеки, пользователи, книги с категориями
+    и наличием, отношения и сессии с книгами. Популярность книг, авторов, категорий и библиотек
+    распределена по закону Ципфа. Данные определяются seed, количеством записей и опорной датой
+    (при пустой базе совпадают и id). Пачки загружаются параллельно пулом из workers процессов
+    этапами PHASES: каждый этап ссылается только на таблицы предыдущих этапов.
+    После загрузки последовательности id сдвигаются за новые записи. Счётчики книг, каталог, поисковые
+    векторы и рейтинговые таблицы не заполняются (команды recount_book_counters, refresh_catalog и др.).
+    progress(группа, строки по таблицам) вызывается после каждого этапа. Возвращает строки по таблицам
+    """
+    spec = get_spec(counts, seed, chunk_size, date)
+    totals = Counter()
+    pool = None
+    if workers > 1:
+        pool = spawn_pool(workers)
+    try:
+        for phase in PHASES:
+            tasks = [(spec, group, index) for group in phase if counts[group]
+                     for index in range(math.ceil((counts[group] if group in ID_MODELS else counts['users'])
+                                                  / chunk_size))]
+            results = pool.map(load_chunk, tasks) if pool else map(load_chunk, tasks)
+            phase_totals = sum(results, Counter())
+            totals.update(phase_totals)
+            if progress:
+                progress(phase, phase_totals)
+    finally:
+        if pool:
+            pool.shutdown()
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [
+                *ID_MODELS.values(), *(TABLES[table][0] for table in ('book_categories', 'available', 'relations',
+                                                                       'session_books'))]):
+            cursor.execute(sql)
+    return dict(totals)
+
@@ -0,0 +1,191 @@
+import codecs
+import csv
+import json
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+
+from books.models import Books, Libraries, BookLibraryAvailable
+from books.services import books_changed
+
+
+# Количество строк, которые проверяются и записываются вместе (одна транзакция и по одному запросу на шаг)
+CHUNK_SIZE = 1000
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'да'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', 'нет'}
+
+
+def iter_lines(stream, encoding='utf-8'):
+    """
+    Построчное чтение потока (например, тела запроса) без загрузки его в память целиком.
+    Недекодируемые байты заменяются, и такие строки попадают в отчёт как ошибочные
+    """
+    return codecs.iterdecode(iter(stream.readline, b''), encoding, errors='replace')
+
+
+def read_csv(lines):
+    """Строки CSV с заголовком (book,library,available[,copies]): (номер строки, словарь, ошибка)"""
+    reader = csv.DictReader(lines)
+    try:
+        for row in reader:
+            yield reader.line_num, row, None
+    except csv.Error as error:
+        yield reader.line_num, None, f'Некорректный CSV: {error}.'
+
+
+def read_ndjson(lines):
+    """Строки NDJSON (по объекту JSON в строке): (номер строки, словарь, ошибка)"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, 'Некорректный JSON.'
+            continue
+        if isinstance(row, dict):
+            yield number, row, None
+        else:
+            yield number, None, 'Ожидается объект JSON.'
+
+
+READERS = {
+    'text/csv': read_csv,
+    'application/x-ndjson': read_ndjson,
+    'application/ndjson': read_ndjson,
+    'application/jsonl': read_ndjson,
+}
+
+
+def parse_id(value):
+    if isinstance(value, bool):
+        raise ValueError
+    return int(value)
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError
+
+
+def parse_row(row):
+    """Приведение значений строки к типам полей, возвращает (значения, ошибки по полям)"""
+    values, errors = {}, {}
+    for field in ('book', 'library'):
+        try:
+            values[field] = parse_id(row.get(field))
+        except (TypeError, ValueError):
+            errors[field] = ['Ожидается id.']
+    try:
+        values['available'] = parse_bool(row.get('available'))
+    except ValueError:
+        errors['available'] = ['Ожидается true или false.']
+    if row.get('copies') not in (None, ''):
+        try:
+            values['copies'] = parse_id(row['copies'])
+            if values['copies'] < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            errors['copies'] = ['Ожидается неотрицательное целое число.']
+    return values, errors
+
+
+class AvailabilityImport:
+    """
+    Импорт наличия книг в библиотеках из потока строк (book, library, available[, copies]).
+    Строки читаются по мере поступления и применяются частями по CHUNK_SIZE:
+    для части один запрос проверки книг, один - библиотек, один - существующих записей (с блокировкой),
+    затем bulk_create новых и bulk_update изменённых записей в одной транзакции.
+    Ошибочные строки попадают в отчёт и не мешают остальным, для повторяющейся пары книги и библиотеки
+    применяется последняя строка
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.report = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'errors': []}
+
+    def run(self, rows):
+        """rows - (номер строки, словарь, ошибка) из read_csv или read_ndjson, возвращает отчёт"""
+        parsed = self.parse(rows)
+        for chunk in iter(lambda: list(islice(parsed, self.chunk_size)), []):
+            self.apply(chunk)
+        return self.report
+
+    def error(self, line, errors):
+        self.report['errors'].append({'line': line, 'errors': errors})
+
+    def parse(self, rows):
+        for line, row, error in rows:
+            self.report['rows'] += 1
+            if error:
+                self.error(line, {'non_field_errors': [error]})
+                continue
+            values, errors = parse_row(row)
+            if errors:
+                self.error(line, errors)
+                continue
+            yield line, values
+
+    def apply(self, chunk):
+        book_ids = {values['book'] for _, values in chunk}
+        library_ids = {values['library'] for _, values in chunk}
+        books = set(Books.objects.filter(pk__in=book_ids).order_by().values_list('pk', flat=True))
+        libraries = set(Libraries.objects.filter(pk__in=library_ids).order_by().values_list('pk', flat=True))
+        rows = {}
+        for line, values in chunk:
+            errors = {}
+            if values['book'] not in books:
+                errors['book'] = ['Книга не найдена.']
+            if values['library'] not in libraries:
+                errors['library'] = ['Библиотека не найдена.']
+            if errors:
+                self.error(line, errors)
+            else:
+                rows[values['book'], values['library']] = line, values
+        if not rows:
+            return
+        try:
+            with transaction.atomic():
+                created, updated, unchanged, errors = self.save(rows)
+        except IntegrityError:
+            # пару книги и библиотеки одновременно создал другой запрос, часть можно отправить повторно
+            for line, _ in rows.values():
+                self.error(line, {'non_field_errors': ['Запись изменена одновременно другим запросом.']})
+            return
+        self.report['errors'].extend(errors)
+        self.report['created'] += created
+        self.report['updated'] += updated
+        self.report['unchanged'] += unchanged
+
+    def save(self, rows):
+        existing = BookLibraryAvailable.objects.select_for_update().order_by().filter(
+            book_id__in={book_id for book_id, _ in rows}, library_id__in={library_id for _, library_id in rows})
+        existing = {(entry.book_id, entry.library_id): entry for entry in existing}
+        to_create, to_update, unchanged, errors = [], [], 0, []
+        for key, (line, values) in rows.items():
+            entry = existing.get(key)
+            if entry is None:
+                to_create.append(BookLibraryAvailable(book_id=values['book'], library_id=values['library'],
+                                                      available=values['available'], copies=values.get('copies', 1)))
+                continue
+            copies = values.get('copies', entry.copies)
+            if copies < entry.reserved:
+                message = f'Зарезервировано {entry.reserved} экземпляров.'
+                errors.append({'line': line, 'errors': {'copies': [message]}})
+            elif (entry.available, entry.copies) == (values['available'], copies):
+                unchanged += 1
+            else:
+                entry.available, entry.copies = values['available'], copies
+                to_update.append(entry)
+        BookLibraryAvailable.objects.bulk_create(to_create)
+        BookLibraryAvailable.objects.bulk_update(to_update, ['available', 'copies'])
+        # bulk-операции не отправляют сигналы, поэтому каталог и кэш книг обновляются здесь
+        books_changed({entry.book_id for entry in [*to_create, *to_update]})
+        return len(to_create), len(to_update), unchanged, errors
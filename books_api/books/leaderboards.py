@@ -0,0 +1,215 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q, Value
+from django.db.models.functions import Cast
+
+from books.cache import bump_versions
+from books.models import (
+    Books, BookLibraryAvailable, Categories, Libraries, Leaderboard, LeaderboardEntry, LeaderboardQueue
+)
+
+
+DEFAULT_LEADERBOARDS_SETTINGS = {
+    'ENABLED': True,
+    'SIZE': 100,
+    'PRIOR_VOTES': 10,
+    'PRIOR_MEAN': 3,
+    'BATCH_SIZE': 1000,
+    'FLUSH_INTERVAL': 5,
+}
+
+METRICS = ('rating', 'likes')
+
+BOOK_VALUES = ('pk', 'rating_sum', 'rating_count', 'likes')
+
+
+def get_leaderboards_settings():
+    return {**DEFAULT_LEADERBOARDS_SETTINGS, **getattr(settings, 'BOOKS_LEADERBOARDS', {})}
+
+
+def get_score(metric, rating_sum, rating_count, likes):
+    """
+    Значение показателя книги или None, если книга в таблицу не попадает (нет оценок или лайков).
+    Байесовское среднее - средняя оценка с PRIOR_VOTES добавленными оценками PRIOR_MEAN:
+    у книги с одной оценкой 5 оно ближе к PRIOR_MEAN, чем у книги с сотнями оценок 4.9.
+    Априорные значения заданы в настройках, а не берутся из текущих данных, поэтому показатель книги
+    зависит только от её счётчиков и таблицы можно обновлять по изменившимся книгам
+    """
+    if metric == 'likes':
+        return float(likes) if likes else None
+    if not rating_count:
+        return None
+    conf = get_leaderboards_settings()
+    return (conf['PRIOR_VOTES'] * conf['PRIOR_MEAN'] + rating_sum) / (conf['PRIOR_VOTES'] + rating_count)
+
+
+def score_expression(metric):
+    """get_score в виде выражения SQL для выбора лучших книг запросом"""
+    if metric == 'likes':
+        return Cast(F('likes'), FloatField())
+    conf = get_leaderboards_settings()
+    prior = Value(float(conf['PRIOR_VOTES'] * conf['PRIOR_MEAN']))
+    return ExpressionWrapper((prior + F('rating_sum')) / (Value(float(conf['PRIOR_VOTES'])) + F('rating_count')),
+                             output_field=FloatField())
+
+
+def rank_key(item):
+    book_id, score = item
+    return -score, book_id
+
+
+def scope_books(scope, scope_id):
+    """Книги области таблицы: все, книги категории или книги в наличии в библиотеке"""
+    if scope == 'category':
+        return Books.objects.filter(categories=scope_id)
+    if scope == 'library':
+        return Books.objects.filter(lib_available__library=scope_id, lib_available__available=True)
+    return Books.objects.all()
+
+
+def top_books(scope, scope_id, metric, size):
+    """Лучшие size книг области одним запросом: [(id книги, значение показателя), ...] по местам"""
+    books = scope_books(scope, scope_id).filter(**{'likes__gt' if metric == 'likes' else 'rating_count__gt': 0})
+    books = books.annotate(score=score_expression(metric)).order_by('-score', 'pk')
+    items = [(values[0], get_score(metric, *values[1:])) for values in books.values_list(*BOOK_VALUES)[:size]]
+    return sorted(items, key=rank_key)
+
+
+def save_board(board, items):
+    LeaderboardEntry.objects.filter(leaderboard=board).delete()
+    LeaderboardEntry.objects.bulk_create([
+        LeaderboardEntry(leaderboard=board, rank=rank, book_id=book_id, score=score)
+        for rank, (book_id, score) in enumerate(items, 1)
+    ])
+    board.size = len(items)
+    board.save(update_fields=['size', 'updated_at'])
+
+
+def rebuild_leaderboards():
+    """
+    Функция для полного построения рейтинговых таблиц: всех книг, каждой категории и каждой библиотеки
+    по каждому показателю (по запросу на таблицу). Возвращает количество таблиц
+    """
+    size = get_leaderboards_settings()['SIZE']
+    scopes = [('all', 0), *(('category', pk) for pk in Categories.objects.values_list('pk', flat=True)),
+              *(('library', pk) for pk in Libraries.objects.values_list('pk', flat=True))]
+    with transaction.atomic():
+        stale = Leaderboard.objects.all()
+        for scope, scope_id in scopes:
+            stale = stale.exclude(scope=scope, scope_id=scope_id)
+            for metric in METRICS:
+                board, _ = Leaderboard.objects.get_or_create(scope=scope, scope_id=scope_id, metric=metric)
+                save_board(board, top_books(scope, scope_id, metric, size))
+        # таблицы удалённых категорий и библиотек
+        stale.delete()
+    bump_versions([('leaderboards',)])
+    return len(scopes) * len(METRICS)
+
+
+def get_book_scopes(book_ids):
+    """Значения счётчиков книг и области таблиц, в которые они входят: ({id: значения}, {id: {(scope, id)}})"""
+    values = {row[0]: row[1:] for row in Books.objects.filter(pk__in=book_ids).values_list(*BOOK_VALUES)}
+    scopes = {book_id: {('all', 0)} for book_id in values}
+    links = Books.categories.through.objects.filter(books_id__in=values).values_list('books_id', 'categories_id')
+    for book_id, category_id in links:
+        scopes[book_id].add(('category', category_id))
+    available = BookLibraryAvailable.objects.filter(book_id__in=values, available=True)
+    for book_id, library_id in available.values_list('book_id', 'library_id'):
+        scopes[book_id].add(('library', library_id))
+    return values, scopes
+
+
+def update_leaderboards(book_ids):
+    """
+    Функция для обновления рейтинговых таблиц после изменения книг (счётчиков, категорий, наличия, удаления).
+    Затрагиваются только таблицы областей изменённых книг и таблицы, где они уже есть: таблицы блокируются,
+    изменённые книги заново ставятся на свои места, и таблица перезаписывается, только если изменилась.
+    Если книга заполненной таблицы опустилась ниже её последнего места или покинула область, её место
+    может занять книга не из таблицы, поэтому такая таблица выбирается запросом заново.
+    В неполной (в том числе пустой) таблице уже есть все книги области с показателем, и она обновляется
+    без запроса. Удалённые книги убираются из таблиц каскадно, и освободившиеся места заполняются запросом,
+    как и только что созданные таблицы (например, новой категории).
+    Вызывается обработчиком очереди (flush_leaderboards), а не в запросе, изменившем книгу
+    """
+    book_ids = set(book_ids)
+    if not book_ids:
+        return
+    size = get_leaderboards_settings()['SIZE']
+    with transaction.atomic():
+        values, scopes = get_book_scopes(book_ids)
+        keys = set().union(*scopes.values())
+        keys.update(LeaderboardEntry.objects.filter(book_id__in=book_ids).values_list(
+            'leaderboard__scope', 'leaderboard__scope_id').distinct())
+        condition = Q(pk__in=[])
+        for scope, scope_id in keys:
+            condition |= Q(scope=scope, scope_id=scope_id)
+        existing = set(Leaderboard.objects.filter(condition).values_list('scope', 'scope_id', 'metric'))
+        Leaderboard.objects.bulk_create([
+            Leaderboard(scope=scope, scope_id=scope_id, metric=metric) for scope, scope_id in keys for metric in METRICS
+            if (scope, scope_id, metric) not in existing
+        ], ignore_conflicts=True)
+        if book_ids - values.keys():
+            condition |= Q(pk__in=Leaderboard.objects.annotate(entries_count=Count('entries')).filter(
+                size__gt=F('entries_count')).values('pk'))
+        boards = list(Leaderboard.objects.select_for_update().filter(condition).order_by('pk'))
+        entries = defaultdict(list)
+        for board_id, book_id, score in LeaderboardEntry.objects.filter(leaderboard__in=boards).values_list(
+                'leaderboard_id', 'book_id', 'score'):
+            entries[board_id].append((book_id, score))
+        changed = False
+        for board in boards:
+            old = entries[board.pk]
+            new = {}
+            for book_id in values:
+                score = get_score(board.metric, *values[book_id])
+                if score is not None and (board.scope, board.scope_id) in scopes[book_id]:
+                    new[book_id] = score
+            if (board.scope, board.scope_id, board.metric) not in existing or len(old) < board.size:
+                # новая таблица либо места удалённых книг
+                refill = True
+            else:
+                # заполненная таблица непуста, поэтому последнее место есть
+                refill = board.size >= size and any(
+                    book_id in book_ids and (book_id not in new
+                                             or rank_key((book_id, new[book_id])) > rank_key(old[-1]))
+                    for book_id, _ in old)
+            if refill:
+                items = top_books(board.scope, board.scope_id, board.metric, size)
+            else:
+                items = sorted([item for item in old if item[0] not in book_ids] + list(new.items()),
+                               key=rank_key)[:size]
+            if items != old:
+                save_board(board, items)
+                changed = True
+    if changed:
+        bump_versions([('leaderboards',)])
+
+
+def leaderboards_changed(book_ids):
+    """
+    Функция для добавления книг в очередь обновления рейтинговых таблиц (только INSERT в транзакции изменения,
+    без блокировки таблиц), в качестве аргумента принимает id книг
+    """
+    if not get_leaderboards_settings()['ENABLED']:
+        return
+    LeaderboardQueue.objects.bulk_create([LeaderboardQueue(book_id=book_id) for book_id in set(book_ids)])
+
+
+def flush_leaderboards(batch_size=None):
+    """
+    Функция для обработки очереди обновления рейтинговых таблиц: все отметки одной книги объединяются,
+    и таблицы обновляются один раз за проход (update_leaderboards). Отметки выбираются с SKIP LOCKED,
+    поэтому блокировки таблиц берёт только обработчик очереди. Возвращает количество обработанных книг
+    """
+    batch_size = batch_size or get_leaderboards_settings()['BATCH_SIZE']
+    with transaction.atomic():
+        queue = LeaderboardQueue.objects.select_for_update(skip_locked=True).order_by('pk')
+        entries = list(queue.values_list('pk', 'book_id')[:batch_size])
+        if not entries:
+            return 0
+        book_ids = {book_id for _, book_id in entries}
+        update_leaderboards(book_ids)
+        LeaderboardQueue.objects.filter(pk__in=[pk for pk, _ in entries]).delete()
+    return len(book_ids)
@@ -0,0 +1,312 @@
+import datetime
+import json
+import math
+import random
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from rest_framework.settings import api_settings
+from rest_framework.authtoken.models import Token
+
+from books.models import (
+    Authors, Books, Categories,
+    Libraries, BookLibraryAvailable, User,
+    UserBookRelation, UserBookSession
+)
+from books.services import recount_book_values, refresh_book_catalog, delete_cascade
+
+
+API_PREFIX = '/api/v1'
+
+
+class LoadTestData:
+    """
+    Записи, созданные seed: id книг, категорий (с количеством книг категории) и сессий,
+    токены пользователей и администратора
+    """
+
+    def __init__(self, marker, book_ids, category_books, session_ids, tokens, admin_token):
+        self.marker = marker
+        self.book_ids = book_ids
+        self.category_books = category_books
+        self.category_ids = sorted(category_books)
+        self.session_ids = session_ids
+        self.tokens = tokens
+        self.admin_token = admin_token
+
+
+def seed(scale, seed_value):
+    """
+    Заполнение базы для нагрузочного прогона: на единицу scale 100 книг, 10 авторов, 20 пользователей
+    с 10 отношениями и 2 сессиями каждый. Состав данных определяется seed_value, записи помечаются меткой
+    в названиях и именах (удаляются cleanup)
+    """
+    rng = random.Random(seed_value)
+    marker = f'loadtest-{time.time_ns()}'
+    Authors.objects.bulk_create(Authors(first_name=marker, last_name=f'Author {i}') for i in range(10 * scale))
+    author_ids = list(Authors.objects.filter(first_name=marker).order_by('pk').values_list('pk', flat=True))
+    Categories.objects.bulk_create(Categories(title=f'{marker} {i}') for i in range(5 + 2 * scale))
+    category_ids = list(Categories.objects.filter(title__startswith=marker).order_by('pk').values_list('pk', flat=True))
+    Libraries.objects.bulk_create(Libraries(title=f'{marker} {i}', location='-', phone='-')
+                                  for i in range(3 + scale // 5))
+    library_ids = list(Libraries.objects.filter(title__startswith=marker).order_by('pk').values_list('pk', flat=True))
+    # bulk_create не во всех СУБД возвращает pk, поэтому записи перечитываются по метке
+    Books.objects.bulk_create(Books(title=f'{marker} {i}', description='-', author_id=rng.choice(author_ids))
+                              for i in range(100 * scale))
+    book_ids = list(Books.objects.filter(title__startswith=marker).order_by('pk').values_list('pk', flat=True))
+    book_categories = [(book_id, category_id) for book_id in book_ids
+                       for category_id in rng.sample(category_ids, rng.randint(1, 3))]
+    Books.categories.through.objects.bulk_create(
+        Books.categories.through(books_id=book_id, categories_id=category_id)
+        for book_id, category_id in book_categories)
+    category_books = Counter({category_id: 0 for category_id in category_ids})
+    category_books.update(category_id for _, category_id in book_categories)
+    library_books = defaultdict(list)
+    for book_id in book_ids:
+        for library_id in rng.sample(library_ids, rng.randint(1, len(library_ids))):
+            library_books[library_id].append(book_id)
+    BookLibraryAvailable.objects.bulk_create(
+        BookLibraryAvailable(book_id=book_id, library_id=library_id, available=True, copies=rng.randint(1, 5))
+        for library_id, books in library_books.items() for book_id in books)
+    User.objects.bulk_create(User(username=f'{marker}-{i}') for i in range(20 * scale))
+    user_ids = list(User.objects.filter(username__startswith=f'{marker}-').order_by('pk').values_list('pk', flat=True))
+    admin = User.objects.create_superuser(username=f'{marker}admin', email='', password=None)
+    Token.objects.bulk_create(Token(user_id=user_id, key=Token.generate_key()) for user_id in [*user_ids, admin.pk])
+    UserBookRelation.objects.bulk_create(
+        UserBookRelation(user_id=user_id, book_id=book_id, like=rng.random() < 0.5,
+                         in_bookmarks=rng.random() < 0.3, rate=rng.choice([None, 1, 2, 3, 4, 5]))
+        for user_id in user_ids for book_id in rng.sample(book_ids, min(10, len(book_ids))))
+    today = datetime.date.today()
+    sessions = [(user_id, rng.choice(library_ids)) for user_id in user_ids for _ in range(2)]
+    UserBookSession.objects.bulk_create(
+        UserBookSession(user_id=user_id, library_id=library_id, start_date=today,
+                        end_date=today + datetime.timedelta(days=14)) for user_id, library_id in sessions)
+    session_ids = list(UserBookSession.objects.filter(user_id__in=user_ids).order_by('pk').values_list('pk', flat=True))
+    UserBookSession.books.through.objects.bulk_create(
+        UserBookSession.books.through(userbooksession_id=session_id, books_id=book_id)
+        for session_id, (_, library_id) in zip(session_ids, sessions)
+        for book_id in rng.sample(library_books[library_id], min(3, len(library_books[library_id]))))
+    recount_book_values(book_ids)
+    refresh_book_catalog(book_ids, create=True)
+    tokens = dict(Token.objects.filter(user_id__in=user_ids).values_list('user_id', 'key'))
+    return LoadTestData(marker, book_ids, dict(category_books), session_ids,
+                        [tokens[user_id] for user_id in user_ids], Token.objects.get(user=admin).key)
+
+
+def cleanup(data):
+    """Удаление записей прогона по метке (каскад книг и библиотек - через delete_cascade)"""
+    for author in Authors.objects.filter(first_name=data.marker):
+        delete_cascade(author)
+    for library in Libraries.objects.filter(title__startswith=data.marker):
+        delete_cascade(library)
+    Categories.objects.filter(title__startswith=data.marker).delete()
+    User.objects.filter(username__startswith=data.marker).delete()
+
+
+# Сценарии смеси запросов MIX (функция, вес): каждый возвращает (маршрут, метод, путь, токен, параметры или тело)
+def anonymous_book_list(rng, data, state):
+    # одна из первых пяти страниц, но не дальше последней страницы выборки (иначе - 404 неверной страницы)
+    params, count = {}, len(data.book_ids)
+    if rng.random() < 0.3:
+        params['categories'] = rng.choice(data.category_ids)
+        count = data.category_books[params['categories']]
+    if rng.random() < 0.3:
+        params['ordering'] = rng.choice(['-rating', '-likes'])
+    params['page'] = rng.randint(1, min(5, max(1, math.ceil(count / api_settings.PAGE_SIZE))))
+    return 'GET /books/', 'get', '/books/', None, params
+
+
+def anonymous_book_detail(rng, data, state):
+    # популярные книги читают чаще: индекс с распределением, сдвинутым к началу списка
+    book_id = data.book_ids[min(int(rng.paretovariate(1.2)) - 1, len(data.book_ids) - 1)]
+    return 'GET /books/{id}/', 'get', f'/books/{book_id}/', None, None
+
+
+def relation_write(rng, data, state):
+    book_id = rng.choice(data.book_ids)
+    body = {'book': book_id, 'like': rng.random() < 0.5, 'in_bookmarks': rng.random() < 0.3, 'rate': rng.randint(1, 5)}
+    return 'PUT /book-relation/{book}/', 'put', f'/book-relation/{book_id}/', state['token'], body
+
+
+def my_sessions(rng, data, state):
+    return 'GET /my-sessions/', 'get', '/my-sessions/', state['token'], None
+
+
+def admin_session_processing(rng, data, state):
+    """Администратор принимает, а затем закрывает сессии своей части; после них - просматривает список сессий"""
+    if state['sessions']:
+        session_id, body = state['sessions'].pop()
+        return 'PATCH /user-sessions/{id}/', 'patch', f'/user-sessions/{session_id}/', data.admin_token, body
+    return 'GET /user-sessions/', 'get', '/user-sessions/', data.admin_token, {'is_closed': False}
+
+
+MIX = (
+    (anonymous_book_list, 40),
+    (anonymous_book_detail, 30),
+    (relation_write, 15),
+    (my_sessions, 10),
+    (admin_session_processing, 5),
+)
+
+
+class InProcessTransport:
+    """Запросы к приложению в том же процессе через тестовый клиент Django (с middleware и аутентификацией)"""
+
+    def __init__(self):
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        self.client = Client(HTTP_HOST=host.lstrip('.'))
+
+    def request(self, method, path, token, data):
+        extra = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        if method == 'get':
+            return self.client.get(API_PREFIX + path, data=data, **extra).status_code
+        return getattr(self.client, method)(API_PREFIX + path, data=json.dumps(data),
+                                            content_type='application/json', **extra).status_code
+
+    def close(self):
+        connection.close()
+
+
+class HttpTransport:
+    """Запросы по HTTP к запущенному серверу (например, gunicorn с рабочими настройками)"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/') + API_PREFIX
+
+    def request(self, method, path, token, data):
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        url, body = self.url + path, None
+        if method == 'get':
+            if data:
+                url += '?' + urllib.parse.urlencode(data)
+        else:
+            body = json.dumps(data).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(url, data=body, headers=headers, method=method.upper())
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    def close(self):
+        pass
+
+
+def run(data, transport_factory, clients, requests, seed_value, warmup=0):
+    """
+    Параллельный прогон смеси MIX: clients клиентов, каждый со своим генератором случайных чисел
+    (из seed_value и номера клиента), поэтому последовательность запросов каждого клиента воспроизводима.
+    Первые warmup запросов каждого клиента не учитываются.
+    Возвращает результаты (маршрут, статус, время в мс) и общее время учитываемой части в секундах
+    """
+    scenarios, weights = zip(*MIX)
+    per_client = [requests // clients + (index < requests % clients) for index in range(clients)]
+
+    def work(index):
+        rng = random.Random(f'{seed_value}-{index}')
+        state = {
+            'token': data.tokens[index % len(data.tokens)],
+            # сессии делятся между клиентами без пересечений: каждая принимается, затем закрывается
+            'sessions': [(session_id, body) for session_id in reversed(data.session_ids[index::clients])
+                         for body in ({'is_closed': True}, {'is_accepted': True})],
+        }
+        transport = transport_factory()
+        results = []
+        try:
+            for number in range(warmup + per_client[index]):
+                route, method, path, token, body = rng.choices(scenarios, weights)[0](rng, data, state)
+                started = time.perf_counter()
+                try:
+                    status = transport.request(method, path, token, body)
+                except Exception as error:
+                    status = type(error).__name__
+                if number >= warmup:
+                    results.append((route, status, (time.perf_counter() - started) * 1000))
+        finally:
+            transport.close()
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        chunks = list(executor.map(work, range(clients)))
+    return [result for chunk in chunks for result in chunk], time.perf_counter() - started
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentiles(timings):
+    """p50, p95 и p99 времени ответа (timings отсортированы)"""
+    quantiles = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+    return {'p50': round(quantiles[49], 2), 'p95': round(quantiles[94], 2), 'p99': round(quantiles[98], 2)}
+
+
+def summarize(results, elapsed, meta):
+    """
+    Отчёт прогона: параметры (meta), общая и по маршрутам пропускная способность (запросов в секунду),
+    ответы по статусам, ошибки (статус 400 и выше или исключение) и перцентили времени ответа в мс
+    """
+    routes = defaultdict(list)
+    for route, status, timing in results:
+        routes[route].append((status, timing))
+
+    def stats(items):
+        timings = sorted(timing for _, timing in items)
+        statuses = Counter(str(status) for status, _ in items)
+        return {
+            'requests': len(items),
+            'throughput': round(len(items) / elapsed, 2),
+            'errors': sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400),
+            'statuses': dict(statuses),
+            **percentiles(timings),
+            'max': round(timings[-1], 2),
+        }
+
+    return {
+        'meta': meta,
+        'elapsed': round(elapsed, 3),
+        'total': stats([(status, timing) for _, status, timing in results]),
+        'routes': {route: stats(items) for route, items in sorted(routes.items())},
+    }
+
+
+COMPARED = ('throughput', 'p50', 'p95', 'p99')
+
+
+def compare_reports(old, new):
+    """
+    Сравнение двух отчётов summarize: строки (маршрут, показатель, было, стало, изменение в процентах)
+    для маршрутов обоих отчётов. Отчёты сравнимы, если совпадают параметры прогона, кроме коммита
+    """
+    rows = []
+    for route in ['total', *sorted(set(old['routes']) & set(new['routes']))]:
+        before = old['total'] if route == 'total' else old['routes'][route]
+        after = new['total'] if route == 'total' else new['routes'][route]
+        for key in COMPARED:
+            change = (after[key] - before[key]) / before[key] * 100 if before[key] else None
+            rows.append((route, key, before[key], after[key], change))
+    return rows
+
+
+def differing_meta(old, new):
+    """Параметры прогона, кроме коммита и времени запуска, которые различаются в двух отчётах"""
+    keys = (set(old['meta']) | set(new['meta'])) - {'commit', 'started_at'}
+    return sorted(key for key in keys if old['meta'].get(key) != new['meta'].get(key))
@@ -0,0 +1,106 @@
+import datetime
+import random
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from books.models import Authors, Books, Libraries, BookLibraryAvailable, User, UserBookSession
+from books.views import MySessionsViewSet
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочная проверка резервирования экземпляров: параллельные запросы на создание сессий
+    к одним и тем же книгам одной библиотеки. После прогона для каждой книги сравнивается число
+    держащих её сессий с количеством экземпляров (перерезервирования быть не должно).
+    Записи создаются с меткой и удаляются после прогона. Для честной конкуренции нужна PostgreSQL:
+    SQLite выполняет записи по очереди и отвечает ошибками блокировки базы
+    """
+    help = 'Проверяет резервирование экземпляров под параллельной нагрузкой'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=3, help='Количество книг')
+        parser.add_argument('--copies', type=int, default=10, help='Экземпляров каждой книги')
+        parser.add_argument('--requests', type=int, default=500, help='Количество запросов на создание сессии')
+        parser.add_argument('--workers', type=int, default=16, help='Количество параллельных потоков')
+
+    def handle(self, *args, **options):
+        marker = f'reservations-{time.time_ns()}'
+        library = Libraries.objects.create(title=marker, location='-', phone='-')
+        author = Authors.objects.create(first_name=marker, last_name='-')
+        users = [User.objects.create_user(username=f'{marker}-{i}') for i in range(options['workers'])]
+        try:
+            books = [Books.objects.create(title=f'{marker} {i}', description='-', author=author)
+                     for i in range(options['books'])]
+            BookLibraryAvailable.objects.bulk_create(
+                BookLibraryAvailable(book=book, library=library, available=True, copies=options['copies'])
+                for book in books)
+            started = time.perf_counter()
+            results = self.run(users, library, [book.pk for book in books], options['requests'], options['workers'])
+            elapsed = time.perf_counter() - started
+            self.report(results, elapsed, library, books)
+        finally:
+            UserBookSession.objects.filter(library=library).delete()
+            Books.objects.filter(author=author).delete()
+            author.delete()
+            library.delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def run(self, users, library, book_ids, count, workers):
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        factory = APIRequestFactory()
+        view = MySessionsViewSet.as_view({'post': 'create'})
+        today = datetime.date.today()
+
+        def request(number):
+            data = {
+                'books': random.sample(book_ids, random.randint(1, len(book_ids))),
+                'library': library.pk,
+                'start_date': str(today),
+                'end_date': str(today + datetime.timedelta(days=7)),
+            }
+            http_request = factory.post('/api/v1/my-sessions/', data, format='json', HTTP_HOST=host.lstrip('.'))
+            force_authenticate(http_request, user=users[number % len(users)])
+            started = time.perf_counter()
+            try:
+                status = view(http_request).status_code
+            except Exception as error:
+                status = type(error).__name__
+            return status, (time.perf_counter() - started) * 1000
+
+        def work(numbers):
+            try:
+                return [request(number) for number in numbers]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunks = executor.map(work, [range(i, count, workers) for i in range(workers)])
+        return [result for chunk in chunks for result in chunk]
+
+    def report(self, results, elapsed, library, books):
+        statuses = Counter(status for status, _ in results)
+        timings = sorted(timing for _, timing in results)
+        quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        self.stdout.write(f'запросов: {len(results)} за {elapsed:.2f} с ({len(results) / elapsed:.0f} в секунду)')
+        self.stdout.write('ответы: ' + ', '.join(f'{status}: {number}' for status, number in sorted(
+            statuses.items(), key=lambda item: str(item[0]))))
+        self.stdout.write(f'время ответа, мс: p50 {quantiles[49]:.1f}, p95 {quantiles[94]:.1f}, '
+                          f'p99 {quantiles[98]:.1f}, max {timings[-1]:.1f}')
+        oversubscribed = 0
+        for entry in BookLibraryAvailable.objects.filter(library=library).select_related('book').order_by('book_id'):
+            holders = UserBookSession.objects.filter(library=library, books=entry.book_id, holds_copies=True,
+                                                     is_closed=False).count()
+            oversubscribed += max(holders - entry.copies, 0) + (holders != entry.reserved)
+            self.stdout.write(f'{entry.book}: экземпляров {entry.copies}, зарезервировано {entry.reserved}, '
+                              f'сессий {holders}')
+        if oversubscribed:
+            self.stdout.write(self.style.ERROR('Найдено перерезервирование или расхождение счётчиков'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Перерезервирования нет'))
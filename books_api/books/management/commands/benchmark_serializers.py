@@ -0,0 +1,97 @@
+import datetime
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+import books.serializers as s
+from books.models import (
+    Authors, Books, Categories,
+    Libraries, BookCatalog, User,
+    UserBookSession, UserBookOffer
+)
+from books.query_budget import Rollback
+from books.row_serializers import get_row_serializer
+from books.services import refresh_book_catalog
+
+
+class Command(BaseCommand):
+    """
+    Сравнение сериализаторов DRF для списков с быстрой сериализацией RowSerializer
+    на страницах разного размера. Недостающие записи создаются в транзакции, которая затем откатывается
+    """
+    help = 'Сравнивает скорость сериализаторов списков и RowSerializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000], help='Размеры страниц')
+        parser.add_argument('--repeat', type=int, default=20, help='Количество повторов для каждого замера')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.fill(max(options['rows']))
+                self.run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def fill(self, count):
+        """Дополнение базы записями до count строк в каждом сравниваемом списке"""
+        marker = f'benchmark-{time.time_ns()}'
+        user = User.objects.create_user(username=marker)
+        library = Libraries.objects.create(title=marker, location='-', phone='-')
+        # bulk_create не во всех СУБД возвращает pk, поэтому записи перечитываются по метке
+        Categories.objects.bulk_create(Categories(title=f'{marker} {i}') for i in range(3))
+        categories = list(Categories.objects.filter(title__startswith=marker))
+        Authors.objects.bulk_create(
+            Authors(first_name=marker, middle_name='M' if i % 2 else None, last_name=f'Author {i}')
+            for i in range(count))
+        authors = list(Authors.objects.filter(first_name=marker).order_by('pk'))
+        Books.objects.bulk_create(
+            Books(title=f'{marker} {i}', description='-', author=authors[i]) for i in range(count))
+        books = list(Books.objects.filter(title__startswith=marker))
+        Books.categories.through.objects.bulk_create(
+            Books.categories.through(books_id=book.pk, categories_id=category.pk)
+            for book in books for category in categories)
+        refresh_book_catalog([book.pk for book in books], create=True)
+        today = datetime.date.today()
+        UserBookSession.objects.bulk_create(
+            UserBookSession(user=user, library=library, start_date=today, end_date=today) for _ in range(count))
+        UserBookOffer.objects.bulk_create(
+            UserBookOffer(user=user, library=library, quantity=1, books_description='-') for _ in range(count))
+
+    def run(self, sizes, repeat):
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        request = Request(APIRequestFactory().get('/api/v1/', HTTP_HOST=host.lstrip('.')))
+        context = {'request': request, 'format': None, 'view': None}
+        cases = [
+            (s.BookCatalogListSerializer, BookCatalog.objects.all()),
+            (s.BooksListSerializer, Books.objects.select_related('author').prefetch_related('categories')),
+            (s.AuthorsListSerializer, Authors.objects.all()),
+            (s.UserBooksSessionsListSerializer, UserBookSession.objects.select_related('user', 'library')),
+            (s.UserBooksOffersListSerializer, UserBookOffer.objects.select_related('user', 'library')),
+        ]
+        self.stdout.write(f'{"serializer":<34}{"rows":>6}{"drf, ms":>12}{"rows, ms":>12}{"speedup":>10}')
+        for serializer_class, queryset in cases:
+            row_serializer = get_row_serializer(serializer_class)
+            for size in sizes:
+                drf = self.measure(repeat, lambda: serializer_class(
+                    queryset[:size], many=True, context=context).data)
+                fast = self.measure(repeat, lambda: row_serializer.serialize(
+                    row_serializer.prepare(queryset)[:size], context))
+                self.stdout.write(f'{serializer_class.__name__:<34}{size:>6}{drf:>12.2f}{fast:>12.2f}'
+                                  f'{drf / fast:>9.1f}x')
+
+    @staticmethod
+    def measure(repeat, function):
+        """Медиана времени выполнения function (с запросом к базе) в миллисекундах"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,52 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    """
+    Команда для создания индексов моделей (Meta.indexes), которых ещё нет в базе данных.
+    В PostgreSQL индексы создаются через CREATE INDEX CONCURRENTLY без блокировки записи в таблицы,
+    а недостроенные (невалидные после прерванного CONCURRENTLY) индексы удаляются и создаются заново.
+    Индексы создаются с IF NOT EXISTS, поэтому последующая миграция с ними ничего не делает
+    """
+    help = 'Создаёт отсутствующие индексы моделей приложения books (в PostgreSQL - без блокировки таблиц)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только вывести индексы, которые будут созданы')
+
+    def get_invalid_indexes(self):
+        if connection.vendor != 'postgresql':
+            return set()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexrelid::regclass::text FROM pg_index WHERE NOT indisvalid')
+            return {row[0] for row in cursor.fetchall()}
+
+    def handle(self, *args, **options):
+        concurrently = connection.vendor == 'postgresql'
+        invalid = self.get_invalid_indexes()
+        created = 0
+        for model in apps.get_app_config('books').get_models():
+            if not model._meta.indexes:
+                continue
+            with connection.cursor() as cursor:
+                existing = connection.introspection.get_constraints(cursor, model._meta.db_table)
+            for index in model._meta.indexes:
+                if index.name in existing and index.name not in invalid:
+                    continue
+                # индексы только для PostgreSQL (PostgresIndexMixin) в остальных СУБД не создаются
+                if not getattr(index, 'is_supported', lambda connection: True)(connection):
+                    continue
+                self.stdout.write(f'{model._meta.db_table}: {index.name}')
+                created += 1
+                if options['dry_run']:
+                    continue
+                # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+                with connection.schema_editor(atomic=False) as editor:
+                    if index.name in invalid:
+                        editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {editor.quote_name(index.name)}')
+                    if concurrently:
+                        editor.add_index(model, index, concurrently=True)
+                    else:
+                        editor.add_index(model, index)
+        self.stdout.write(self.style.SUCCESS(f'Создано индексов: {created}'))
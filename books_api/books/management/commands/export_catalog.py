@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.exporters import ExportError, export_catalog
+
+
+class Command(BaseCommand):
+    """
+    Команда для полной выгрузки каталога книг (автор, категории, наличие в библиотеках и счётчики)
+    в сжатые файлы NDJSON или CSV: книги делятся на диапазоны id, которые выгружаются параллельно
+    в отдельные файлы, а в manifest.json записываются файлы, диапазоны, количество записей и контрольные суммы
+    """
+    help = 'Выгружает каталог книг в сжатые файлы NDJSON или CSV с манифестом'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Директория для файлов выгрузки')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson', help='Формат файлов')
+        parser.add_argument('--compression', choices=['gzip', 'zstd', 'none'], default='gzip',
+                            help='Сжатие файлов (для zstd нужен пакет zstandard)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Количество процессов')
+        parser.add_argument('--shards', type=int, default=None,
+                            help='Количество файлов (по умолчанию - по количеству процессов)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Количество книг в одной пачке')
+
+    def handle(self, *args, **options):
+        try:
+            manifest = export_catalog(
+                options['output'], fmt=options['format'], compression=options['compression'],
+                workers=options['workers'], shards=options['shards'], chunk_size=options['chunk_size'],
+            )
+        except ExportError as error:
+            raise CommandError(error)
+        size = sum(shard['bytes'] for shard in manifest['shards'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено {manifest["rows"]} книг в {len(manifest["shards"])} файлов ({size / 2 ** 20:.1f} МБ)'))
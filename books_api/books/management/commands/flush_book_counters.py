@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.services import flush_book_counters, get_counters_settings
+
+
+class Command(BaseCommand):
+    """
+    Обработчик очереди отложенного пересчёта счётчиков книг (BOOKS_COUNTERS['CONSISTENCY'] = 'deferred'):
+    раз в FLUSH_INTERVAL секунд пересчитывает каждую помеченную книгу один раз
+    """
+    help = 'Обрабатывает очередь отложенного пересчёта рейтинга, лайков и закладок книг'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Обработать очередь один раз и завершиться')
+        parser.add_argument('--interval', type=float, default=None, help='Интервал между проходами (секунды)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Количество отметок за одну транзакцию')
+
+    def handle(self, *args, **options):
+        conf = get_counters_settings()
+        interval = options['interval'] if options['interval'] is not None else conf['FLUSH_INTERVAL']
+        while True:
+            started = time.monotonic()
+            total = 0
+            while True:
+                books = flush_book_counters(options['batch_size'])
+                if not books:
+                    break
+                total += books
+            if total:
+                self.stdout.write(f'Пересчитано книг: {total}')
+            if options['once']:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - started)))
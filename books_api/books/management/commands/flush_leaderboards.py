@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.leaderboards import flush_leaderboards, get_leaderboards_settings
+
+
+class Command(BaseCommand):
+    """
+    Обработчик очереди обновления рейтинговых таблиц книг (books.leaderboards):
+    раз в FLUSH_INTERVAL секунд переносит в таблицы изменения каждой помеченной книги один раз
+    """
+    help = 'Обрабатывает очередь обновления рейтинговых таблиц книг'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Обработать очередь один раз и завершиться')
+        parser.add_argument('--interval', type=float, default=None, help='Интервал между проходами (секунды)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Количество отметок за одну транзакцию')
+
+    def handle(self, *args, **options):
+        conf = get_leaderboards_settings()
+        interval = options['interval'] if options['interval'] is not None else conf['FLUSH_INTERVAL']
+        while True:
+            started = time.monotonic()
+            total = 0
+            while True:
+                books = flush_leaderboards(options['batch_size'])
+                if not books:
+                    break
+                total += books
+            if total:
+                self.stdout.write(f'Обновлены рейтинговые таблицы для книг: {total}')
+            if options['once']:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - started)))
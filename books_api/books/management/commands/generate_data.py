@@ -0,0 +1,53 @@
+import datetime
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.generators import DEFAULT_DATE, GenerationError, generate_data, get_counts
+
+
+class Command(BaseCommand):
+    """
+    Команда для генерации синтетических данных (books.generators) любого объёма: авторы, категории, библиотеки,
+    пользователи, книги с категориями и наличием, отношения пользователей и сессии с популярностью по закону Ципфа.
+    Данные определяются --seed, количеством записей и --date, загружаются пачками (в PostgreSQL - COPY)
+    параллельно несколькими процессами. Не переданные количества считаются по количеству книг
+    """
+    help = 'Генерирует синтетические данные для разработки и замеров производительности'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000, help='Количество книг')
+        for name, help_text in (
+            ('authors', 'авторов (по умолчанию - книг / 20)'),
+            ('categories', 'категорий (по умолчанию - книг / 200, от 20 до 2000)'),
+            ('libraries', 'библиотек (по умолчанию - книг / 1000, от 5 до 500)'),
+            ('users', 'пользователей (по умолчанию - книг / 2)'),
+            ('relations', 'отношений пользователей к книгам, примерно (по умолчанию - книг * 10)'),
+            ('sessions', 'сессий (по умолчанию - пользователей / 2)'),
+        ):
+            parser.add_argument(f'--{name}', type=int, default=None, help=f'Количество {help_text}')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора')
+        parser.add_argument('--date', type=datetime.date.fromisoformat, default=DEFAULT_DATE,
+                            help='Опорная дата: данные создаются за несколько лет до неё (ГГГГ-ММ-ДД)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Количество процессов')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Количество строк главной таблицы в пачке')
+
+    def handle(self, *args, **options):
+        try:
+            counts = get_counts(options['books'], **{name: options[name] for name in (
+                'authors', 'categories', 'libraries', 'users', 'relations', 'sessions')})
+        except GenerationError as error:
+            raise CommandError(error)
+        started = time.perf_counter()
+
+        def progress(phase, totals):
+            rows = ', '.join(f'{table}: {count}' for table, count in sorted(totals.items()))
+            self.stdout.write(f'{", ".join(phase)} - {time.perf_counter() - started:.1f} с ({rows})')
+
+        totals = generate_data(counts, options['seed'], workers=options['workers'],
+                               chunk_size=options['chunk_size'], date=options['date'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Сгенерировано {sum(totals.values())} строк за {time.perf_counter() - started:.1f} с. '
+            f'Затем выполните recount_book_counters, refresh_catalog, update_search_index, '
+            f'rebuild_leaderboards и refresh_similar_books --full'))
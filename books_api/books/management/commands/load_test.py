@@ -0,0 +1,77 @@
+import datetime
+import json
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from books.loadtest import (
+    InProcessTransport, HttpTransport, seed, cleanup,
+    run, summarize, get_commit, compare_reports, differing_meta
+)
+
+
+class Command(BaseCommand):
+    """
+    Воспроизводимый нагрузочный прогон API (books.loadtest): база заполняется данными размера --scale,
+    затем --clients параллельных клиентов выполняют смесь анонимных чтений списка и экземпляров книг,
+    записей отношений пользователей, просмотра своих сессий и обработки сессий администратором.
+    Последовательность запросов определяется --seed, поэтому отчёты JSON разных коммитов сравнимы (--compare).
+    По умолчанию запросы выполняются в том же процессе, с --url - по HTTP к запущенному серверу
+    с той же базой. Созданные записи удаляются после прогона (кроме --keep)
+    """
+    help = 'Нагрузочный прогон API с пропускной способностью и перцентилями времени ответа по маршрутам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=10, help='Размер данных (100 книг и 20 пользователей на 1)')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генераторов данных и запросов')
+        parser.add_argument('--clients', type=int, default=16, help='Количество параллельных клиентов')
+        parser.add_argument('--requests', type=int, default=2000, help='Количество учитываемых запросов')
+        parser.add_argument('--warmup', type=int, default=10, help='Неучитываемых запросов каждого клиента')
+        parser.add_argument('--url', help='Адрес запущенного сервера (по умолчанию - запросы в том же процессе)')
+        parser.add_argument('--output', help='Файл для отчёта JSON (по умолчанию - вывод в консоль)')
+        parser.add_argument('--compare', help='Отчёт JSON предыдущего прогона для сравнения')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные записи')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        if options['clients'] < 1 or options['scale'] < 1:
+            raise CommandError('--clients и --scale должны быть положительными')
+        data = seed(options['scale'], options['seed'])
+        try:
+            transport_factory = partial(HttpTransport, options['url']) if options['url'] else InProcessTransport
+            results, elapsed = run(data, transport_factory, options['clients'], options['requests'],
+                                   options['seed'], options['warmup'])
+        finally:
+            if not options['keep']:
+                cleanup(data)
+        meta = {
+            'commit': get_commit(),
+            'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'transport': 'http' if options['url'] else 'in-process',
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+            **{key: options[key] for key in ('scale', 'seed', 'clients', 'requests', 'warmup')},
+        }
+        report = summarize(results, elapsed, meta)
+        text = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(text + '\n')
+        else:
+            self.stdout.write(text)
+        if baseline is not None:
+            self.compare(baseline, report)
+
+    def compare(self, baseline, report):
+        differing = differing_meta(baseline, report)
+        if differing:
+            self.stdout.write(self.style.WARNING(f'Параметры прогонов различаются: {", ".join(differing)}'))
+        self.stdout.write(f'{"маршрут":<30}{"показатель":>12}{"было":>12}{"стало":>12}{"изменение":>12}')
+        for route, key, before, after, change in compare_reports(baseline, report):
+            change = f'{change:+.1f}%' if change is not None else '-'
+            self.stdout.write(f'{route:<30}{key:>12}{before:>12.2f}{after:>12.2f}{change:>12}')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from books.query_budget import count_queries, format_table
+
+
+class Command(BaseCommand):
+    """
+    Команда для публикации таблицы количества запросов к базе каждого маршрута API (books.query_budget)
+    при нескольких размерах заполнения. Заполнение выполняется в транзакции, которая затем откатывается
+    """
+    help = 'Выводит таблицу Markdown с количеством запросов к базе для каждого маршрута API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[5, 50],
+                            help='Количество связанных записей главных объектов заполнения')
+        parser.add_argument('--output', help='Файл для таблицы (по умолчанию - вывод в консоль)')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes']
+        table = format_table(sizes, {size: count_queries(size) for size in sizes})
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(table + '\n')
+        else:
+            self.stdout.write(table)
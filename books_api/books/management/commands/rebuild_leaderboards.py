@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from books.leaderboards import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    """
+    Команда для полного построения рейтинговых таблиц книг (books.leaderboards) по текущим счётчикам,
+    например после изменения BOOKS_LEADERBOARDS или пересчёта счётчиков
+    """
+    help = 'Строит рейтинговые таблицы книг по байесовскому среднему оценок и по лайкам'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Рейтинговые таблицы построены: {rebuild_leaderboards()}'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from books.services import recount_reading_now, recount_book_values, recount_reservations
+
+
+class Command(BaseCommand):
+    """
+    Команда для пересчёта счётчиков книг по исходным таблицам:
+    рейтинга, лайков и закладок (по отношениям пользователей), reading_now (по сессиям)
+    и зарезервированных экземпляров в библиотеках (по незакрытым сессиям)
+    """
+    help = 'Пересчитывает рейтинг, лайки, закладки, reading_now и резервирование экземпляров'
+
+    def handle(self, *args, **options):
+        total = recount_book_values()
+        recount_reading_now()
+        entries = recount_reservations()
+        self.stdout.write(self.style.SUCCESS(f'Счётчики пересчитаны: {total} книг, {entries} записей наличия'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from books.engine import get_catalog_engine, get_catalog_engine_settings
+from books.models import Books
+from books.services import refresh_book_catalog
+
+
+class Command(BaseCommand):
+    """
+    Команда для полного перестроения каталога книг (BookCatalog) по текущим данным
+    и снимка каталога (books.engine), если он включён
+    """
+    help = 'Перестраивает каталог книг BookCatalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Количество книг в одной пачке')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        total, chunk = 0, []
+        for book_id in Books.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk_size):
+            chunk.append(book_id)
+            if len(chunk) == chunk_size:
+                refresh_book_catalog(chunk, create=True)
+                total, chunk = total + len(chunk), []
+        refresh_book_catalog(chunk, create=True)
+        total += len(chunk)
+        if get_catalog_engine_settings()['ENABLED']:
+            get_catalog_engine().build()
+        self.stdout.write(self.style.SUCCESS(f'Каталог обновлён: {total} книг'))
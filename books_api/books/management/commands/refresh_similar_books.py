@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.recommendations import build_similar_books, flush_similar_books, get_recommendations_settings
+
+
+class Command(BaseCommand):
+    """
+    Построение похожих книг (books.recommendations): с --full - полностью по всем положительным отношениям,
+    иначе - обработка очереди изменений отношений раз в FLUSH_INTERVAL секунд
+    """
+    help = 'Строит похожие книги по совместным лайкам, закладкам и высоким оценкам пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Построить соседей всех книг и завершиться')
+        parser.add_argument('--once', action='store_true', help='Обработать очередь один раз и завершиться')
+        parser.add_argument('--interval', type=float, default=None, help='Интервал между проходами (секунды)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Количество отметок за одну транзакцию')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            self.stdout.write(f'Построены похожие книги для книг: {build_similar_books()}')
+            return
+        conf = get_recommendations_settings()
+        interval = options['interval'] if options['interval'] is not None else conf['FLUSH_INTERVAL']
+        while True:
+            started = time.monotonic()
+            total = 0
+            while True:
+                books = flush_similar_books(options['batch_size'])
+                if not books:
+                    break
+                total += books
+            if total:
+                self.stdout.write(f'Пересчитаны похожие книги для книг: {total}')
+            if options['once']:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - started)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books.search import SEARCH_DOCUMENTS, get_search_backend
+
+
+class Command(BaseCommand):
+    """Команда для пересчёта поисковых векторов (или локального индекса) всех моделей с полнотекстовым поиском"""
+    help = 'Пересчитывает поисковые векторы search_vector'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        for model in SEARCH_DOCUMENTS:
+            backend.rebuild(model)
+            self.stdout.write(f'{model._meta.label}: готово')
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс обновлён'))
@@ -1,10 +1,115 @@
+import json
+import re
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres import indexes as postgres_indexes
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.backends.ddl_references import Statement
 
 
 User = get_user_model()
 
 
+class IfNotExistsMixin:
+    """
+    Индекс создаётся с IF NOT EXISTS: на рабочей базе индексы можно заранее построить без блокировки записи
+    командой create_indexes (CREATE INDEX CONCURRENTLY), и миграция с этими индексами их не пересоздаёт
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        statement = super().create_sql(model, schema_editor, using=using, **kwargs)
+        statement.template = re.sub(r'^CREATE INDEX( CONCURRENTLY)?', r'\g<0> IF NOT EXISTS', statement.template)
+        return statement
+
+
+class Index(IfNotExistsMixin, models.Index):
+    pass
+
+
+class PostgresIndexMixin:
+    """
+    Индекс только для PostgreSQL (например, GIN): объявлен в модели при любой СУБД, поэтому миграции
+    не зависят от подключённой базы, а в остальных СУБД его создание и удаление - пустая операция (комментарий)
+    """
+
+    @staticmethod
+    def is_supported(connection):
+        return connection.vendor == 'postgresql'
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if not self.is_supported(schema_editor.connection):
+            return Statement('-- %(name)s: только PostgreSQL', name=self.name)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+    def remove_sql(self, model, schema_editor, **kwargs):
+        if not self.is_supported(schema_editor.connection):
+            return Statement('-- %(name)s: только PostgreSQL', name=self.name)
+        return super().remove_sql(model, schema_editor, **kwargs)
+
+
+class GinIndex(PostgresIndexMixin, IfNotExistsMixin, postgres_indexes.GinIndex):
+    pass
+
+
+class IdArrayField(ArrayField):
+    """
+    Массив id (integer[] с GIN-индексом в PostgreSQL), в остальных СУБД - список JSON в текстовом поле.
+    Фильтр overlap (в массиве есть хотя бы один из переданных id) работает в обоих случаях
+    """
+
+    def __init__(self, base_field=None, **kwargs):
+        super().__init__(base_field or models.IntegerField(), **kwargs)
+
+    def db_type(self, connection):
+        return super().db_type(connection) if connection.vendor == 'postgresql' else 'text'
+
+    def get_placeholder(self, value, compiler, connection):
+        return super().get_placeholder(value, compiler, connection) if connection.vendor == 'postgresql' else '%s'
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if connection.vendor == 'postgresql' or value is None:
+            return value
+        return json.dumps(value)
+
+    def from_db_value(self, value, expression, connection):
+        return json.loads(value) if isinstance(value, str) else value
+
+
+@IdArrayField.register_lookup
+class IdArrayOverlap(models.Lookup):
+    """Пересечение массива с переданным списком id: && в PostgreSQL, иначе EXISTS по json_each"""
+    lookup_name = 'overlap'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        ids = [int(pk) for pk in self.rhs]
+        if connection.vendor == 'postgresql':
+            return f'{lhs} && %s::integer[]', [*params, ids]
+        if not ids:
+            return '0 = 1', params
+        placeholders = ', '.join(['%s'] * len(ids))
+        return f'EXISTS (SELECT 1 FROM json_each({lhs}) WHERE json_each.value IN ({placeholders}))', [*params, *ids]
+
+
+def search_vector_index(name):
+    """GIN-индекс для поля полнотекстового поиска (создаётся только в PostgreSQL)"""
+    return GinIndex(fields=['search_vector'], name=name)
+
+
+def format_author_name(first_name, middle_name, last_name):
+    """Краткое имя автора (инициалы и фамилия)"""
+    return f'{first_name[0]}. {middle_name[0]}. {last_name}' if middle_name else f'{first_name[0]}. {last_name}'
+
+
+def format_author_full_name(first_name, middle_name, last_name):
+    """Полное имя автора"""
+    return f'{first_name} {middle_name} {last_name}' if middle_name else f'{first_name} {last_name}'
+
+
 class Books(models.Model):
     """Модель книг, доступных в в библиотеке"""
     title = models.CharField(verbose_name='Название', max_length=255, unique=True)
@@ -12,9 +117,13 @@ class Books(models.Model):
     author = models.ForeignKey('Authors', on_delete=models.CASCADE, verbose_name='Автор', related_name='aut_books')
     categories = models.ManyToManyField('Categories', verbose_name='Категории', blank=True, related_name='cat_books')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
     rating = models.DecimalField(max_digits=3, decimal_places=2, null=True, default=None, verbose_name='Рейтинг')
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')
+    rating_count = models.PositiveIntegerField(default=0, verbose_name='Количество оценок')
     likes = models.PositiveIntegerField(default=0, verbose_name='Мне нравится')
     bookmarks = models.PositiveIntegerField(default=0, verbose_name='В закладках')
+    reading_now = models.PositiveIntegerField(default=0, verbose_name='Читают сейчас')
 
     class Meta:
         ordering = ['-created_at']
@@ -29,28 +138,36 @@ class Authors(models.Model):
     middle_name = models.CharField(verbose_name='Отчество', max_length=64, blank=True, null=True)
     last_name = models.CharField(verbose_name='Фамилия', max_length=64)
     description = models.TextField(verbose_name='Описание', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Поисковый вектор')
 
     class Meta:
         ordering = ['last_name']
+        indexes = [
+            search_vector_index('authors_search_idx'),
+            Index(fields=['last_name', 'id'], name='authors_last_name_idx'),
+        ]
 
     def get_name(self):
-        name = (f'{self.first_name[0]}. {self.middle_name[0]}. {self.last_name}'
-                if self.middle_name else f'{self.first_name[0]}. {self.last_name}')
-        return name
+        return format_author_name(self.first_name, self.middle_name, self.last_name)
 
     def __str__(self):
-        full_name = (f'{self.first_name} {self.middle_name} {self.last_name}'
-                     if self.middle_name else f'{self.first_name} {self.last_name}')
-        return full_name
+        return format_author_full_name(self.first_name, self.middle_name, self.last_name)
 
 
 class Categories(models.Model):
     """Модель книжных категорий"""
     title = models.CharField(verbose_name='Название', max_length=255)
     description = models.TextField(verbose_name='Описание', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Поисковый вектор')
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            search_vector_index('categories_search_idx'),
+            Index(fields=['title', 'id'], name='categories_title_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -61,12 +178,18 @@ class Libraries(models.Model):
     title = models.CharField(verbose_name='Название', max_length=255)
     location = models.CharField(verbose_name='Адрес', max_length=255)
     phone = models.CharField(verbose_name='Телефон', max_length=64)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Поисковый вектор')
 
     def __str__(self):
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            search_vector_index('libraries_search_idx'),
+            Index(fields=['title', 'id'], name='libraries_title_idx'),
+        ]
 
 
 class BookLibraryAvailable(models.Model):
@@ -75,10 +198,20 @@ class BookLibraryAvailable(models.Model):
     library = models.ForeignKey(Libraries, on_delete=models.CASCADE,
                                 verbose_name='Библиотека', related_name='book_available')
     available = models.BooleanField(verbose_name='В наличии')
+    copies = models.PositiveIntegerField(default=1, verbose_name='Экземпляров')
+    reserved = models.PositiveIntegerField(default=0, verbose_name='Зарезервировано')
 
     class Meta:
-        ordering = ('book', 'library')
+        # по уникальному индексу (book, library), а не по дате книги и названию библиотеки через JOIN
+        ordering = ('book_id', 'library_id')
         unique_together = ('book', 'library')
+        indexes = [
+            # книги в наличии в библиотеке (фильтр по библиотеке, книги библиотеки)
+            Index(fields=['library', 'book'], condition=models.Q(available=True), name='available_library_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(reserved__lte=models.F('copies')), name='reserved_lte_copies'),
+        ]
 
     def __str__(self):
         return f'Связь {self.book} с {self.library}'
@@ -95,13 +228,29 @@ class UserBookSession(models.Model):
     is_closed = models.BooleanField(default=False, verbose_name='Закрыто')
     message = models.TextField(verbose_name='Комментарий', default='-')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    holds_copies = models.BooleanField(default=False, editable=False, verbose_name='Резервирует экземпляры')
 
     class Meta:
-        ordering = ('-created_at', 'is_closed', 'is_accepted', 'user', 'library')
+        # 'library_id', а не 'library': иначе список упорядочивается по названию библиотеки через JOIN без индекса
+        ordering = ('-created_at', 'is_closed', 'is_accepted', 'user', 'library_id')
+        indexes = [
+            # список всех сессий в порядке ordering (сессии пользователя выбираются по индексу внешнего ключа)
+            Index(fields=['-created_at', 'is_closed', 'is_accepted', 'user', 'library'], name='session_order_idx'),
+        ]
 
     def __str__(self):
         return f'Сессия {self.user} в {self.library}'
 
+    @property
+    def is_active(self):
+        """Сессия принята и не закрыта - книги сессии учитываются в Books.reading_now"""
+        return self.is_accepted and not self.is_closed
+
+    @property
+    def is_holding(self):
+        """Сессия создана с резервированием и не закрыта - держит по экземпляру своих книг в своей библиотеке"""
+        return self.holds_copies and not self.is_closed
+
 
 class UserBookOffer(models.Model):
     """Модель предложения книг в определенную библиотеку"""
@@ -113,12 +262,19 @@ class UserBookOffer(models.Model):
     is_closed = models.BooleanField(default=False, verbose_name='Закрыто')
     message = models.TextField(verbose_name='Комментарий', default='-')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Поисковый вектор')
 
     def __str__(self):
         return f'Предложение {self.user} книг в {self.library}'
 
     class Meta:
-        ordering = ('-created_at', 'is_closed', 'is_accepted', 'user', 'library')
+        # 'library_id', а не 'library': иначе список упорядочивается по названию библиотеки через JOIN без индекса
+        ordering = ('-created_at', 'is_closed', 'is_accepted', 'user', 'library_id')
+        indexes = [
+            search_vector_index('offer_search_idx'),
+            # список всех предложений в порядке ordering (предложения пользователя - по индексу внешнего ключа)
+            Index(fields=['-created_at', 'is_closed', 'is_accepted', 'user', 'library'], name='offer_order_idx'),
+        ]
 
 
 class UserBookRelation(models.Model):
@@ -138,6 +294,160 @@ class UserBookRelation(models.Model):
 
     class Meta:
         unique_together = ('book', 'user')
+        indexes = [
+            # закладки пользователя
+            Index(fields=['user', 'book'], condition=models.Q(in_bookmarks=True), name='relation_bookmarks_idx'),
+        ]
 
     def __str__(self):
         return f'Отношение {self.user} к {self.book}'
+
+
+class BookCatalog(models.Model):
+    """
+    Модель каталога книг (денормализованное представление для списков книг),
+    обновляется сигналами при изменении книг, их категорий, авторов и наличия в библиотеках
+    """
+    book = models.OneToOneField(Books, on_delete=models.CASCADE, primary_key=True,
+                                verbose_name='Книга', related_name='catalog')
+    title = models.CharField(verbose_name='Название', max_length=255)
+    author = models.ForeignKey(Authors, on_delete=models.CASCADE, verbose_name='Автор', related_name='catalog_books')
+    author_name = models.CharField(verbose_name='Имя автора', max_length=255)
+    categories = models.JSONField(verbose_name='Категории', default=list)
+    category_ids = IdArrayField(verbose_name='id категорий', default=list)
+    library_ids = IdArrayField(verbose_name='id библиотек, в которых есть книга', default=list)
+    available = models.BooleanField(verbose_name='В наличии хотя бы в одной библиотеке', default=False)
+    created_at = models.DateTimeField(verbose_name='Дата создания')
+    rating = models.DecimalField(max_digits=3, decimal_places=2, null=True, default=None, verbose_name='Рейтинг')
+    likes = models.PositiveIntegerField(default=0, verbose_name='Мне нравится')
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Поисковый вектор')
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            search_vector_index('catalog_search_idx'),
+            # фильтры по категориям и библиотекам без соединения со связующими таблицами
+            GinIndex(fields=['category_ids'], name='catalog_category_ids_idx'),
+            GinIndex(fields=['library_ids'], name='catalog_library_ids_idx'),
+            # индексы под keyset-пагинацию (поле упорядочивания + pk)
+            Index(fields=['available', 'created_at', 'book'], name='catalog_created_idx'),
+            Index(fields=['available', 'rating', 'book'], name='catalog_rating_idx'),
+            Index(fields=['available', 'likes', 'book'], name='catalog_likes_idx'),
+            Index(fields=['author', 'created_at', 'book'], name='catalog_author_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'Каталог: {self.title}'
+
+
+class BookCounterQueue(models.Model):
+    """
+    Модель очереди книг с изменившимися отношениями пользователей (режим отложенного пересчёта счётчиков):
+    запись только добавляется, а обработчик очереди пересчитывает каждую книгу один раз за проход
+    """
+    book = models.ForeignKey(Books, on_delete=models.CASCADE, verbose_name='Книга', related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return f'Пересчёт счётчиков: {self.book_id}'
+
+
+class BookSimilarity(models.Model):
+    """
+    Модель похожих книг (books.recommendations): для каждой книги хранятся до TOP_K соседей
+    по совместным положительным отношениям пользователей, rank - место соседа (с 0)
+    """
+    book = models.ForeignKey(Books, on_delete=models.CASCADE, verbose_name='Книга', related_name='+')
+    similar = models.ForeignKey(Books, on_delete=models.CASCADE, verbose_name='Похожая книга',
+                                related_name='similar_for')
+    rank = models.PositiveSmallIntegerField(verbose_name='Место')
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        ordering = ['book', 'rank']
+        # соседи книги читаются одним проходом по индексу
+        unique_together = ('book', 'rank')
+
+    def __str__(self):
+        return f'Похожая книга {self.similar_id} для {self.book_id}'
+
+
+class BookSimilarityQueue(models.Model):
+    """
+    Модель очереди изменений положительных отношений пользователей к книгам:
+    обработчик пересчитывает соседей книги и других книг пользователя один раз за проход.
+    Отметки добавляются и при каскадном удалении отношений вместе с книгой или пользователем,
+    поэтому id хранятся без внешних ключей
+    """
+    book_id = models.PositiveIntegerField(verbose_name='id книги')
+    user_id = models.PositiveIntegerField(verbose_name='id пользователя')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return f'Пересчёт похожих книг: {self.book_id}'
+
+
+class Leaderboard(models.Model):
+    """
+    Модель рейтинговой таблицы книг (books.leaderboards): лучшие книги всего каталога, категории
+    или библиотеки (книги в наличии) по байесовскому среднему оценок или по лайкам.
+    size - количество мест, по нему считается количество страниц без COUNT(*)
+    """
+    SCOPES = (
+        ('all', 'Все книги'),
+        ('category', 'Категория'),
+        ('library', 'Библиотека'),
+    )
+    METRICS = (
+        ('rating', 'Байесовское среднее оценок'),
+        ('likes', 'Мне нравится'),
+    )
+    scope = models.CharField(max_length=10, choices=SCOPES, verbose_name='Область')
+    scope_id = models.PositiveIntegerField(default=0, verbose_name='id категории или библиотеки')
+    metric = models.CharField(max_length=10, choices=METRICS, verbose_name='Показатель')
+    size = models.PositiveSmallIntegerField(default=0, verbose_name='Количество мест')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    class Meta:
+        unique_together = ('scope', 'scope_id', 'metric')
+
+    def __str__(self):
+        return f'Рейтинг {self.scope}:{self.scope_id} по {self.metric}'
+
+
+class LeaderboardQueue(models.Model):
+    """
+    Модель очереди книг, изменения которых нужно перенести в рейтинговые таблицы (books.leaderboards):
+    обработчик обновляет таблицы по каждой книге один раз за проход. Отметки добавляются и при удалении книги,
+    поэтому id хранится без внешнего ключа
+    """
+    book_id = models.PositiveIntegerField(verbose_name='id книги')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return f'Обновление рейтинговых таблиц: {self.book_id}'
+
+
+class LeaderboardEntry(models.Model):
+    """Модель места книги в рейтинговой таблице, страница таблицы - диапазон rank (с 1) по индексу"""
+    leaderboard = models.ForeignKey(Leaderboard, on_delete=models.CASCADE, verbose_name='Рейтинг',
+                                    related_name='entries')
+    rank = models.PositiveSmallIntegerField(verbose_name='Место')
+    book = models.ForeignKey(Books, on_delete=models.CASCADE, verbose_name='Книга', related_name='leaderboard_entries')
+    score = models.FloatField(verbose_name='Значение показателя')
+
+    class Meta:
+        ordering = ['leaderboard', 'rank']
+        unique_together = ('leaderboard', 'rank')
+
+    def __str__(self):
+        return f'{self.rank}. {self.book_id}'
@@ -0,0 +1,213 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from books.engine import CatalogEngineResult
+
+
+class BooksListPagination(PageNumberPagination):
+    """
+    Пагинация для списков книг со стабильным порядком для любого поля из ordering_fields
+    (дополнительно упорядочивается по pk, NULL-значения всегда в конце).
+    Без параметра cursor работает как обычная постраничная пагинация (PageNumberPagination).
+    С параметром cursor (для первой страницы - пустым) включается курсорная (keyset) пагинация
+    без COUNT(*) и OFFSET, поэтому любая страница стоит столько же, сколько первая.
+    """
+    cursor_query_param = 'cursor'
+    cursor_query_description = 'Курсор для keyset-пагинации (пустое значение - первая страница).'
+    ordering_param = api_settings.ORDERING_PARAM
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.field, self.descending = self.get_ordering(request, queryset, view)
+        if self.field in queryset.query.annotations:
+            # упорядочивание по аннотации (например, релевантности полнотекстового поиска)
+            self.model_field = queryset.query.annotations[self.field].output_field
+            self.nullable = False
+        else:
+            self.model_field = queryset.model._meta.get_field(self.field)
+            self.nullable = self.model_field.null
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset.order_by(*self.get_order_by(False)), request, view)
+
+        self.request = request
+        self.display_page_controls = False
+        self.page_size = self.get_page_size(request)
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.page_query_param)
+        position = self.decode_cursor(request)
+
+        reverse = bool(position and position['reverse'])
+        queryset = queryset.order_by(*self.get_order_by(reverse))
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position['value'], position['pk'], reverse))
+        return self.set_cursor_page(list(queryset[:self.page_size + 1]), position)
+
+    def paginate_engine(self, state, filters, queryset, request, view=None):
+        """
+        Пагинация по снимку каталога (books.engine.CatalogState): pk книг страницы берутся из снимка,
+        а строки - одним запросом по pk из queryset. Порядок, курсоры и ссылки совпадают с paginate_queryset
+        """
+        self.field, self.descending = self.get_ordering(request, queryset, view)
+        self.model_field = queryset.model._meta.get_field(self.field)
+        self.nullable = self.model_field.null
+        self.cursor_mode = self.cursor_query_param in request.query_params
+
+        def fetch(pks):
+            rows = {row.pk: row for row in queryset.filter(pk__in=pks)}
+            return [rows[pk] for pk in pks if pk in rows]
+
+        if not self.cursor_mode:
+            result = CatalogEngineResult(state, filters, self.field, self.descending, fetch)
+            return super().paginate_queryset(result, request, view)
+
+        self.request = request
+        self.display_page_controls = False
+        self.page_size = self.get_page_size(request)
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.page_query_param)
+        position = self.decode_cursor(request)
+        if position is None:
+            pks = state.page(filters, self.field, self.descending, 0, self.page_size + 1)
+        else:
+            pks = state.after(filters, self.field, self.descending, position['value'], position['pk'],
+                              position['reverse'], self.page_size + 1)
+        return self.set_cursor_page(fetch(pks), position)
+
+    def set_cursor_page(self, results, position):
+        """Страница курсорной пагинации из page_size + 1 записей (лишняя говорит о следующей странице)"""
+        reverse = bool(position and position['reverse'])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page_results = results
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.page_results:
+            return None
+        return self.encode_cursor(self.page_results[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous or not self.page_results:
+            return None
+        return self.encode_cursor(self.page_results[0], reverse=True)
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Определение поля упорядочивания: первое допустимое поле из параметра ordering,
+        иначе первое поле упорядочивания queryset или модели
+        """
+        valid_fields = getattr(view, 'ordering_fields', None) or []
+        params = request.query_params.get(self.ordering_param)
+        if params:
+            for term in params.split(','):
+                term = term.strip()
+                if term.lstrip('-') in valid_fields:
+                    return term.lstrip('-'), term.startswith('-')
+        ordering = queryset.query.order_by or queryset.model._meta.ordering or ['-pk']
+        term = ordering[0]
+        return term.lstrip('-'), term.startswith('-')
+
+    def get_order_by(self, reverse):
+        """Выражения упорядочивания: поле (NULL в конце) и pk в том же направлении"""
+        descending = self.descending != reverse
+        if descending:
+            return (F(self.field).desc(nulls_last=not reverse, nulls_first=reverse), F('pk').desc())
+        return (F(self.field).asc(nulls_last=not reverse, nulls_first=reverse), F('pk').asc())
+
+    def get_position_filter(self, value, pk, reverse):
+        """Условие keyset: записи строго после (или, при reverse, строго до) позиции курсора"""
+        field = self.field
+        greater = self.descending == reverse
+        pk_lookup = 'pk__gt' if greater else 'pk__lt'
+        if value is None:
+            if reverse:
+                return Q(**{f'{field}__isnull': False}) | Q(**{f'{field}__isnull': True, pk_lookup: pk})
+            return Q(**{f'{field}__isnull': True, pk_lookup: pk})
+        value_lookup = f'{field}__gt' if greater else f'{field}__lt'
+        condition = Q(**{value_lookup: value}) | Q(**{field: value, pk_lookup: pk})
+        if self.nullable and not reverse:
+            condition |= Q(**{f'{field}__isnull': True})
+        return condition
+
+    def encode_cursor(self, obj, reverse):
+        value = getattr(obj, self.field)
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        position = {
+            'o': f'-{self.field}' if self.descending else self.field,
+            'v': value,
+            'pk': obj.pk,
+            'r': reverse
+        }
+        cursor = urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """Разбор курсора из запроса, None для первой страницы"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            ordering = f'-{self.field}' if self.descending else self.field
+            if position['o'] != ordering:
+                raise ValueError('ordering changed')
+            value = position['v']
+            if value is not None:
+                value = self.model_field.to_python(value)
+            return {'value': value, 'pk': int(position['pk']), 'reverse': bool(position['r'])}
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_schema_fields(self, view):
+        fields = super().get_schema_fields(view)
+        return fields + [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(title='Cursor', description=self.cursor_query_description)
+            )
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': self.cursor_query_description,
+                'schema': {'type': 'string'},
+            },
+        ]
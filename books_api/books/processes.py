@@ -0,0 +1,14 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+
+
+def spawn_pool(workers):
+    """
+    Пул из workers процессов для параллельной работы с базой. Процессы запускаются методом spawn
+    (без унаследованных соединений с базой) и настраивают Django до загрузки задач:
+    модули с функциями задач импортируют модели
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=django.setup)
@@ -0,0 +1,275 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from books.leaderboards import rebuild_leaderboards
+from books.models import (
+    Authors, Books, Categories,
+    Libraries, BookLibraryAvailable, User,
+    UserBookOffer, UserBookRelation, UserBookSession
+)
+from books.recommendations import build_similar_books
+from books.services import recount_book_values, refresh_book_catalog
+from books.urls import router
+
+
+class Rollback(Exception):
+    """Исключение для отката транзакции с временными данными замера (общее для замеров и бенчмарков)"""
+
+
+class Endpoint:
+    """
+    Запрос к маршруту API для замера количества запросов к базе: имя маршрута, метод, роль пользователя
+    (None - анонимный, 'user' или 'admin'), а также функции, возвращающие по заполненным данным
+    аргументы маршрута и тело запроса
+    """
+
+    def __init__(self, name, method, role=None, kwargs=None, data=None, content_type='application/json'):
+        self.name = name
+        self.method = method
+        self.role = role
+        self.kwargs = kwargs
+        self.data = data
+        self.content_type = content_type
+
+    def __str__(self):
+        return f'{self.method.upper()} {self.name}'
+
+    def call(self, client, objects):
+        url = reverse(self.name, kwargs=self.kwargs(objects) if self.kwargs else None)
+        data = self.data(objects) if self.data else None
+        if self.method == 'get':
+            return client.get(url, data=data)
+        if self.content_type != 'application/json':
+            return getattr(client, self.method)(url, data=data, content_type=self.content_type)
+        return getattr(client, self.method)(url, data=data, format='json')
+
+
+def book_data(objects):
+    return {'title': 'Budget', 'description': '-', 'author': objects['author'].pk,
+            'categories': [objects['categories'][0].pk]}
+
+
+def session_data(objects):
+    today = datetime.date.today()
+    return {'books': [objects['book'].pk], 'library': objects['libraries'][0].pk,
+            'start_date': str(today), 'end_date': str(today + datetime.timedelta(days=7))}
+
+
+def edit_session_data(objects):
+    return {**session_data(objects), 'is_accepted': True, 'is_closed': False, 'message': '-'}
+
+
+def offer_data(objects):
+    return {'library': objects['libraries'][0].pk, 'quantity': 1, 'books_description': '-'}
+
+
+def edit_offer_data(objects):
+    return {**offer_data(objects), 'is_accepted': True, 'is_closed': False, 'message': '-'}
+
+
+def available_data(objects):
+    return {'book': objects['free_book'].pk, 'library': objects['libraries'][0].pk, 'available': True, 'copies': 1}
+
+
+def pk_of(key):
+    return lambda objects: {'pk': objects[key].pk}
+
+
+# Главные объекты заполнения связаны с N записями: книга - с N категориями, библиотеками, отношениями,
+# автор, категория и библиотека - с N книгами, пользователь - с N сессиями, предложениями и закладками
+ENDPOINTS = [
+    Endpoint('book-list', 'get'),
+    Endpoint('book-list', 'get', data=lambda objects: {'categories': objects['categories'][0].pk}),
+    Endpoint('book-list', 'post', 'admin', data=book_data),
+    Endpoint('book-facets', 'get'),
+    Endpoint('book-leaderboard', 'get'),
+    Endpoint('book-detail', 'get', kwargs=pk_of('book')),
+    Endpoint('book-detail', 'put', 'admin', kwargs=pk_of('book'), data=book_data),
+    Endpoint('book-detail', 'patch', 'admin', kwargs=pk_of('book'), data=lambda objects: {'title': 'Budget'}),
+    Endpoint('book-detail', 'delete', 'admin', kwargs=pk_of('book')),
+    Endpoint('book-similar', 'get', kwargs=pk_of('book')),
+    *(endpoint for name, key, data in (
+        ('author', 'author', {'last_name': 'Budget', 'first_name': 'Budget', 'description': '-'}),
+        ('category', 'category', {'title': 'Budget', 'description': '-'}),
+        ('library', 'library', {'title': 'Budget', 'location': '-', 'phone': '-'}),
+    ) for endpoint in (
+        Endpoint(f'{name}-list', 'get'),
+        Endpoint(f'{name}-list', 'post', 'admin', data=lambda objects, data=data: data),
+        Endpoint(f'{name}-detail', 'get', kwargs=pk_of(key)),
+        Endpoint(f'{name}-detail', 'put', 'admin', kwargs=pk_of(key), data=lambda objects, data=data: data),
+        Endpoint(f'{name}-detail', 'patch', 'admin', kwargs=pk_of(key), data=lambda objects: {'description': '+'}),
+        Endpoint(f'{name}-detail', 'delete', 'admin', kwargs=pk_of(key)),
+        Endpoint(f'{name}-books', 'get', kwargs=pk_of(key)),
+    )),
+    Endpoint('my-session-list', 'get', 'user'),
+    Endpoint('my-session-list', 'post', 'user', data=session_data),
+    Endpoint('my-session-detail', 'get', 'user', kwargs=pk_of('session')),
+    Endpoint('my-offer-list', 'get', 'user'),
+    Endpoint('my-offer-list', 'post', 'user', data=offer_data),
+    Endpoint('my-offer-detail', 'get', 'user', kwargs=pk_of('offer')),
+    Endpoint('my-bookmark-list', 'get', 'user'),
+    Endpoint('my-bookmark-detail', 'get', 'user', kwargs=pk_of('book')),
+    Endpoint('book-relation-detail', 'put', 'user', kwargs=lambda objects: {'book': objects['book'].pk},
+             data=lambda objects: {'book': objects['book'].pk, 'like': False, 'in_bookmarks': True, 'rate': 4}),
+    Endpoint('book-relation-detail', 'patch', 'user', kwargs=lambda objects: {'book': objects['book'].pk},
+             data=lambda objects: {'like': False}),
+    Endpoint('book-relation-bulk', 'post', 'user',
+             data=lambda objects: [{'book': objects['book'].pk, 'rate': 5}, {'book': objects['free_book'].pk}]),
+    Endpoint('available-list', 'get', 'admin'),
+    Endpoint('available-list', 'post', 'admin', data=available_data),
+    Endpoint('available-import', 'post', 'admin', content_type='text/csv',
+             data=lambda objects: f'book,library,available\n{objects["free_book"].pk},'
+                                  f'{objects["libraries"][0].pk},1\n'),
+    Endpoint('available-detail', 'get', 'admin', kwargs=pk_of('available')),
+    Endpoint('available-detail', 'put', 'admin', kwargs=pk_of('available'),
+             data=lambda objects: {'book': objects['book'].pk, 'library': objects['library'].pk,
+                                   'available': True, 'copies': 1000}),
+    Endpoint('available-detail', 'patch', 'admin', kwargs=pk_of('available'), data=lambda objects: {'copies': 999}),
+    Endpoint('available-detail', 'delete', 'admin', kwargs=pk_of('available')),
+    Endpoint('user-session-list', 'get', 'admin'),
+    Endpoint('user-session-detail', 'get', 'admin', kwargs=pk_of('session')),
+    Endpoint('user-session-detail', 'put', 'admin', kwargs=pk_of('session'), data=edit_session_data),
+    Endpoint('user-session-detail', 'patch', 'admin', kwargs=pk_of('session'),
+             data=lambda objects: {'is_accepted': True}),
+    Endpoint('user-session-detail', 'delete', 'admin', kwargs=pk_of('session')),
+    Endpoint('user-offer-list', 'get', 'admin'),
+    Endpoint('user-offer-detail', 'get', 'admin', kwargs=pk_of('offer')),
+    Endpoint('user-offer-detail', 'put', 'admin', kwargs=pk_of('offer'), data=edit_offer_data),
+    Endpoint('user-offer-detail', 'patch', 'admin', kwargs=pk_of('offer'), data=lambda objects: {'is_accepted': True}),
+    Endpoint('user-offer-detail', 'delete', 'admin', kwargs=pk_of('offer')),
+]
+
+
+def get_routes():
+    """
+    Пары (имя маршрута, метод) всех маршрутов books/urls.py, зарегистрированных в роутере.
+    HEAD не учитывается: ViewSet добавляет его в actions представления при первом запросе к маршруту
+    """
+    routes = set()
+    for pattern in router.urls:
+        for method in getattr(pattern.callback, 'actions', None) or {}:
+            if method != 'head':
+                routes.add((pattern.name, method))
+    return routes
+
+
+def fill(count):
+    """
+    Заполнение базы для замера: главные объекты связаны с count записями.
+    Возвращает словарь объектов, по которым строятся аргументы маршрутов и тела запросов
+    """
+    marker = f'budget-{time.time_ns()}'
+    user = User.objects.create_user(username=f'{marker}-user')
+    admin = User.objects.create_superuser(username=f'{marker}-admin', email='', password=None)
+    User.objects.bulk_create(User(username=f'{marker}-{i}') for i in range(count))
+    readers = list(User.objects.filter(username__regex=rf'^{marker}-\d+$'))
+    author = Authors.objects.create(first_name=marker, last_name='Author')
+    Categories.objects.bulk_create(Categories(title=f'{marker} {i}') for i in range(count))
+    categories = list(Categories.objects.filter(title__startswith=marker).order_by('pk'))
+    Libraries.objects.bulk_create(Libraries(title=f'{marker} {i}', location='-', phone='-') for i in range(count))
+    libraries = list(Libraries.objects.filter(title__startswith=marker).order_by('pk'))
+    # bulk_create не во всех СУБД возвращает pk, поэтому записи перечитываются по метке
+    Books.objects.bulk_create(Books(title=f'{marker} {i}', description='-', author=author) for i in range(count + 1))
+    books = list(Books.objects.filter(title__startswith=marker).order_by('pk'))
+    book, free_book, books = books[0], books[-1], books[:-1]
+    Books.categories.through.objects.bulk_create([
+        *(Books.categories.through(books_id=book.pk, categories_id=category.pk) for category in categories[1:]),
+        *(Books.categories.through(books_id=item.pk, categories_id=categories[0].pk) for item in books),
+    ])
+    BookLibraryAvailable.objects.bulk_create([
+        *(BookLibraryAvailable(book=book, library=library, available=True, copies=count + 10)
+          for library in libraries[1:]),
+        *(BookLibraryAvailable(book=item, library=libraries[0], available=True, copies=count + 10) for item in books),
+    ])
+    UserBookRelation.objects.bulk_create([
+        *(UserBookRelation(user=user, book=item, in_bookmarks=True, like=True, rate=5) for item in books),
+        *(UserBookRelation(user=reader, book=book, in_bookmarks=True, like=True, rate=4) for reader in readers),
+    ])
+    today = datetime.date.today()
+    UserBookSession.objects.bulk_create([
+        *(UserBookSession(user=user, library=libraries[0], start_date=today, end_date=today) for _ in range(count)),
+        *(UserBookSession(user=reader, library=libraries[0], start_date=today, end_date=today) for reader in readers),
+    ])
+    session = UserBookSession.objects.filter(user=user).order_by('pk').first()
+    session.books.add(*books)
+    UserBookOffer.objects.bulk_create([
+        *(UserBookOffer(user=user, library=libraries[0], quantity=1, books_description='-') for _ in range(count)),
+        *(UserBookOffer(user=reader, library=libraries[0], quantity=1, books_description='-') for reader in readers),
+    ])
+    book_ids = [item.pk for item in books] + [free_book.pk]
+    recount_book_values(book_ids)
+    refresh_book_catalog(book_ids, create=True)
+    build_similar_books()
+    rebuild_leaderboards()
+    return {
+        'user': user, 'admin': admin, 'author': author, 'book': book, 'free_book': free_book,
+        'categories': categories, 'category': categories[0], 'libraries': libraries, 'library': libraries[0],
+        'session': session, 'offer': UserBookOffer.objects.filter(user=user).order_by('pk').first(),
+        'available': BookLibraryAvailable.objects.get(book=book, library=libraries[0]),
+    }
+
+
+def count_queries(count, endpoints=ENDPOINTS):
+    """
+    Количество запросов к базе каждого запроса к API при заполнении count записями: {endpoint: (запросы, статус)}.
+    Заполнение и каждый запрос выполняются в транзакциях, которые затем откатываются,
+    поэтому запросы не влияют друг на друга, а кэш очищается перед каждым запросом (замеряется промах кэша).
+    Замер идёт на отдельных кэшах (isolated_caches), поэтому очистка и новые версии не затрагивают рабочий кэш
+    """
+    host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'testserver'
+    client = APIClient(HTTP_HOST=host.lstrip('.'))
+    results = {}
+    with isolated_caches():
+        try:
+            with transaction.atomic():
+                objects = fill(count)
+                for endpoint in endpoints:
+                    client.force_authenticate(objects[endpoint.role] if endpoint.role else None)
+                    cache.clear()
+                    try:
+                        with transaction.atomic(), CaptureQueriesContext(connection) as context:
+                            response = endpoint.call(client, objects)
+                            raise Rollback
+                    except Rollback:
+                        pass
+                    results[endpoint] = (len(context.captured_queries), response.status_code)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            cache.clear()
+    return results
+
+
+def isolated_caches():
+    """
+    Настройки замера: каждый псевдоним CACHES заменяется своим кэшем в памяти процесса, а кэширование
+    по версиям работает как в одном процессе (SINGLE_PROCESS). Иначе очистка кэша и новые версии
+    при заполнении сбросили бы ETag и кэш экземпляров работающего сервиса в общем кэше
+    """
+    return override_settings(
+        CACHES={alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                        'LOCATION': f'books-query-budget-{alias}'} for alias in settings.CACHES},
+        BOOKS_DETAIL_CACHE={**getattr(settings, 'BOOKS_DETAIL_CACHE', {}), 'SINGLE_PROCESS': True},
+    )
+
+
+def format_table(sizes, results):
+    """Таблица Markdown: запрос, роль, количество запросов к базе при каждом размере заполнения и статус ответа"""
+    lines = [
+        '| Запрос | Роль | ' + ' | '.join(f'N = {size}' for size in sizes) + ' | Статус |',
+        '|---|---|' + '---:|' * len(sizes) + '---|',
+    ]
+    for endpoint in results[sizes[0]]:
+        counts = [results[size][endpoint][0] for size in sizes]
+        statuses = sorted({results[size][endpoint][1] for size in sizes})
+        lines.append(f'| {endpoint} | {endpoint.role or "-"} | ' + ' | '.join(map(str, counts)) +
+                     f' | {", ".join(map(str, statuses))} |')
+    return '\n'.join(lines)
@@ -0,0 +1,208 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from books.cache import bump_versions
+from books.models import BookSimilarity, BookSimilarityQueue, UserBookRelation
+
+
+DEFAULT_RECOMMENDATIONS_SETTINGS = {
+    'BACKEND': 'auto',
+    'TOP_K': 20,
+    'MIN_RATE': 4,
+    'BATCH_SIZE': 1000,
+    'FLUSH_INTERVAL': 60,
+}
+
+
+def get_recommendations_settings():
+    return {**DEFAULT_RECOMMENDATIONS_SETTINGS, **getattr(settings, 'BOOKS_RECOMMENDATIONS', {})}
+
+
+def positive_relations():
+    """Положительные отношения: лайк, закладка или оценка не ниже MIN_RATE"""
+    min_rate = get_recommendations_settings()['MIN_RATE']
+    return UserBookRelation.objects.filter(Q(like=True) | Q(in_bookmarks=True) | Q(rate__gte=min_rate)).order_by()
+
+
+def is_positive(values):
+    """Положительно ли отношение со значениями get_relation_values (None - отношения нет)"""
+    if not values:
+        return False
+    min_rate = get_recommendations_settings()['MIN_RATE']
+    return bool(values['like'] or values['in_bookmarks'] or (values['rate'] or 0) >= min_rate)
+
+
+def positive_changed(old_values, new_values):
+    return is_positive(old_values) != is_positive(new_values)
+
+
+def mark_similar_books(user_id, book_ids):
+    """
+    Функция для добавления в очередь пересчёта похожих книг изменений положительных отношений пользователя,
+    в качестве аргументов принимает id пользователя и id книг
+    """
+    mark_similar_relations((user_id, book_id) for book_id in book_ids)
+
+
+def mark_similar_relations(pairs):
+    """То же для отношений нескольких пользователей одним INSERT, принимает пары (id пользователя, id книги)"""
+    BookSimilarityQueue.objects.bulk_create([
+        BookSimilarityQueue(user_id=user_id, book_id=book_id) for user_id, book_id in set(pairs)
+    ])
+
+
+class PythonSimilarity:
+    """
+    Соседи книг по совместным положительным отношениям пользователей на чистом Python.
+    Сходство - косинусная мера: количество общих пользователей / sqrt(n1 * n2),
+    где n - количество положительных отношений книги (из counts, а если книги там нет - из pairs)
+    """
+
+    def __init__(self, pairs, counts):
+        self.users = defaultdict(list)
+        self.books = defaultdict(list)
+        for user_id, book_id in pairs:
+            self.users[user_id].append(book_id)
+            self.books[book_id].append(user_id)
+        self.counts = {book_id: counts.get(book_id) or len(users) for book_id, users in self.books.items()}
+
+    def neighbours(self, book_ids, top_k):
+        """Словарь {id книги: [(id соседа, сходство), ...]} по убыванию сходства (при равенстве - по id)"""
+        result = {}
+        for book_id in book_ids:
+            common = Counter()
+            for user_id in self.books.get(book_id, ()):
+                common.update(self.users[user_id])
+            common.pop(book_id, None)
+            scores = ((-(value / math.sqrt(self.counts[book_id] * self.counts[other])), other)
+                      for other, value in common.items())
+            result[book_id] = [(other, -score) for score, other in heapq.nsmallest(top_k, scores)]
+        return result
+
+
+class NumpySimilarity:
+    """
+    То же, что PythonSimilarity, на разреженных матрицах SciPy: матрица пользователи x книги,
+    совместные отношения пачки книг со всеми книгами - одно произведение матриц,
+    сходство и упорядочивание соседей считаются векторно по строке результата
+    """
+
+    def __init__(self, pairs, counts):
+        import numpy as np
+        from scipy import sparse
+        self.np = np
+        data = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        user_ids, users = np.unique(data[:, 0], return_inverse=True)
+        self.book_ids, books = np.unique(data[:, 1], return_inverse=True)
+        self.matrix = sparse.csc_matrix((np.ones(len(data)), (users, books)),
+                                        shape=(len(user_ids), len(self.book_ids)))
+        observed = np.bincount(books, minlength=len(self.book_ids))
+        self.totals = np.array([counts.get(book_id) or total for book_id, total in zip(
+            self.book_ids.tolist(), observed.tolist())], dtype=np.float64)
+
+    def neighbours(self, book_ids, top_k):
+        np = self.np
+        result = {book_id: [] for book_id in book_ids}
+        targets = np.array(sorted(result), dtype=np.int64)
+        positions = np.searchsorted(self.book_ids, targets)
+        found = positions < len(self.book_ids)
+        found[found] = self.book_ids[positions[found]] == targets[found]
+        positions = positions[found]
+        if not len(positions):
+            return result
+        common = (self.matrix[:, positions].T @ self.matrix).tocsr()
+        for row, position in enumerate(positions.tolist()):
+            start, end = common.indptr[row], common.indptr[row + 1]
+            columns, values = common.indices[start:end], common.data[start:end]
+            keep = columns != position
+            columns, values = columns[keep], values[keep]
+            scores = values / np.sqrt(self.totals[position] * self.totals[columns])
+            order = np.lexsort((self.book_ids[columns], -scores))[:top_k]
+            result[int(self.book_ids[position])] = list(zip(
+                self.book_ids[columns[order]].tolist(), scores[order].tolist()))
+        return result
+
+
+def get_similarity_class():
+    """NumpySimilarity при установленных numpy и scipy (BACKEND 'auto' или 'numpy'), иначе PythonSimilarity"""
+    if get_recommendations_settings()['BACKEND'] != 'python':
+        try:
+            import numpy  # noqa: F401
+            import scipy.sparse  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            return NumpySimilarity
+    return PythonSimilarity
+
+
+def save_similar_books(neighbours):
+    """Замена соседей книг (словарь из neighbours) и инвалидация закэшированных ответов"""
+    with transaction.atomic():
+        BookSimilarity.objects.filter(book_id__in=list(neighbours)).delete()
+        BookSimilarity.objects.bulk_create([
+            BookSimilarity(book_id=book_id, similar_id=similar_id, rank=rank, score=score)
+            for book_id, items in neighbours.items() for rank, (similar_id, score) in enumerate(items)
+        ], batch_size=1000)
+    bump_versions([('similar', book_id) for book_id in neighbours])
+
+
+def build_similar_books():
+    """
+    Функция для полного построения соседей всех книг: положительные отношения читаются одним запросом,
+    соседи считаются и сохраняются пачками по BATCH_SIZE книг. Возвращает количество книг
+    """
+    conf = get_recommendations_settings()
+    pairs = list(positive_relations().values_list('user_id', 'book_id'))
+    counts = Counter(book_id for _, book_id in pairs)
+    similarity = get_similarity_class()(pairs, counts)
+    book_ids = sorted(counts)
+    # у книг без положительных отношений соседей больше нет
+    stale = set(BookSimilarity.objects.order_by().values_list('book_id', flat=True).distinct()) - counts.keys()
+    save_similar_books(dict.fromkeys(stale, []))
+    for start in range(0, len(book_ids), conf['BATCH_SIZE']):
+        save_similar_books(similarity.neighbours(book_ids[start:start + conf['BATCH_SIZE']], conf['TOP_K']))
+    return len(book_ids)
+
+
+def refresh_similar_books(book_ids):
+    """
+    Функция для пересчёта соседей нескольких книг: читаются только положительные отношения пользователей
+    этих книг и количество положительных отношений их соседей, остальные книги не затрагиваются
+    """
+    book_ids = set(book_ids)
+    if not book_ids:
+        return
+    relations = positive_relations()
+    related = relations.filter(user_id__in=relations.filter(book_id__in=book_ids).values('user_id'))
+    pairs = list(related.values_list('user_id', 'book_id'))
+    counts = dict(relations.filter(book_id__in=related.values('book_id')).values('book_id').annotate(
+        count=Count('pk')).values_list('book_id', 'count'))
+    similarity = get_similarity_class()(pairs, counts)
+    save_similar_books(similarity.neighbours(book_ids, get_recommendations_settings()['TOP_K']))
+
+
+def flush_similar_books(batch_size=None):
+    """
+    Функция для обработки очереди изменений положительных отношений: пересчитываются соседи изменённых книг
+    и текущих положительных книг тех же пользователей (у них изменилось количество общих пользователей).
+    Соседи остальных книг, у которых изменилась только нормировка сходства, обновляются полным построением.
+    Возвращает количество пересчитанных книг
+    """
+    batch_size = batch_size or get_recommendations_settings()['BATCH_SIZE']
+    with transaction.atomic():
+        queue = BookSimilarityQueue.objects.select_for_update(skip_locked=True).order_by('pk')
+        entries = list(queue.values_list('pk', 'user_id', 'book_id')[:batch_size])
+        if not entries:
+            return 0
+        book_ids = {book_id for _, _, book_id in entries}
+        book_ids.update(positive_relations().filter(
+            user_id__in={user_id for _, user_id, _ in entries}).values_list('book_id', flat=True))
+        refresh_similar_books(book_ids)
+        BookSimilarityQueue.objects.filter(pk__in=[pk for pk, _, _ in entries]).delete()
+    return len(book_ids)
@@ -0,0 +1,193 @@
+from collections import defaultdict
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import ManyToManyField
+from rest_framework import serializers
+from rest_framework.fields import ReadOnlyField, CharField, BooleanField, IntegerField
+from rest_framework.relations import ManyRelatedField, SlugRelatedField
+from rest_framework.response import Response
+
+from books.fields import HyperlinkedIdentityField
+
+
+# Поля DRF, чьё представление совпадает со значением из базы
+IDENTITY_FIELDS = (ReadOnlyField, CharField, BooleanField, IntegerField)
+
+
+class UnsupportedSerializer(Exception):
+    """Сериализатор нельзя выполнить без экземпляров модели"""
+
+
+class RowSerializer:
+    """
+    Быстрая сериализация списков без создания экземпляров модели и обхода полей DRF для каждой строки.
+    Из ModelSerializer берутся столбцы, нужные его полям: запрос выполняется через values_list,
+    а строки в словари превращает функция, один раз сгенерированная для сериализатора.
+    Поддерживаются поля модели (в том числе через ForeignKey без NULL, например 'user.username'),
+    HyperlinkedIdentityField из books.fields, SlugRelatedField(many=True) (одним дополнительным запросом на страницу)
+    и вычисляемые поля из Meta.row_sources: {'поле': (('столбец', ...), функция)}.
+    Результат совпадает с serializer_class(..., many=True).data
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.columns = ['pk']
+        self.globals = {}
+        self.urls = {}
+        self.related = {}
+        row_sources = getattr(serializer_class.Meta, 'row_sources', {})
+        items = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if name in row_sources:
+                columns, function = row_sources[name]
+                self.globals[f'f_{name}'] = function
+                args = ', '.join(f'r[{self.column(column)}]' for column in columns)
+                items.append((name, f'f_{name}({args})'))
+            else:
+                items.append((name, self.compile_field(name, field)))
+        body = ''.join(f'        {name!r}: {expression},\n' for name, expression in items)
+        args = ', '.join([*self.urls, *self.related])
+        source = f'def factory({args}):\n    def row(r):\n        return {{\n{body}        }}\n    return row\n'
+        exec(compile(source, f'<row serializer {serializer_class.__name__}>', 'exec'), self.globals)
+        self.factory = self.globals['factory']
+
+    def column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return self.columns.index(column)
+
+    def compile_field(self, name, field):
+        if isinstance(field, HyperlinkedIdentityField):
+            if field.lookup_field != 'pk':
+                self.get_model_field(field.lookup_field.split('__'))
+            self.urls[f'u_{name}'] = field
+            return f'u_{name}(r[{self.column(field.lookup_field)}])'
+        if isinstance(field, ManyRelatedField) and isinstance(field.child_relation, SlugRelatedField):
+            model_field = self.get_model_field(field.source_attrs)
+            if not isinstance(model_field, ManyToManyField) or len(field.source_attrs) > 1:
+                raise UnsupportedSerializer(name)
+            self.related[f'm_{name}'] = (model_field, field.child_relation.slug_field)
+            return f'm_{name}.get(r[0], [])'
+        if field.source == '*' or isinstance(field, serializers.RelatedField) or isinstance(field, ManyRelatedField):
+            raise UnsupportedSerializer(name)
+        model_field = self.get_model_field(field.source_attrs)
+        if model_field.is_relation:
+            raise UnsupportedSerializer(name)
+        position = self.column('__'.join(field.source_attrs))
+        if isinstance(field, IDENTITY_FIELDS) and not getattr(model_field, 'choices', None):
+            return f'r[{position}]'
+        # пустые значения сериализатор DRF отдаёт как None, не вызывая to_representation
+        self.globals[f'c_{name}'] = field.to_representation
+        return f'(None if r[{position}] is None else c_{name}(r[{position}]))'
+
+    def get_model_field(self, attrs):
+        """Поле модели по пути source; промежуточные связи должны быть ForeignKey без NULL"""
+        model = self.model
+        try:
+            for attr in attrs[:-1]:
+                field = model._meta.get_field(attr)
+                if not (field.many_to_one and field.concrete) or field.null:
+                    raise UnsupportedSerializer(attr)
+                model = field.related_model
+            field = model._meta.get_field(attrs[-1])
+        except FieldDoesNotExist:
+            raise UnsupportedSerializer('.'.join(attrs))
+        if not field.concrete and not field.many_to_many:
+            raise UnsupportedSerializer('.'.join(attrs))
+        return field
+
+    def prepare(self, queryset, extra_columns=()):
+        """
+        Запрос строк с нужными столбцами, extra_columns - дополнительные столбцы,
+        которые нужны пагинации (поля упорядочивания) и в результат не попадают
+        """
+        columns = list(dict.fromkeys([*self.columns, *extra_columns]))
+        return queryset.prefetch_related(None).values_list(*columns, named=True)
+
+    def get_related(self, rows):
+        pks = [row[0] for row in rows]
+        related = {}
+        for name, (model_field, slug_field) in self.related.items():
+            values = defaultdict(list)
+            if pks:
+                lookup = model_field.related_query_name()
+                queryset = model_field.related_model.objects.filter(**{f'{lookup}__in': pks})
+                for pk, value in queryset.values_list(lookup, slug_field):
+                    values[pk].append(value)
+            related[name] = values
+        return related
+
+    def get_urls(self, context):
+        request, format = context.get('request'), context.get('format')
+        urls = {}
+        for name, field in self.urls.items():
+            field_format = field.format if format and field.format and field.format != format else format
+            urls[name] = (lambda field, field_format: lambda value: field.format_url(
+                value, field.view_name, request, field_format
+            ))(field, field_format)
+        return urls
+
+    def serialize(self, rows, context):
+        rows = list(rows)
+        row = self.factory(**self.get_urls(context), **self.get_related(rows))
+        return [row(r) for r in rows]
+
+
+@lru_cache(maxsize=None)
+def get_row_serializer(serializer_class):
+    """RowSerializer для сериализатора или None, если его поля требуют экземпляров модели"""
+    try:
+        return RowSerializer(serializer_class)
+    except UnsupportedSerializer:
+        return None
+
+
+class RowListMixin:
+    """
+    Примесь для ViewSet: списки (действие list и действия, вызывающие row_list)
+    сериализуются через RowSerializer, если сериализатор действия это поддерживает
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.row_list(self.filter_queryset(self.get_queryset()))
+
+    def row_list(self, queryset):
+        row_serializer = get_row_serializer(self.get_serializer_class())
+        if row_serializer is None:
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
+            serializer = self.get_serializer(queryset, many=True)
+            return Response(serializer.data)
+
+        queryset = row_serializer.prepare(queryset, self.get_ordering_columns(queryset))
+        page = self.paginate_queryset(queryset)
+        data = row_serializer.serialize(page if page is not None else queryset, self.get_serializer_context())
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def get_ordering_columns(self, queryset):
+        """Локальные поля и аннотации, по которым может упорядочиваться (и строить курсор) пагинация"""
+        terms = [*(getattr(self, 'ordering_fields', None) or []), *queryset.query.order_by,
+                 *queryset.model._meta.ordering]
+        columns = []
+        for term in terms:
+            if not isinstance(term, str):
+                continue
+            name = term.lstrip('-')
+            if name in queryset.query.annotations:
+                columns.append(name)
+                continue
+            try:
+                field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete and not field.is_relation:
+                columns.append(name)
+        return columns
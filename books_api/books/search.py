@@ -0,0 +1,251 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from functools import reduce
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Q
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+from books.models import Authors, BookCatalog, Categories, Libraries, UserBookOffer
+
+
+# Модели с полем search_vector и поля, из которых строится поисковый документ
+SEARCH_DOCUMENTS = {
+    BookCatalog: ('title',),
+    Authors: ('first_name', 'last_name'),
+    Categories: ('title',),
+    Libraries: ('title',),
+    UserBookOffer: ('books_description',),
+}
+
+DEFAULT_SEARCH_SETTINGS = {
+    'BACKEND': 'auto',
+    'CONFIG': 'russian',
+}
+
+TOKEN_RE = re.compile(r'\w+')
+
+_backend = None
+
+
+def get_search_settings():
+    return {**DEFAULT_SEARCH_SETTINGS, **getattr(settings, 'BOOKS_SEARCH', {})}
+
+
+def get_search_backend():
+    """
+    Получение бэкенда полнотекстового поиска из настройки BOOKS_SEARCH['BACKEND']:
+    'auto' - PostgresSearchBackend для PostgreSQL, иначе LocalSearchBackend,
+    либо путь к классу бэкенда
+    """
+    global _backend
+    if _backend is None:
+        path = get_search_settings()['BACKEND']
+        if path == 'auto':
+            backend_class = PostgresSearchBackend if connection.vendor == 'postgresql' else LocalSearchBackend
+        else:
+            backend_class = import_string(path)
+        _backend = backend_class()
+    return _backend
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class PostgresSearchBackend:
+    """
+    Поиск по полю search_vector (tsvector с GIN-индексом) с конфигурацией из BOOKS_SEARCH['CONFIG'],
+    вектор пересчитывается для каждой изменённой записи. Каждый токен запроса ищется как префикс
+    лексемы (to_tsquery с :*), как и в LocalSearchBackend: неполное слово ('Толс') тоже находит запись
+    """
+    ranked = True
+
+    def __init__(self):
+        self.config = get_search_settings()['CONFIG']
+
+    def update(self, model, pks):
+        model.objects.filter(pk__in=pks).update(
+            search_vector=SearchVector(*SEARCH_DOCUMENTS[model], config=self.config))
+
+    def remove(self, model, pks):
+        pass
+
+    def rebuild(self, model):
+        model.objects.update(search_vector=SearchVector(*SEARCH_DOCUMENTS[model], config=self.config))
+
+    def get_query(self, text):
+        # токены состоят только из букв и цифр, поэтому операторы tsquery в запрос не попадут
+        return SearchQuery(' & '.join(f"'{token}':*" for token in tokenize(text)), config=self.config,
+                           search_type='raw')
+
+    def condition(self, model, vector_field, text):
+        if not tokenize(text):
+            return Q(pk__in=[])
+        return Q(**{vector_field: self.get_query(text)})
+
+
+class LocalSearchIndex:
+    """
+    Инвертированный индекс в памяти процесса для одной модели:
+    токен -> множество pk. Строится при первом обращении и обновляется сигналами.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.lock = threading.Lock()
+        self.postings = defaultdict(set)
+        self.documents = {}
+        self.vocabulary = []
+        self.built = False
+
+    def build(self):
+        with self.lock:
+            self.postings.clear()
+            self.documents.clear()
+            for pk, *values in self.model.objects.values_list('pk', *self.fields).iterator():
+                self._add(pk, values)
+            self.vocabulary = sorted(self.postings)
+            self.built = True
+
+    def _add(self, pk, values):
+        tokens = {token for value in values for token in tokenize(value)}
+        self.documents[pk] = tokens
+        for token in tokens:
+            self.postings[token].add(pk)
+
+    def _remove(self, pk):
+        for token in self.documents.pop(pk, ()):
+            self.postings[token].discard(pk)
+            if not self.postings[token]:
+                del self.postings[token]
+
+    def update(self, pks):
+        if not self.built:
+            return
+        rows = self.model.objects.filter(pk__in=pks).values_list('pk', *self.fields)
+        with self.lock:
+            for pk, *values in rows:
+                self._remove(pk)
+                self._add(pk, values)
+            self.vocabulary = sorted(self.postings)
+
+    def remove(self, pks):
+        if not self.built:
+            return
+        with self.lock:
+            for pk in pks:
+                self._remove(pk)
+            self.vocabulary = sorted(self.postings)
+
+    def _match(self, tokens):
+        result = None
+        for token in tokens:
+            matched = set()
+            position = bisect_left(self.vocabulary, token)
+            while position < len(self.vocabulary) and self.vocabulary[position].startswith(token):
+                matched |= self.postings[self.vocabulary[position]]
+                position += 1
+            result = matched if result is None else result & matched
+            if not result:
+                break
+        return result or set()
+
+    def search(self, tokens):
+        """
+        pk документов, в которых для каждого токена запроса есть слово, начинающееся с него.
+        Найденные документы перечитываются из базы по pk, поэтому устаревшие записи индекса
+        (например, после отката транзакции) исправляются и не попадают в результат
+        """
+        if not self.built:
+            self.build()
+        with self.lock:
+            candidates = self._match(tokens)
+        if not candidates:
+            return set()
+        rows = self.model.objects.filter(pk__in=candidates).values_list('pk', *self.fields)
+        with self.lock:
+            for pk, *values in rows:
+                self._remove(pk)
+                self._add(pk, values)
+            for pk in candidates - {row[0] for row in rows}:
+                self._remove(pk)
+            self.vocabulary = sorted(self.postings)
+            return {pk for pk in candidates if pk in self.documents and all(
+                any(word.startswith(token) for word in self.documents[pk]) for token in tokens)}
+
+
+class LocalSearchBackend:
+    """
+    Запасной бэкенд без PostgreSQL (например, для тестов на SQLite):
+    локальный индекс в памяти процесса, совпадение по префиксам слов, без ранжирования.
+    """
+    ranked = False
+
+    def __init__(self):
+        self.indexes = {model: LocalSearchIndex(model, fields) for model, fields in SEARCH_DOCUMENTS.items()}
+
+    def update(self, model, pks):
+        self.indexes[model].update(pks)
+
+    def remove(self, model, pks):
+        self.indexes[model].remove(pks)
+
+    def rebuild(self, model):
+        self.indexes[model].build()
+
+    def condition(self, model, vector_field, text):
+        tokens = tokenize(text)
+        prefix, document_model = resolve_vector_field(model, vector_field)
+        pks = self.indexes[document_model].search(tokens) if tokens else set()
+        return Q(**{f'{prefix}__pk__in' if prefix else 'pk__in': pks})
+
+
+def resolve_vector_field(model, vector_field):
+    """Разбор пути к полю search_vector: (путь к модели документа, модель документа)"""
+    parts = vector_field.split('__')
+    for part in parts[:-1]:
+        model = model._meta.get_field(part).related_model
+    return '__'.join(parts[:-1]), model
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    Замена SearchFilter на полнотекстовый поиск по индексу.
+    Представление задаёт search_vector_field - путь к полю search_vector
+    (например, 'search_vector' или 'books__catalog__search_vector'),
+    остальные search_fields ищутся как в SearchFilter и объединяются с полнотекстовым поиском через ИЛИ.
+    Если упорядочивание не задано, результаты в PostgreSQL упорядочиваются по релевантности.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        vector_field = getattr(view, 'search_vector_field', None)
+        search_terms = self.get_search_terms(request)
+        if not vector_field or not search_terms:
+            return super().filter_queryset(request, queryset, view)
+
+        backend = get_search_backend()
+        text = ' '.join(search_terms)
+        condition = backend.condition(queryset.model, vector_field, text)
+        search_fields = self.get_search_fields(view, request)
+        if search_fields:
+            orm_lookups = [self.construct_search(str(search_field)) for search_field in search_fields]
+            condition |= reduce(lambda q, term: q & reduce(
+                lambda inner, lookup: inner | Q(**{lookup: term}), orm_lookups, Q()), search_terms, Q())
+
+        queryset = queryset.filter(condition)
+        if self.must_call_distinct(queryset, [vector_field, *(search_fields or [])]):
+            return queryset.distinct()
+        if backend.ranked and api_settings.ORDERING_PARAM not in request.query_params:
+            ordering = queryset.query.order_by or queryset.model._meta.ordering
+            queryset = queryset.annotate(
+                search_rank=SearchRank(F(vector_field), backend.get_query(text))
+            ).order_by('-search_rank', *ordering)
+        return queryset
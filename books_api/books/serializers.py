@@ -1,13 +1,18 @@
 import datetime
 
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
+from books.fields import HyperlinkedIdentityField
 from books.models import (
     Books, Authors,
     Categories, Libraries,
     BookLibraryAvailable, UserBookSession,
-    User, UserBookRelation, UserBookOffer
+    User, UserBookRelation, UserBookOffer,
+    BookCatalog, format_author_name, format_author_full_name
 )
+from books.services import ReservationError, reserve_session
 
 
 class BooksListSerializer(serializers.ModelSerializer):
@@ -17,11 +22,28 @@ class BooksListSerializer(serializers.ModelSerializer):
     """
     author = serializers.ReadOnlyField(source='author.get_name')
     categories = serializers.SlugRelatedField(slug_field='title', read_only=True, many=True)
-    url = serializers.HyperlinkedIdentityField(view_name='book-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='book-detail', read_only=True)
 
     class Meta:
         model = Books
         fields = ('title', 'author', 'categories', 'url')
+        row_sources = {
+            'author': (('author__first_name', 'author__middle_name', 'author__last_name'), format_author_name)
+        }
+
+
+class BookCatalogListSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для получения списка книг из каталога
+    с гиперссылками на экземпляры книг (представление совпадает с BooksListSerializer)
+    """
+    author = serializers.ReadOnlyField(source='author_name')
+    categories = serializers.ReadOnlyField()
+    url = HyperlinkedIdentityField(view_name='book-detail', read_only=True)
+
+    class Meta:
+        model = BookCatalog
+        fields = ('title', 'author', 'categories', 'url')
 
 
 class CategoriesForBooksDetailSerializer(serializers.ModelSerializer):
@@ -29,7 +51,7 @@ class CategoriesForBooksDetailSerializer(serializers.ModelSerializer):
     Сериализатор для представления категорий при получении экземпляра книги
     с гиперссылкой на книги из данной категории
     """
-    url = serializers.HyperlinkedIdentityField(view_name='category-books', read_only=True)
+    url = HyperlinkedIdentityField(view_name='category-books', read_only=True)
 
     class Meta:
         model = Categories
@@ -41,7 +63,7 @@ class AuthorForBooksDetailSerializer(serializers.ModelSerializer):
     Сериализатор для представления автора при получении экземпляра книги
     с гиперссылкой на книги автора
     """
-    url = serializers.HyperlinkedIdentityField(view_name='author-books', read_only=True)
+    url = HyperlinkedIdentityField(view_name='author-books', read_only=True)
     full_name = serializers.ReadOnlyField(source='__str__')
 
     class Meta:
@@ -63,7 +85,6 @@ class BooksDetailSerializer(serializers.ModelSerializer):
     author = AuthorForBooksDetailSerializer(read_only=True)
     categories = CategoriesForBooksDetailSerializer(many=True, read_only=True)
     lib_available = LibrariesForBooksDetailSerializer(many=True, read_only=True)
-    reading_now = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Books
@@ -84,12 +105,13 @@ class AuthorsListSerializer(serializers.ModelSerializer):
     Сериализатор для получения списка авторов
     с гиперссылками на экземпляры авторов
     """
-    url = serializers.HyperlinkedIdentityField(view_name='author-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='author-detail', read_only=True)
     full_name = serializers.ReadOnlyField(source='__str__')
 
     class Meta:
         model = Authors
         fields = ('full_name', 'url')
+        row_sources = {'full_name': (('first_name', 'middle_name', 'last_name'), format_author_full_name)}
 
 
 class AuthorDetailSerializer(serializers.ModelSerializer):
@@ -97,7 +119,7 @@ class AuthorDetailSerializer(serializers.ModelSerializer):
     Сериализатор для получения экземпляра автора
     с гиперссылкой на его книги
     """
-    url = serializers.HyperlinkedIdentityField(view_name='author-books', read_only=True)
+    url = HyperlinkedIdentityField(view_name='author-books', read_only=True)
 
     class Meta:
         model = Authors
@@ -117,7 +139,7 @@ class CategoriesListSerializer(serializers.ModelSerializer):
     Сериализатор для получения списка категорий
     с гиперссылками на экземпляры категорий
     """
-    url = serializers.HyperlinkedIdentityField(view_name='category-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='category-detail', read_only=True)
 
     class Meta:
         model = Categories
@@ -129,7 +151,7 @@ class CategoryDetailSerializer(serializers.ModelSerializer):
     Сериализатор для получения экземпляра категории
     с гиперссылкой на книги данной категории
     """
-    url = serializers.HyperlinkedIdentityField(view_name='category-books', read_only=True)
+    url = HyperlinkedIdentityField(view_name='category-books', read_only=True)
 
     class Meta:
         model = Categories
@@ -149,7 +171,7 @@ class LibrariesListSerializer(serializers.ModelSerializer):
     Сериализатор для получения списка библиотек
     с гиперссылками на экземпляры библиотек
     """
-    url = serializers.HyperlinkedIdentityField(view_name='library-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='library-detail', read_only=True)
 
     class Meta:
         model = Libraries
@@ -161,7 +183,7 @@ class LibraryDetailSerializer(serializers.ModelSerializer):
     Сериализатор для получения экземпляра библиотеки
     с гиперссылкой на книги из данной библиотеки
     """
-    url = serializers.HyperlinkedIdentityField(view_name='library-books', read_only=True)
+    url = HyperlinkedIdentityField(view_name='library-books', read_only=True)
 
     class Meta:
         model = Libraries
@@ -181,7 +203,7 @@ class MyBooksSessionsListSerializer(serializers.ModelSerializer):
     Сериализатор для получения списка своих сессий
     с гиперссылками на их экземпляры
     """
-    url = serializers.HyperlinkedIdentityField(view_name='my-session-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='my-session-detail', read_only=True)
     user = serializers.ReadOnlyField(source='user.username')
     library = serializers.ReadOnlyField(source='library.title')
 
@@ -228,19 +250,36 @@ class BooksSessionCreateSerializer(serializers.ModelSerializer):
             if not available_object.available:
                 raise serializers.ValidationError(f'В данный момент {available_object.library} '
                                                   f'не имеет в наличии {available_object.book}')
+            if available_object.reserved >= available_object.copies:
+                raise serializers.ValidationError(f'В данный момент {available_object.library} '
+                                                  f'не имеет свободных экземпляров {available_object.book}')
         if data['start_date'] < datetime.datetime.now().date():
             raise serializers.ValidationError("Дата начала периода не может быть раньше сегодняшнего дня")
         if data['start_date'] >= data['end_date']:
             raise serializers.ValidationError("Дата конца должна быть позже даты начала")
         return data
 
+    def create(self, validated_data):
+        """
+        Создание сессии и резервирование экземпляров её книг в одной транзакции:
+        проверка в validate выполняется без блокировок, поэтому окончательно свободные экземпляры
+        проверяются условным UPDATE в reserve_session, и при нехватке сессия не создаётся
+        """
+        with transaction.atomic():
+            session = super().create(validated_data)
+            try:
+                reserve_session(session)
+            except ReservationError as error:
+                raise serializers.ValidationError(str(error))
+        return session
+
 
 class UserBooksSessionsListSerializer(serializers.ModelSerializer):
     """
     Сериализатор для получения списка сессий пользователей
     с гиперссылками на их экземпляры
     """
-    url = serializers.HyperlinkedIdentityField(view_name='user-session-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='user-session-detail', read_only=True)
     user = serializers.ReadOnlyField(source='user.username')
     library = serializers.ReadOnlyField(source='library.title')
 
@@ -279,7 +318,7 @@ class BooksLibrariesAvailableListSerializer(serializers.ModelSerializer):
     """
     book = serializers.ReadOnlyField(source='book.title')
     library = serializers.ReadOnlyField(source='library.title')
-    url = serializers.HyperlinkedIdentityField(view_name='available-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='available-detail', read_only=True)
 
     class Meta:
         model = BookLibraryAvailable
@@ -293,7 +332,7 @@ class BooksLibrariesAvailableDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = BookLibraryAvailable
-        fields = ('id', 'book', 'library', 'available')
+        fields = ('id', 'book', 'library', 'available', 'copies', 'reserved')
 
 
 class BooksLibrariesAvailableEditSerializer(serializers.ModelSerializer):
@@ -301,7 +340,14 @@ class BooksLibrariesAvailableEditSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = BookLibraryAvailable
-        fields = ('id', 'book', 'library', 'available')
+        fields = ('id', 'book', 'library', 'available', 'copies', 'reserved')
+        read_only_fields = ('reserved',)
+
+    def validate_copies(self, value):
+        """Проверка, что экземпляров не меньше уже зарезервированных"""
+        if self.instance is not None and value < self.instance.reserved:
+            raise serializers.ValidationError(f'Зарезервировано {self.instance.reserved} экземпляров.')
+        return value
 
 
 class UserBookRelationSerializer(serializers.ModelSerializer):
@@ -312,12 +358,48 @@ class UserBookRelationSerializer(serializers.ModelSerializer):
         exclude = ('user', 'id')
 
 
+class UserBookRelationBulkListSerializer(serializers.ListSerializer):
+    """
+    Список изменений отношений для массового обновления: не больше max_items элементов (проверяется
+    до проверки элементов) и книги не повторяются. Существование книг проверяет bulk_update_relations
+    в своей транзакции
+    """
+    max_items = 1000
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and len(data) > self.max_items:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [f'Не больше {self.max_items} книг за один запрос.']
+            }, code='max_items')
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        book_ids = [item['book'] for item in attrs]
+        if len(set(book_ids)) != len(book_ids):
+            raise serializers.ValidationError('Книги в списке не должны повторяться.')
+        return attrs
+
+
+class UserBookRelationBulkSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор элемента массового создания и обновления отношений пользователя к книгам:
+    id книги и изменяемые поля (отсутствующие поля не меняются)
+    """
+    book = serializers.IntegerField()
+
+    class Meta:
+        model = UserBookRelation
+        exclude = ('user', 'id')
+        extra_kwargs = {field: {'required': False} for field in ('like', 'in_bookmarks', 'rate')}
+        list_serializer_class = UserBookRelationBulkListSerializer
+
+
 class MyBooksOffersListSerializer(serializers.ModelSerializer):
     """
     Сериализатор для получения списка своих предложений книг
     с гиперссылками на их экземпляры
     """
-    url = serializers.HyperlinkedIdentityField(view_name='my-offer-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='my-offer-detail', read_only=True)
     user = serializers.ReadOnlyField(source='user.username')
     library = serializers.ReadOnlyField(source='library.title')
 
@@ -350,7 +432,7 @@ class UserBooksOffersListSerializer(serializers.ModelSerializer):
     Сериализатор для получения списка предложений книг пользователей
     с гиперссылками на их экземпляры
     """
-    url = serializers.HyperlinkedIdentityField(view_name='user-offer-detail', read_only=True)
+    url = HyperlinkedIdentityField(view_name='user-offer-detail', read_only=True)
     user = serializers.ReadOnlyField(source='user.username')
     library = serializers.ReadOnlyField(source='library.title')
 
@@ -380,3 +462,19 @@ class UserBooksOfferEditSerializer(serializers.ModelSerializer):
             if not data.get('is_accepted', True):
                 raise serializers.ValidationError("Нельзя снять одобрение с уже одобренной заявки.")
         return data
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    """
+    Параметры рейтинговой таблицы книг: показатель, область (категория или библиотека,
+    без них - все книги) и номер страницы
+    """
+    metric = serializers.ChoiceField(choices=('rating', 'likes'), default='rating')
+    category = serializers.IntegerField(min_value=1, required=False)
+    library = serializers.IntegerField(min_value=1, required=False)
+    page = serializers.IntegerField(min_value=1, default=1)
+
+    def validate(self, data):
+        if 'category' in data and 'library' in data:
+            raise serializers.ValidationError('Укажите категорию или библиотеку, но не обе.')
+        return data
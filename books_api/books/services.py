@@ -1,9 +1,105 @@
-from django.db.models import Avg, Count
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.forms import ModelChoiceField, ModelMultipleChoiceField
+from django.db import IntegrityError, connection, transaction
+from django.db.models import (
+    Avg, Count, Sum, Exists, OuterRef, F,
+    Subquery, Value, Case, When, FloatField,
+    ExpressionWrapper, CharField, IntegerField, QuerySet
+)
+from django.db.models.functions import Cast, Coalesce, Floor, Least, Now, NullIf
 from django_filters.rest_framework import (
     FilterSet, DateFromToRangeFilter, BooleanFilter,
     ModelMultipleChoiceFilter, ModelChoiceFilter
 )
-from books.models import UserBookSession, UserBookOffer, Books, Categories, Authors, Libraries, UserBookRelation
+from books.models import (
+    UserBookSession, UserBookOffer, Books,
+    Categories, Authors, Libraries,
+    UserBookRelation, BookLibraryAvailable, BookCatalog,
+    BookCounterQueue
+)
+from books.cache import bump_book_versions, get_table_ids, is_cache_shared
+from books.engine import catalog_changed
+from books.leaderboards import leaderboards_changed
+from books.recommendations import mark_similar_books, positive_changed
+from books.search import get_search_backend
+
+
+def get_missing_pks(table, queryset, pks):
+    """
+    pk из переданных, которых нет в queryset: проверка по множеству pk таблицы из кэша (get_table_ids),
+    а pk, которых в нём нет (например, записи созданы без сигналов), перепроверяются запросом.
+    Без общего кэша версий (is_cache_shared) множество могло бы содержать удалённые другим процессом записи,
+    поэтому pk проверяются запросом
+    """
+    if not is_cache_shared():
+        pks = set(pks)
+        return pks - set(queryset.filter(pk__in=pks).values_list('pk', flat=True))
+    missing = set(pks) - get_table_ids(table, queryset)
+    if missing:
+        missing -= set(queryset.filter(pk__in=missing).values_list('pk', flat=True))
+    return missing
+
+
+class CachedModelChoiceField(ModelChoiceField):
+    """
+    Поле выбора записи по id без запроса к базе (id проверяется через get_missing_pks),
+    значение поля - pk записи (фильтр по нему совпадает с фильтром по экземпляру)
+    """
+
+    def __init__(self, queryset, *, table, **kwargs):
+        self.table = table
+        super().__init__(queryset, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            pk = self.queryset.model._meta.pk.to_python(value)
+            if get_missing_pks(self.table, self.queryset, [pk]):
+                raise ValidationError('missing')
+        except ValidationError:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return pk
+
+
+class CachedModelMultipleChoiceField(ModelMultipleChoiceField):
+    """Поле выбора нескольких записей по id без запроса к базе, значение поля - список pk"""
+
+    def __init__(self, queryset, *, table, **kwargs):
+        self.table = table
+        super().__init__(queryset, **kwargs)
+
+    def _check_values(self, value):
+        try:
+            value = frozenset(value)
+        except TypeError:
+            raise ValidationError(self.error_messages['invalid_list'], code='invalid_list')
+        pks = {}
+        for item in value:
+            try:
+                pks[item] = self.queryset.model._meta.pk.to_python(item)
+            except ValidationError:
+                raise ValidationError(self.error_messages['invalid_pk_value'], code='invalid_pk_value',
+                                      params={'pk': item})
+        missing = get_missing_pks(self.table, self.queryset, pks.values())
+        for item, pk in pks.items():
+            if pk in missing:
+                raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice',
+                                      params={'value': item})
+        return sorted(set(pks.values()))
+
+
+class CachedModelChoiceFilter(ModelChoiceFilter):
+    """ModelChoiceFilter с проверкой id по кэшу таблицы table (ключ версии из books.cache)"""
+    field_class = CachedModelChoiceField
+
+
+class CachedModelMultipleChoiceFilter(ModelMultipleChoiceFilter):
+    """ModelMultipleChoiceFilter с проверкой id по кэшу таблицы table (ключ версии из books.cache)"""
+    field_class = CachedModelMultipleChoiceField
 
 
 class UserBookOfferFilter(FilterSet):
@@ -45,59 +141,598 @@ class BooksListFilter(FilterSet):
     выбор автора,
     выбор библиотеки
     """
-    categories = ModelMultipleChoiceFilter(queryset=Categories.objects.all())
-    author = ModelChoiceFilter(queryset=Authors.objects.all())
-    lib_available__library = ModelChoiceFilter(queryset=Libraries.objects.all())
+    categories = CachedModelMultipleChoiceFilter(queryset=Categories.objects.all(), table='categories')
+    author = CachedModelChoiceFilter(queryset=Authors.objects.all(), table='authors')
+    lib_available__library = CachedModelChoiceFilter(queryset=Libraries.objects.all(), table='libraries')
 
     class Meta:
         model = Books
         fields = ['categories', 'author', 'lib_available__library']
 
 
-def set_rating(book):
+class BookCatalogFilter(FilterSet):
     """
-    Функция для подсчёта рейтинга книги,
-    в качестве аргумента принимает экземпляр книги
+    Кастомный фильтр для списков книг из каталога
+    (параметры совпадают с BooksListFilter):
+    выбор категорий,
+    выбор автора,
+    выбор библиотеки
     """
-    book.rating = UserBookRelation.objects.filter(book=book).aggregate(rating=Avg('rate')).get('rating')
-    book.save()
+    categories = CachedModelMultipleChoiceFilter(field_name='category_ids', queryset=Categories.objects.all(),
+                                                 table='categories', method='filter_ids')
+    author = CachedModelChoiceFilter(queryset=Authors.objects.all(), table='authors')
+    lib_available__library = CachedModelChoiceFilter(field_name='library_ids', queryset=Libraries.objects.all(),
+                                                     table='libraries', method='filter_ids')
+
+    class Meta:
+        model = BookCatalog
+        fields = ['categories', 'author', 'lib_available__library']
+
+    def filter_ids(self, queryset, name, value):
+        """Фильтр по массиву id записи каталога (category_ids, library_ids): есть хотя бы один из выбранных"""
+        if isinstance(value, QuerySet) or value in (None, []):
+            # пустой выбор: ModelMultipleChoiceField возвращает queryset.none()
+            return queryset
+        return queryset.filter(**{f'{name}__overlap': value if isinstance(value, list) else [value]})
+
+    def get_values(self):
+        """Нормализованные значения фильтров после is_valid: id категорий по возрастанию, id автора и библиотеки"""
+        data = self.form.cleaned_data
+        return {
+            'categories': sorted(data.get('categories') or []),
+            'author': data.get('author'),
+            'library': data.get('lib_available__library'),
+        }
+
 
+FACETS = ('categories', 'authors', 'libraries', 'rating')
 
-def set_likes(book):
+
+def get_book_facets(queryset):
     """
-    Функция для подсчёта лайков книги,
-    в качестве аргумента принимает экземпляр книги
+    Функция для подсчёта книг из queryset каталога по категориям, авторам, библиотекам
+    и целой части рейтинга (None - без оценок) одним запросом: UNION ALL сгруппированных подзапросов,
+    возвращает строки (фасет, значение, количество) для build_facets
     """
-    book.likes = UserBookRelation.objects.filter(book=book, like=True).select_related('user').count()
-    book.save()
+    book_ids = queryset.order_by().values('pk')
+    books = BookCatalog.objects.filter(pk__in=book_ids)
+
+    def part(facet, rows, value, count=Count('pk')):
+        return rows.order_by().annotate(facet=Value(facet, output_field=CharField()), value=value).values_list(
+            'facet', 'value').annotate(count=count)
+
+    parts = [
+        part('count', books, Value(None, output_field=IntegerField())),
+        part('categories', Books.categories.through.objects.filter(books_id__in=book_ids), F('categories_id')),
+        part('authors', books, F('author_id')),
+        part('libraries', BookLibraryAvailable.objects.filter(book_id__in=book_ids), F('library_id'),
+             Count('book_id', distinct=True)),
+        part('rating', books, Cast(Floor('rating'), IntegerField())),
+    ]
+    return parts[0].union(*parts[1:], all=True)
 
 
-def set_bookmarks(book):
+def build_facets(rows):
     """
-    Функция для подсчёта закладок книги,
-    в качестве аргумента принимает экземпляр книги
+    Ответ фасетов из строк (фасет, значение, количество): общее количество книг и списки
+    {'id' (для рейтинга - 'rating'), 'count'} по убыванию количества (рейтинг - по убыванию, без оценок в конце)
     """
-    book.bookmarks = UserBookRelation.objects.filter(book=book, in_bookmarks=True).select_related('user').count()
-    book.save()
+    facets = {'count': 0, **{facet: [] for facet in FACETS}}
+    for facet, value, count in rows:
+        if facet == 'count':
+            facets['count'] = count
+        elif count:
+            facets[facet].append({'rating' if facet == 'rating' else 'id': value, 'count': count})
+    for facet in FACETS[:-1]:
+        facets[facet].sort(key=lambda item: (-item['count'], item['id']))
+    facets['rating'].sort(key=lambda item: (item['rating'] is None, -(item['rating'] or 0)))
+    return facets
+
+
+RELATION_VALUES = ('like', 'in_bookmarks', 'rate')
+
+DEFAULT_COUNTERS_SETTINGS = {
+    'CONSISTENCY': 'sync',
+    'FLUSH_INTERVAL': 1,
+    'BATCH_SIZE': 1000,
+}
+
+
+def get_relation_values(relation):
+    """Значения полей отношения, влияющих на рейтинг, лайки и закладки книги"""
+    return {field: getattr(relation, field) for field in RELATION_VALUES}
+
 
+COUNTER_FIELDS = ('likes', 'bookmarks', 'rating_sum', 'rating_count')
 
-def set_book_values(serializer, created):
+
+def get_book_values_delta(old_values, new_values):
     """
-    Функция для обновления полей рейтинга, лайков и закладок книги при создании или изменении отношения,
-    в качестве аргументов принимает сериализатор и bool-значение создания отношения
+    Разница счётчиков книги между двумя состояниями отношения
+    (None - отношения не было или больше нет)
     """
-    functions_dict = {
-        'rate': set_rating,
-        'like': set_likes,
-        'in_bookmarks': set_bookmarks
+    old_values, new_values = old_values or {}, new_values or {}
+    old_rate, new_rate = old_values.get('rate'), new_values.get('rate')
+    return {
+        'likes': bool(new_values.get('like')) - bool(old_values.get('like')),
+        'bookmarks': bool(new_values.get('in_bookmarks')) - bool(old_values.get('in_bookmarks')),
+        'rating_sum': (new_rate or 0) - (old_rate or 0),
+        'rating_count': (new_rate is not None) - (old_rate is not None),
     }
-    if created:
-        for field in functions_dict:
-            function = functions_dict[field]
-            function(serializer.instance.book)
+
+
+def change_book_values(book_id, old_values, new_values):
+    """
+    Функция для изменения рейтинга, лайков и закладок книги на разницу между состояниями отношения
+    (без пересчёта всех отношений книги), в качестве аргументов принимает id книги
+    и значения отношения до и после изменения (None - отношения не было или больше нет)
+    """
+    change_books_values({book_id: get_book_values_delta(old_values, new_values)})
+
+
+def remove_relations_values(items):
+    """
+    Функция для вычитания удалённых отношений из счётчиков книг одним UPDATE,
+    в качестве аргумента принимает пары (id книги, значения удалённого отношения get_relation_values)
+    """
+    deltas = {}
+    for book_id, values in items:
+        total = deltas.setdefault(book_id, dict.fromkeys(COUNTER_FIELDS, 0))
+        for field, value in get_book_values_delta(values, None).items():
+            total[field] += value
+    change_books_values(deltas)
+
+
+def change_books_values(deltas):
+    """
+    Функция для изменения счётчиков нескольких книг одним атомарным UPDATE только изменившихся столбцов,
+    в качестве аргумента принимает словарь {id книги: разница счётчиков (get_book_values_delta)}
+    """
+    deltas = {book_id: delta for book_id, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+    updates = {}
+    for field in COUNTER_FIELDS:
+        values = {book_id: delta[field] for book_id, delta in deltas.items() if delta[field]}
+        if not values:
+            continue
+        if len(values) == len(deltas) and len(set(values.values())) == 1:
+            change = Value(next(iter(values.values())))
+        else:
+            change = Case(*(When(pk=book_id, then=Value(value)) for book_id, value in values.items()),
+                          default=Value(0))
+        updates[field] = F(field) + change
+    if 'rating_sum' in updates or 'rating_count' in updates:
+        # в UPDATE столбцы справа имеют прежние значения, поэтому рейтинг считается по новым сумме и количеству;
+        # без оценок делитель NULL и рейтинг тоже NULL
+        rating_sum = updates.get('rating_sum', F('rating_sum'))
+        rating_count = updates.get('rating_count', F('rating_count'))
+        updates['rating'] = ExpressionWrapper(Cast(rating_sum, FloatField()) / NullIf(rating_count, Value(0)),
+                                              output_field=Books._meta.get_field('rating'))
+    Books.objects.filter(pk__in=deltas).update(**updates, updated_at=Now())
+    if 'likes' in updates or 'rating' in updates:
+        book = Books.objects.filter(pk=OuterRef('pk'))
+        BookCatalog.objects.filter(pk__in=deltas).update(likes=Subquery(book.values('likes')),
+                                                         rating=Subquery(book.values('rating')))
+        catalog_changed(deltas)
+        leaderboards_changed(deltas)
+    bump_book_versions(deltas)
+
+
+def set_book_values(relation, old_values=None):
+    """
+    Функция для обновления полей рейтинга, лайков и закладок книги при создании или изменении отношения,
+    в качестве аргументов принимает экземпляр отношения и значения его полей до изменения
+    (get_relation_values, None - отношение только что создано).
+    В режиме BOOKS_COUNTERS['CONSISTENCY'] = 'deferred' книга только помечается в очереди пересчёта.
+    Если отношение стало или перестало быть положительным, книга помечается в очереди пересчёта похожих книг
+    """
+    new_values = get_relation_values(relation)
+    if positive_changed(old_values, new_values):
+        mark_similar_books(relation.user_id, [relation.book_id])
+    if get_counters_settings()['CONSISTENCY'] == 'deferred':
+        mark_books_dirty([relation.book_id])
+    else:
+        change_book_values(relation.book_id, old_values, new_values)
+
+
+UPSERT_RELATION_SQL = """
+WITH old AS (
+    SELECT {like}, {in_bookmarks}, {rate} FROM {table} WHERE {book} = %(book)s AND {user} = %(user)s FOR UPDATE
+), new AS (
+    INSERT INTO {table} AS relation ({book}, {user}, {like}, {in_bookmarks}, {rate})
+    SELECT %(book)s, %(user)s, %(like)s, %(in_bookmarks)s, %(rate)s
+    FROM (SELECT 1) AS source LEFT JOIN old ON TRUE
+    WHERE EXISTS (SELECT 1 FROM {books} WHERE {books_pk} = %(book)s)
+    ON CONFLICT ({book}, {user}) DO UPDATE SET {updates}
+    RETURNING relation.{pk}, relation.{like}, relation.{in_bookmarks}, relation.{rate}, relation.xmax = 0
+)
+SELECT new.*, old.{like} IS NOT NULL, old.{like}, old.{in_bookmarks}, old.{rate} FROM new LEFT JOIN old ON TRUE
+"""
+
+
+def upsert_relation(user, book_id, values):
+    """
+    Функция для создания или изменения отношения пользователя к книге с обновлением счётчиков книги
+    на разницу между прежним и новым состоянием отношения, в качестве аргументов принимает пользователя,
+    id книги и изменяемые поля из RELATION_VALUES (отсутствующие остаются прежними, у новой строки - по умолчанию).
+    В PostgreSQL выполняется одним запросом INSERT ... ON CONFLICT DO UPDATE ... RETURNING, который
+    в том же запросе блокирует и возвращает прежние значения строки. Если строку между чтением и вставкой
+    создал параллельный запрос, прежние значения неизвестны и счётчики книги пересчитываются полностью.
+    Возвращает отношение или None, если книги нет
+    """
+    values = {field: values[field] for field in RELATION_VALUES if field in values}
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            return _upsert_relation_returning(user, book_id, values)
+        relation = UserBookRelation.objects.select_for_update().filter(user=user, book_id=book_id).first()
+        if relation is None:
+            if not Books.objects.filter(pk=book_id).exists():
+                return None
+            old_values, relation = None, UserBookRelation(user=user, book_id=book_id)
+        else:
+            old_values = get_relation_values(relation)
+        for field, value in values.items():
+            setattr(relation, field, value)
+        relation.save()
+        set_book_values(relation, old_values)
+        return relation
+
+
+def _upsert_relation_returning(user, book_id, values):
+    opts = UserBookRelation._meta
+    quote = connection.ops.quote_name
+    columns = {field: quote(opts.get_field(field).column) for field in ('book', 'user', *RELATION_VALUES)}
+    updates = [f'{columns[field]} = EXCLUDED.{columns[field]}' for field in values]
+    sql = UPSERT_RELATION_SQL.format(
+        table=quote(opts.db_table), pk=quote(opts.pk.column),
+        books=quote(Books._meta.db_table), books_pk=quote(Books._meta.pk.column),
+        # без изменяемых полей строка всё равно обновляется, чтобы RETURNING её вернул
+        updates=', '.join(updates) or f'{columns["like"]} = relation.{columns["like"]}',
+        **columns
+    )
+    params = {field: values.get(field, opts.get_field(field).get_default()) for field in RELATION_VALUES}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {**params, 'book': book_id, 'user': user.pk})
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    pk, like, in_bookmarks, rate, inserted, existed, *old = row
+    relation = UserBookRelation(pk=pk, user=user, book_id=book_id, like=like, in_bookmarks=in_bookmarks, rate=rate)
+    relation._state.adding = False
+    if inserted or existed:
+        set_book_values(relation, dict(zip(RELATION_VALUES, old)) if existed else None)
+        return relation
+    mark_similar_books(user.pk, [book_id])
+    if get_counters_settings()['CONSISTENCY'] == 'deferred':
+        mark_books_dirty([book_id])
+    else:
+        recount_book_values([book_id])
+    return relation
+
+
+class BooksNotFoundError(Exception):
+    """Книг из списка нет (удалены или не существовали), book_ids - их id по возрастанию"""
+
+    def __init__(self, book_ids):
+        self.book_ids = sorted(book_ids)
+        super().__init__(f'Книги не найдены: {", ".join(map(str, self.book_ids))}.')
+
+
+def create_relations(user, book_ids):
+    """
+    Функция для создания недостающих отношений пользователя к книгам со значениями по умолчанию
+    (такие отношения не входят в счётчики книг) одним INSERT ... ON CONFLICT DO NOTHING: строку,
+    созданную параллельным запросом, вставка пропускает. Книги проверяются в той же транзакции,
+    а внешние ключи в PostgreSQL (DEFERRABLE INITIALLY DEFERRED) проверяются сразу, а не при фиксации,
+    поэтому книга, удалённая параллельно, даёт BooksNotFoundError вместо IntegrityError
+    """
+    book_ids = set(book_ids)
+    missing = book_ids - set(Books.objects.filter(pk__in=book_ids).values_list('pk', flat=True))
+    if missing:
+        raise BooksNotFoundError(missing)
+    UserBookRelation.objects.bulk_create([UserBookRelation(user=user, book_id=book_id) for book_id in book_ids],
+                                         ignore_conflicts=True)
+    if connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic():
+            connection.check_constraints()
+    except IntegrityError:
+        raise BooksNotFoundError(book_ids - set(Books.objects.filter(pk__in=book_ids).values_list('pk', flat=True)))
+
+
+def bulk_update_relations(user, items):
+    """
+    Функция для создания и изменения отношений пользователя к нескольким книгам в одной транзакции:
+    существующие отношения читаются одним запросом с блокировкой строк, недостающие создаются
+    create_relations и тоже читаются с блокировкой (параллельный запрос с той же книгой ждёт её, а не
+    нарушает unique_together), изменённые сохраняются bulk_update, а счётчики каждой затронутой книги
+    меняются один раз. В качестве аргументов принимает пользователя и список словарей с id книги в 'book'
+    и изменяемыми полями из RELATION_VALUES (отсутствующие поля не меняются),
+    возвращает список отношений в порядке items. Если каких-то книг нет - BooksNotFoundError
+    """
+    with transaction.atomic():
+        book_ids = [item['book'] for item in items]
+        relations = UserBookRelation.objects.select_for_update().filter(user=user)
+        existing = {relation.book_id: relation for relation in relations.filter(book_id__in=book_ids)}
+        new_ids = set(book_ids) - existing.keys()
+        if new_ids:
+            create_relations(user, new_ids)
+            existing.update((relation.book_id, relation) for relation in relations.filter(book_id__in=new_ids))
+        result, deltas, positive = [], {}, []
+        for item in items:
+            relation = existing[item['book']]
+            old_values = get_relation_values(relation)
+            for field in RELATION_VALUES:
+                if field in item:
+                    setattr(relation, field, item[field])
+            new_values = get_relation_values(relation)
+            deltas[relation.book_id] = get_book_values_delta(old_values, new_values)
+            if positive_changed(old_values, new_values):
+                positive.append(relation.book_id)
+            result.append(relation)
+        UserBookRelation.objects.bulk_update(result, RELATION_VALUES)
+        if positive:
+            mark_similar_books(user.pk, positive)
+        if get_counters_settings()['CONSISTENCY'] == 'deferred':
+            mark_books_dirty(book_id for book_id, delta in deltas.items() if any(delta.values()))
+        else:
+            change_books_values(deltas)
+    return result
+
+
+def get_counters_settings():
+    return {**DEFAULT_COUNTERS_SETTINGS, **getattr(settings, 'BOOKS_COUNTERS', {})}
+
+
+def mark_books_dirty(book_ids):
+    """
+    Функция для добавления книг в очередь отложенного пересчёта счётчиков (только INSERT, без блокировки книги),
+    в качестве аргумента принимает id книг
+    """
+    BookCounterQueue.objects.bulk_create([BookCounterQueue(book_id=book_id) for book_id in set(book_ids)])
+
+
+def flush_book_counters(batch_size=None):
+    """
+    Функция для обработки очереди отложенного пересчёта: все отметки одной книги объединяются
+    и книга пересчитывается один раз. Отметки выбираются с SKIP LOCKED, поэтому несколько обработчиков
+    не мешают друг другу, а отметки из ещё не завершённых транзакций останутся до следующего прохода.
+    Возвращает количество пересчитанных книг
+    """
+    batch_size = batch_size or get_counters_settings()['BATCH_SIZE']
+    with transaction.atomic():
+        queue = BookCounterQueue.objects.select_for_update(skip_locked=True).order_by('pk')
+        entries = list(queue.values_list('pk', 'book_id')[:batch_size])
+        if not entries:
+            return 0
+        book_ids = {book_id for _, book_id in entries}
+        recount_book_values(book_ids)
+        BookCounterQueue.objects.filter(pk__in=[pk for pk, _ in entries]).delete()
+    return len(book_ids)
+
+
+def refresh_book_catalog(book_ids, create=False):
+    """
+    Функция для обновления записей каталога книг,
+    в качестве аргументов принимает id книг и bool-значение создания отсутствующих записей
+    """
+    book_ids = set(book_ids)
+    if not book_ids:
+        return
+    books = Books.objects.filter(pk__in=book_ids).select_related('author').prefetch_related(
+        'categories', 'lib_available').annotate(
+        available=Exists(BookLibraryAvailable.objects.filter(book=OuterRef('pk'), available=True)))
+    existing_ids = set(BookCatalog.objects.filter(pk__in=book_ids).values_list('pk', flat=True))
+    to_create, to_update = [], []
+    for book in books:
+        entry = BookCatalog(
+            book=book,
+            title=book.title,
+            author_id=book.author_id,
+            author_name=book.author.get_name(),
+            categories=[category.title for category in book.categories.all()],
+            category_ids=sorted(category.pk for category in book.categories.all()),
+            library_ids=sorted({available.library_id for available in book.lib_available.all()}),
+            available=book.available,
+            created_at=book.created_at,
+            rating=book.rating,
+            likes=book.likes
+        )
+        if book.pk in existing_ids:
+            to_update.append(entry)
+        elif create:
+            to_create.append(entry)
+    BookCatalog.objects.bulk_create(to_create, ignore_conflicts=True)
+    BookCatalog.objects.bulk_update(to_update, ['title', 'author', 'author_name', 'categories', 'category_ids',
+                                                'library_ids', 'available', 'created_at', 'rating', 'likes'])
+    get_search_backend().update(BookCatalog, [entry.pk for entry in to_create + to_update])
+    catalog_changed(book_ids)
+    leaderboards_changed(book_ids)
+
+
+def books_changed(book_ids, create=False):
+    """
+    Функция для обработки изменения данных книг: обновление каталога и инвалидация кэша экземпляров книг,
+    в качестве аргументов принимает id книг и bool-значение создания отсутствующих записей каталога
+    """
+    book_ids = set(book_ids)
+    refresh_book_catalog(book_ids, create=create)
+    bump_book_versions(book_ids)
+
+
+def change_reading_now(book_ids, delta):
+    """
+    Функция для изменения счётчика активных сессий книг одним UPDATE,
+    в качестве аргументов принимает id книг (с повторами для нескольких сессий) и изменение на каждый id
+    """
+    deltas = {}
+    for book_id in book_ids:
+        deltas[book_id] = deltas.get(book_id, 0) + delta
+    for value in set(deltas.values()) - {0}:
+        ids = [book_id for book_id, book_delta in deltas.items() if book_delta == value]
+        Books.objects.filter(pk__in=ids).update(reading_now=F('reading_now') + value, updated_at=Now())
+    bump_book_versions(book_id for book_id, book_delta in deltas.items() if book_delta)
+
+
+def recount_reading_now(book_ids=None):
+    """
+    Функция для полного пересчёта счётчика активных сессий книг по таблице сессий,
+    в качестве аргумента принимает id книг (None - все книги)
+    """
+    books = Books.objects.all() if book_ids is None else Books.objects.filter(pk__in=book_ids)
+    active = UserBookSession.books.through.objects.filter(
+        books=OuterRef('pk'), userbooksession__is_accepted=True, userbooksession__is_closed=False
+    ).order_by().values('books').annotate(count=Count('pk')).values('count')
+    updated = books.update(reading_now=Coalesce(Subquery(active), Value(0)))
+    bump_book_versions(books.values_list('pk', flat=True))
+    return updated
+
+
+def recount_book_values(book_ids=None):
+    """
+    Функция для полного пересчёта рейтинга (суммы и количества оценок), лайков и закладок книг
+    по таблице отношений одним UPDATE, в качестве аргумента принимает id книг (None - все книги)
+    """
+    books = Books.objects.all() if book_ids is None else Books.objects.filter(pk__in=book_ids)
+    relations = UserBookRelation.objects.filter(book=OuterRef('pk')).order_by().values('book')
+
+    def aggregate(expression, **filters):
+        return Coalesce(Subquery(relations.filter(**filters).annotate(value=expression).values('value')), Value(0))
+
+    updated = books.update(
+        rating=Subquery(relations.filter(rate__isnull=False).annotate(value=Avg('rate')).values('value'),
+                        output_field=Books._meta.get_field('rating')),
+        rating_sum=aggregate(Sum('rate'), rate__isnull=False),
+        rating_count=aggregate(Count('pk'), rate__isnull=False),
+        likes=aggregate(Count('pk'), like=True),
+        bookmarks=aggregate(Count('pk'), in_bookmarks=True),
+    )
+    refresh_book_catalog(books.values_list('pk', flat=True))
+    bump_book_versions(books.values_list('pk', flat=True))
+    return updated
+
+
+class ReservationError(Exception):
+    """В библиотеке нет свободного экземпляра книги для сессии"""
+
+
+def reserve_books(library_id, book_ids):
+    """
+    Функция для резервирования одного экземпляра каждой книги в библиотеке: для каждой книги один
+    условный атомарный UPDATE, который увеличивает reserved, только если книга в наличии и есть свободный экземпляр.
+    Строки блокируются по возрастанию id книги, поэтому одновременные резервирования не взаимоблокируются,
+    а ожидающий UPDATE перепроверяет условие по зафиксированной строке и не превышает copies.
+    Если какой-то книги не хватило, уже сделанные резервирования откатываются и выбрасывается ReservationError
+    """
+    entries = BookLibraryAvailable.objects.filter(library_id=library_id, available=True, reserved__lt=F('copies'))
+    with transaction.atomic():
+        for book_id in sorted(book_ids):
+            if not entries.filter(book_id=book_id).update(reserved=F('reserved') + 1):
+                entry = BookLibraryAvailable.objects.filter(library_id=library_id, book_id=book_id).select_related(
+                    'book', 'library').first()
+                if entry is None:
+                    raise ReservationError('Одной или нескольких книг нет в выбранной библиотеке')
+                raise ReservationError(f'В данный момент {entry.library} не имеет свободных экземпляров {entry.book}')
+
+
+def release_books(library_id, book_ids):
+    """
+    Функция для освобождения зарезервированных экземпляров книг в библиотеке
+    (в том же порядке блокировки строк, что и reserve_books)
+    """
+    entries = BookLibraryAvailable.objects.filter(library_id=library_id, reserved__gt=0)
+    for book_id in sorted(book_ids):
+        entries.filter(book_id=book_id).update(reserved=F('reserved') - 1)
+
+
+def end_library_sessions(library_id):
+    """
+    Функция для уменьшения reading_now книг всех активных сессий библиотеки одним запросом перед её удалением
+    (зарезервированные экземпляры не освобождаются: записи наличия удаляются вместе с библиотекой)
+    """
+    links = UserBookSession.books.through.objects.filter(
+        userbooksession__library_id=library_id, userbooksession__is_accepted=True, userbooksession__is_closed=False)
+    change_reading_now(links.values_list('books_id', flat=True), -1)
+
+
+def reserve_session(session):
+    """
+    Функция для резервирования экземпляров книг созданной сессии в её библиотеке,
+    после резервирования сессия держит экземпляры до закрытия (изменения состава и библиотеки
+    сессии учитываются сигналами). Выполняется в транзакции создания сессии
+    """
+    reserve_books(session.library_id, session.books.values_list('pk', flat=True))
+    UserBookSession.objects.filter(pk=session.pk).update(holds_copies=True)
+    session.holds_copies = True
+
+
+def recount_reservations():
+    """
+    Функция для полного пересчёта зарезервированных экземпляров по незакрытым сессиям с резервированием
+    (не больше количества экземпляров), возвращает количество обновлённых записей наличия
+    """
+    holding = UserBookSession.books.through.objects.filter(
+        books=OuterRef('book'), userbooksession__library=OuterRef('library'),
+        userbooksession__holds_copies=True, userbooksession__is_closed=False
+    ).order_by().values('books').annotate(count=Count('pk')).values('count')
+    return BookLibraryAvailable.objects.update(reserved=Least(Coalesce(Subquery(holding), Value(0)), F('copies')))
+
+
+_deletion = threading.local()
+
+
+class DeletionBatch:
+    """
+    Работа обработчиков сигналов удаления, накопленная при каскадном удалении записи (delete_cascade):
+    вызовы одной функции объединяются в один вызов с элементами всех удалённых записей
+    """
+
+    def __init__(self, root):
+        self.root = (type(root), root.pk)
+        self.calls = {}
+
+    def is_root(self, model, pk):
+        return self.root == (model, pk)
+
+    def add(self, function, items):
+        self.calls.setdefault(function, []).extend(items)
+
+    def flush(self):
+        for function, items in self.calls.items():
+            function(items)
+
+
+def get_deletion_batch():
+    return getattr(_deletion, 'batch', None)
+
+
+def defer_deletion_work(function, items):
+    """
+    Вызов function(items) из обработчика сигнала удаления: сразу или, внутри delete_cascade,
+    один раз для элементов всех удалённых записей после удаления
+    """
+    batch = get_deletion_batch()
+    if batch is None:
+        function(items)
     else:
-        for field in serializer.validated_data:
-            function = functions_dict.get(field)
-            if not function:
-                continue
-            function(serializer.instance.book)
+        batch.add(function, items)
+
+
+def delete_cascade(instance):
+    """
+    Функция для удаления записи вместе со связанными записями с постоянным количеством запросов:
+    обработчики сигналов удаления связанных записей копят работу (defer_deletion_work),
+    которая выполняется одним вызовом на функцию в той же транзакции.
+    Активные сессии удаляемой библиотеки обрабатываются заранее одним запросом (end_library_sessions)
+    """
+    with transaction.atomic():
+        batch = _deletion.batch = DeletionBatch(instance)
+        try:
+            if isinstance(instance, Libraries):
+                end_library_sessions(instance.pk)
+            instance.delete()
+        finally:
+            _deletion.batch = None
+        batch.flush()
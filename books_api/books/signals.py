@@ -0,0 +1,277 @@
+from collections import defaultdict
+
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from books.authentication import invalidate_credentials
+
+from books.cache import bump_book_versions, bump_table_versions
+from books.engine import catalog_changed
+from books.leaderboards import leaderboards_changed
+from books.models import (
+    Books, Authors, Categories,
+    Libraries, BookLibraryAvailable, BookCatalog,
+    UserBookOffer, UserBookRelation, UserBookSession,
+    User
+)
+from books.recommendations import is_positive, mark_similar_relations
+from books.search import get_search_backend
+from books.services import (
+    books_changed, change_reading_now,
+    remove_relations_values, get_relation_values,
+    get_counters_settings, mark_books_dirty,
+    reserve_books, release_books,
+    defer_deletion_work, get_deletion_batch
+)
+
+
+@receiver(post_save, sender=Books)
+def book_saved(sender, instance, **kwargs):
+    """Обновление записи каталога и инвалидация кэша при создании или изменении книги"""
+    books_changed([instance.pk], create=True)
+
+
+@receiver(post_delete, sender=Books)
+def book_deleted(sender, instance, **kwargs):
+    """Инвалидация кэша удалённой книги"""
+    bump_book_versions([instance.pk])
+
+
+@receiver(m2m_changed, sender=Books.categories.through)
+def book_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Обновление категорий в каталоге и кэше при изменении связей книг и категорий (с любой стороны)"""
+    if action == 'pre_clear' and reverse:
+        instance._catalog_book_ids = list(instance.cat_books.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        book_ids = [instance.pk]
+    elif action == 'post_clear':
+        book_ids = instance._catalog_book_ids
+    else:
+        book_ids = pk_set
+    books_changed(book_ids)
+
+
+@receiver(post_save, sender=Authors)
+def author_saved(sender, instance, created, **kwargs):
+    """Обновление имени автора в каталоге"""
+    if not created:
+        books_changed(instance.aut_books.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Categories)
+def category_saved(sender, instance, created, **kwargs):
+    """Обновление названия категории в каталоге"""
+    if not created:
+        books_changed(instance.cat_books.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Categories)
+def category_pre_delete(sender, instance, **kwargs):
+    """Запоминание книг удаляемой категории (связи удаляются без сигнала m2m_changed)"""
+    instance._catalog_book_ids = list(instance.cat_books.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Categories)
+def category_deleted(sender, instance, **kwargs):
+    """Удаление категории из каталога"""
+    books_changed(getattr(instance, '_catalog_book_ids', []))
+
+
+@receiver(post_save, sender=Libraries)
+def library_saved(sender, instance, created, **kwargs):
+    """Инвалидация кэша книг библиотеки при её изменении"""
+    if not created:
+        bump_book_versions(instance.book_available.values_list('book_id', flat=True))
+
+
+@receiver(post_save, sender=BookLibraryAvailable)
+def book_available_changed(sender, instance, **kwargs):
+    """Обновление флага наличия книги в каталоге и кэше"""
+    books_changed([instance.book_id])
+
+
+@receiver(post_delete, sender=BookLibraryAvailable)
+def book_available_deleted(sender, instance, **kwargs):
+    """Обновление флага наличия книги в каталоге и кэше (при каскадном удалении - один раз для всех книг)"""
+    defer_deletion_work(books_changed, [instance.book_id])
+
+
+@receiver(post_delete, sender=UserBookRelation)
+def book_relation_deleted(sender, instance, **kwargs):
+    """
+    Вычитание удалённого отношения пользователя из рейтинга, лайков и закладок книги
+    и отметка книги в очереди пересчёта похожих книг, если отношение было положительным
+    (при каскадном удалении - одним запросом для всех отношений)
+    """
+    values = get_relation_values(instance)
+    if is_positive(values):
+        defer_deletion_work(mark_similar_relations, [(instance.user_id, instance.book_id)])
+    if get_counters_settings()['CONSISTENCY'] == 'deferred':
+        defer_deletion_work(mark_books_dirty, [instance.book_id])
+    else:
+        defer_deletion_work(remove_relations_values, [(instance.book_id, values)])
+
+
+@receiver(pre_save, sender=UserBookSession)
+def book_session_pre_save(sender, instance, **kwargs):
+    """
+    Запоминание прежнего состояния сессии для счётчика reading_now (принята и не закрыта)
+    и резервирования экземпляров (держит экземпляры, библиотека).
+    Внутри транзакции строка сессии блокируется до её завершения,
+    чтобы одновременные изменения одной сессии не изменили счётчики дважды
+    """
+    instance._was_active = instance._was_holding = instance._holds_copies = False
+    instance._old_library_id = None
+    if instance.pk is None:
+        return
+    sessions = UserBookSession.objects.filter(pk=instance.pk)
+    if transaction.get_connection().in_atomic_block:
+        sessions = sessions.select_for_update()
+    old = sessions.values('is_accepted', 'is_closed', 'holds_copies', 'library_id').first()
+    if old:
+        instance._was_active = old['is_accepted'] and not old['is_closed']
+        instance._was_holding = old['holds_copies'] and not old['is_closed']
+        instance._holds_copies = old['holds_copies']
+        instance._old_library_id = old['library_id']
+
+
+@receiver(post_save, sender=UserBookSession)
+def book_session_saved(sender, instance, created, **kwargs):
+    """
+    Изменение reading_now книг сессии, если сессия стала активной или перестала быть активной.
+    Сессия с резервированием при закрытии освобождает экземпляры своих книг,
+    при открытии заново или смене библиотеки резервирует их (ReservationError, если экземпляров не хватает)
+    """
+    if created:
+        return
+    is_holding = instance._holds_copies and not instance.is_closed
+    library_changed = instance.library_id != instance._old_library_id
+    if instance._was_holding and (not is_holding or library_changed):
+        release_books(instance._old_library_id, instance.books.values_list('pk', flat=True))
+    if is_holding and (not instance._was_holding or library_changed):
+        reserve_books(instance.library_id, instance.books.values_list('pk', flat=True))
+    if instance.is_active != instance._was_active:
+        change_reading_now(instance.books.values_list('pk', flat=True), 1 if instance.is_active else -1)
+
+
+@receiver(pre_delete, sender=UserBookSession)
+def book_session_pre_delete(sender, instance, **kwargs):
+    """
+    Уменьшение reading_now книг удаляемой активной сессии и освобождение экземпляров
+    (связи удаляются без сигнала m2m_changed). Сессии удаляемой библиотеки обрабатывает delete_cascade
+    """
+    batch = get_deletion_batch()
+    if batch is not None and batch.is_root(Libraries, instance.library_id):
+        return
+    old = UserBookSession.objects.filter(pk=instance.pk).values(
+        'is_accepted', 'is_closed', 'holds_copies', 'library_id').first()
+    if not old or old['is_closed']:
+        return
+    book_ids = list(instance.books.values_list('pk', flat=True))
+    if old['holds_copies']:
+        release_books(old['library_id'], book_ids)
+    if old['is_accepted']:
+        change_reading_now(book_ids, -1)
+
+
+@receiver(m2m_changed, sender=UserBookSession.books.through)
+def book_session_books_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Изменение reading_now и резервирования экземпляров при изменении состава сессии (с любой стороны связи).
+    pk_set при удалении содержит и несвязанные объекты, поэтому связанные определяются до удаления
+    """
+    links = sender.objects.filter(userbooksession__is_closed=False)
+    links = links.filter(books=instance) if reverse else links.filter(userbooksession=instance)
+    if action in ('pre_remove', 'post_add'):
+        links = links.filter(**{'userbooksession__in' if reverse else 'books__in': pk_set})
+    links = links.values_list('books_id', 'userbooksession__is_accepted',
+                              'userbooksession__holds_copies', 'userbooksession__library_id')
+    if action in ('pre_remove', 'pre_clear'):
+        instance._session_links = list(links)
+        return
+    if action in ('post_remove', 'post_clear'):
+        session_links, change_reserved, delta = instance._session_links, release_books, -1
+    elif action == 'post_add':
+        session_links, change_reserved, delta = list(links), reserve_books, 1
+    else:
+        return
+    change_reading_now([book_id for book_id, is_accepted, _, _ in session_links if is_accepted], delta)
+    reserved = defaultdict(list)
+    for book_id, _, holds_copies, library_id in session_links:
+        if holds_copies:
+            reserved[library_id].append(book_id)
+    for library_id, book_ids in reserved.items():
+        change_reserved(library_id, book_ids)
+
+
+# Таблицы с версиями для условных GET-запросов: модель -> (ключ таблицы, ключ записи)
+VERSIONED_TABLES = {
+    Authors: ('authors', 'author'),
+    Categories: ('categories', 'category'),
+    Libraries: ('libraries', 'library'),
+}
+
+
+@receiver(post_save, sender=Authors)
+@receiver(post_save, sender=Categories)
+@receiver(post_save, sender=Libraries)
+@receiver(post_delete, sender=Authors)
+@receiver(post_delete, sender=Categories)
+@receiver(post_delete, sender=Libraries)
+def versioned_table_changed(sender, instance, **kwargs):
+    """Новые версии таблицы и записи (ETag и Last-Modified списков и экземпляров)"""
+    bump_table_versions(*VERSIONED_TABLES[sender], [instance.pk])
+
+
+@receiver(post_save, sender=Authors)
+@receiver(post_save, sender=Categories)
+@receiver(post_save, sender=Libraries)
+@receiver(post_save, sender=UserBookOffer)
+def search_document_saved(sender, instance, **kwargs):
+    """Обновление поискового вектора записи"""
+    get_search_backend().update(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Authors)
+@receiver(post_delete, sender=Categories)
+@receiver(post_delete, sender=Libraries)
+@receiver(post_delete, sender=UserBookOffer)
+@receiver(post_delete, sender=BookCatalog)
+def search_document_deleted(sender, instance, **kwargs):
+    """Удаление записи из поискового индекса"""
+    get_search_backend().remove(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=BookCatalog)
+def catalog_entry_deleted(sender, instance, **kwargs):
+    """Удаление книги из снимка каталога и рейтинговых таблиц (при каскадном удалении - одна отметка очереди)"""
+    catalog_changed([instance.pk])
+    defer_deletion_work(leaderboards_changed, [instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """
+    Инвалидация проверенных учётных данных пользователя при любом изменении (пароль, is_active, права).
+    Изменения через QuerySet.update сигналов не вызывают и действуют после TIMEOUT кэша учётных данных
+    """
+    invalidate_credentials([instance.pk])
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Инвалидация проверенных учётных данных владельца удалённого токена"""
+    invalidate_credentials([instance.user_id])
+
+
+@receiver(user_logged_out)
+def user_logged_out_invalidate(sender, request, user, **kwargs):
+    """Инвалидация проверенных учётных данных пользователя при выходе (ключ сессии больше не действует)"""
+    if user is not None:
+        invalidate_credentials([user.pk])
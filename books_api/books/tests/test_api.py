@@ -1,7 +1,11 @@
 import datetime
 import json
+from unittest import mock
 
-from django.db.models import Count, Case, When
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
@@ -12,6 +16,7 @@ from books.models import (
     UserBookRelation, UserBookSession, UserBookOffer
 )
 import books.serializers as s
+from books.services import flush_book_counters, reserve_session, set_book_values
 
 
 class BooksViewSetTestCase(APITestCase):
@@ -75,19 +80,84 @@ class BooksViewSetTestCase(APITestCase):
         url = reverse('book-list')
         response = self.client.get(url, data={'ordering': '-rating'})
         books = Books.objects.filter(lib_available__available=True).select_related('author').prefetch_related(
-            'categories').distinct().order_by('-rating')
+            'categories').distinct().order_by(F('rating').desc(nulls_last=True), '-pk')
         serializer_data = s.BooksListSerializer(books, many=True, context={'request': response.wsgi_request}).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(serializer_data, response.data['results'])
 
+    @override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': True})
+    def test_list_filter_num_queries(self):
+        # id фильтров проверяются по кэшу (при общем кэше версий), поэтому фильтрация не добавляет запросов
+        url = reverse('book-list')
+        params = {'categories': [self.category_1.id, self.category_2.id], 'author': self.author_1.id,
+                  'lib_available__library': self.library_1.id}
+        self.client.get(url, data=params)
+        with CaptureQueriesContext(connection) as unfiltered:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as filtered:
+            response = self.client.get(url, data=params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, len(response.data['results']))
+        self.assertEqual(len(unfiltered), len(filtered))
+
+    def test_list_filter_invalid(self):
+        url = reverse('book-list')
+        for params in ({'categories': [self.category_1.id, 0]}, {'author': 'abc'}, {'lib_available__library': 0}):
+            response = self.client.get(url, data=params)
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, msg=params)
+
+    def test_list_filter_new_records(self):
+        url = reverse('book-list')
+        self.client.get(url, data={'author': self.author_1.id})
+        author = Authors.objects.create(first_name='Test', last_name='Author 3')
+        # запись без сигналов отсутствует в кэше и проверяется запросом
+        author_bulk = Authors.objects.bulk_create([Authors(first_name='Test', last_name='Author 4')])[0]
+        if author_bulk.pk is None:
+            author_bulk = Authors.objects.get(last_name='Author 4')
+        for author_id in (author.id, author_bulk.id):
+            response = self.client.get(url, data={'author': author_id})
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual([], response.data['results'])
+
+    @override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': True})
+    def test_facets(self):
+        url = reverse('book-facets')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, len(context))
+        self.assertEqual({
+            'count': 2,
+            'categories': [{'id': self.category_1.id, 'count': 2}, {'id': self.category_2.id, 'count': 1}],
+            'authors': [{'id': self.author_1.id, 'count': 1}, {'id': self.author_2.id, 'count': 1}],
+            'libraries': [{'id': self.library_2.id, 'count': 2}, {'id': self.library_1.id, 'count': 1}],
+            'rating': [{'rating': None, 'count': 2}],
+        }, response.data)
+        # повторный запрос отдаётся из кэша
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(response.data, self.client.get(url).data)
+        self.assertEqual(0, len(context))
+
+    def test_facets_filter(self):
+        set_book_values(UserBookRelation.objects.create(book=self.book_2, user=self.user_1, rate=4))
+        url = reverse('book-facets')
+        response = self.client.get(url, data={'categories': self.category_2.id, 'search': 'Book'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({
+            'count': 1,
+            'categories': [{'id': self.category_1.id, 'count': 1}, {'id': self.category_2.id, 'count': 1}],
+            'authors': [{'id': self.author_2.id, 'count': 1}],
+            'libraries': [{'id': self.library_2.id, 'count': 1}],
+            'rating': [{'rating': 4, 'count': 1}],
+        }, response.data)
+        response = self.client.get(url, data={'author': 0})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
     def test_retrieve(self):
         url = reverse('book-detail', kwargs={'pk': self.book_1.id})
         response = self.client.get(path=url)
-        books = Books.objects.filter(pk=self.book_1.id).annotate(
-            reading_now=Count(Case(When(session_books__is_accepted=True,
-                                        session_books__is_closed=False,
-                                        then=1))),
-        ).select_related('author').prefetch_related('categories', 'lib_available__library')
+        books = Books.objects.filter(pk=self.book_1.id).select_related('author').prefetch_related(
+            'categories', 'lib_available__library')
         serializer_data = s.BooksDetailSerializer(books[0], context={'request': response.wsgi_request}).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(serializer_data, response.data)
@@ -618,6 +688,28 @@ class MySessionsViewSetTestCase(APITestCase):
         session = UserBookSession.objects.order_by('-id').first()
         serializer_data = s.BooksSessionCreateSerializer(session, context={'request': response.wsgi_request}).data
         self.assertEqual(serializer_data, response.data)
+        self.assertEqual(1, BookLibraryAvailable.objects.get(book=self.book_3, library=self.library_2).reserved)
+
+    def test_create_no_free_copies(self):
+        url = reverse('my-session-list')
+        self.client.force_login(self.user_1)
+        created_data = {
+            'books': [self.book_1.id, self.book_2.id],
+            'library': self.library_1.id,
+            'start_date': str(self.test_start),
+            'end_date': str(self.test_end)
+        }
+        self.assertEqual(status.HTTP_201_CREATED, self.client.post(url, data=created_data, format='json').status_code)
+        # одновременный запрос: проверка в validate прошла до того, как последний экземпляр второй книги заняли
+        BookLibraryAvailable.objects.filter(book=self.book_1).update(copies=2)
+        with mock.patch.object(s.BooksSessionCreateSerializer, 'validate', lambda self, data: data):
+            response = self.client.post(url, data=created_data, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(1, UserBookSession.objects.filter(holds_copies=True).count())
+        self.assertEqual([1, 1], list(BookLibraryAvailable.objects.filter(library=self.library_1).order_by(
+            'book').values_list('reserved', flat=True)))
+        response = self.client.post(url, data=created_data, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
 
 
 class UserSessionsViewSetTestCase(APITestCase):
@@ -709,12 +801,43 @@ class UserSessionsViewSetTestCase(APITestCase):
         serializer_data = s.UserBooksSessionsEditSerializer(session, context={'request': response.wsgi_request}).data
         self.assertEqual(serializer_data, response.data)
         self.assertTrue(session.is_accepted)
+        self.assertEqual([1, 1, 1], list(Books.objects.order_by('pk').values_list('reading_now', flat=True)))
+
+    def test_update_closed_releases_copies(self):
+        reserve_session(self.session_1)
+        url = reverse('user-session-detail', kwargs={'pk': self.session_1.id})
+        self.client.force_login(self.user_staff)
+        response = self.client.patch(url, data={'is_closed': True}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([0, 0], list(BookLibraryAvailable.objects.filter(library=self.library_1).values_list(
+            'reserved', flat=True)))
+
+    def test_update_no_free_copies(self):
+        reserve_session(self.session_2)
+        BookLibraryAvailable.objects.filter(book=self.book_1).update(reserved=1)
+        url = reverse('user-session-detail', kwargs={'pk': self.session_2.id})
+        self.client.force_login(self.user_staff)
+        response = self.client.patch(url, data={'library': self.library_1.id, 'books': [self.book_1.id]},
+                                     format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual(self.library_2.id, UserBookSession.objects.get(pk=self.session_2.id).library_id)
+        self.assertEqual(1, BookLibraryAvailable.objects.get(book=self.book_3).reserved)
+
+    def test_update_books(self):
+        url = reverse('user-session-detail', kwargs={'pk': self.session_2.id})
+        self.client.force_login(self.user_staff)
+        response = self.client.patch(url, data={'books': [self.book_1.id]}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([1, 0, 0], list(Books.objects.order_by('pk').values_list('reading_now', flat=True)))
 
     def test_destroy(self):
         url = reverse('user-session-detail', kwargs={'pk': self.session_1.id})
         self.client.force_login(self.user_staff)
         response = self.client.delete(url)
         self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        url = reverse('user-session-detail', kwargs={'pk': self.session_2.id})
+        self.client.delete(url)
+        self.assertEqual(0, Books.objects.get(pk=self.book_3.id).reading_now)
 
 
 class BooksLibrariesAvailableViewSetTestCase(APITestCase):
@@ -812,6 +935,55 @@ class BooksLibrariesAvailableViewSetTestCase(APITestCase):
         self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
 
 
+    def test_import_not_admin(self):
+        url = reverse('available-import')
+        self.client.force_login(self.user_1)
+        response = self.client.post(url, data='book,library,available\n', content_type='text/csv')
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+    def test_import_csv(self):
+        url = reverse('available-import')
+        self.client.force_login(self.user_staff)
+        body = (
+            'book,library,available,copies\n'
+            f'{self.book_1.id},{self.library_1.id},false,\n'
+            f'{self.book_1.id},{self.library_2.id},yes,3\n'
+            f'{self.book_2.id},{self.library_1.id},true,1\n'
+            f'{self.book_3.id + 100},{self.library_1.id},true,1\n'
+            f'{self.book_3.id},{self.library_1.id},maybe,1\n'
+        )
+        response = self.client.post(url, data=body, content_type='text/csv; charset=utf-8')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({
+            'rows': 5, 'created': 1, 'updated': 1, 'unchanged': 1,
+            'errors': [
+                {'line': 6, 'errors': {'available': ['Ожидается true или false.']}},
+                {'line': 5, 'errors': {'book': ['Книга не найдена.']}},
+            ]
+        }, response.data)
+        self.assertFalse(BookLibraryAvailable.objects.get(pk=self.available_1.id).available)
+        self.assertEqual(3, BookLibraryAvailable.objects.get(book=self.book_1, library=self.library_2).copies)
+
+    def test_import_ndjson(self):
+        url = reverse('available-import')
+        self.client.force_login(self.user_staff)
+        body = '\n'.join([
+            json.dumps({'book': self.book_2.id, 'library': self.library_2.id, 'available': True}),
+            '{"book": ',
+            json.dumps({'book': self.book_1.id, 'library': self.library_1.id, 'available': False}),
+        ])
+        response = self.client.post(url, data=body, content_type='application/x-ndjson')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual((3, 1, 1), (response.data['rows'], response.data['created'], response.data['updated']))
+        self.assertEqual([{'line': 2, 'errors': {'non_field_errors': ['Некорректный JSON.']}}], response.data['errors'])
+        self.assertTrue(BookLibraryAvailable.objects.filter(book=self.book_2, library=self.library_2).exists())
+
+    def test_import_unsupported(self):
+        url = reverse('available-import')
+        self.client.force_login(self.user_staff)
+        response = self.client.post(url, data={'book': self.book_1.id}, format='json')
+        self.assertEqual(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, response.status_code)
+
 class UserBookRelationViewSetTestCase(APITestCase):
 
     def setUp(self):
@@ -844,6 +1016,93 @@ class UserBookRelationViewSetTestCase(APITestCase):
         serializer_data = s.UserBookRelationSerializer(book_relation).data
         self.assertEqual(serializer_data, response.data, f'\n{serializer_data}\n{response.data}')
         self.assertTrue(book_relation.like)
+        self.assertEqual(1, Books.objects.get(pk=self.book_1.id).likes)
+
+    def test_update_counters(self):
+        url = reverse('book-relation-detail', kwargs={'book': self.book_1.id})
+        self.client.force_login(self.user_1)
+        self.client.patch(url, data={'like': True, 'rate': 4}, format='json')
+        self.client.patch(url, data={'like': True, 'rate': 2}, format='json')
+        self.client.patch(url, data={'in_bookmarks': True}, format='json')
+        book = Books.objects.get(pk=self.book_1.id)
+        self.assertEqual((1, 1, '2.00'), (book.likes, book.bookmarks, str(book.rating)))
+
+    @override_settings(BOOKS_COUNTERS={'CONSISTENCY': 'deferred'})
+    def test_update_deferred(self):
+        url = reverse('book-relation-detail', kwargs={'book': self.book_1.id})
+        self.client.force_login(self.user_1)
+        response = self.client.patch(url, data={'like': True}, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(0, Books.objects.get(pk=self.book_1.id).likes)
+        flush_book_counters()
+        self.assertEqual(1, Books.objects.get(pk=self.book_1.id).likes)
+
+    def test_update_invalid(self):
+        url = reverse('book-relation-detail', kwargs={'book': self.book_1.id})
+        self.client.force_login(self.user_1)
+        response = self.client.patch(url, data={'rate': 10}, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertFalse(UserBookRelation.objects.exists())
+
+    def test_update_not_found(self):
+        url = reverse('book-relation-detail', kwargs={'book': self.book_1.id + 100})
+        self.client.force_login(self.user_1)
+        response = self.client.patch(url, data={'like': True}, format='json')
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertFalse(UserBookRelation.objects.exists())
+
+    def test_bulk(self):
+        book_2 = Books.objects.create(title='Book 2', description='Desc2', author=self.author_1)
+        book_3 = Books.objects.create(title='Book 3', description='Desc3', author=self.author_1)
+        url = reverse('book-relation-bulk')
+        self.client.force_login(self.user_1)
+        self.client.patch(reverse('book-relation-detail', kwargs={'book': self.book_1.id}),
+                          data={'like': True, 'rate': 4}, format='json')
+        items = [
+            {'book': self.book_1.id, 'rate': 2},
+            {'book': book_2.id, 'like': True, 'in_bookmarks': True, 'rate': 5},
+            {'book': book_3.id, 'in_bookmarks': True},
+        ]
+        response = self.client.post(url, data=items, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        relations = [UserBookRelation.objects.get(user=self.user_1, book_id=item['book']) for item in items]
+        self.assertEqual(s.UserBookRelationSerializer(relations, many=True).data, response.data)
+        self.assertTrue(relations[0].like)
+        counters = Books.objects.filter(pk__in=[item['book'] for item in items]).order_by('pk').values_list(
+            'likes', 'bookmarks', 'rating')
+        self.assertEqual([(1, 0, 2), (1, 1, 5), (0, 1, None)], [
+            (likes, bookmarks, rating if rating is None else float(rating)) for likes, bookmarks, rating in counters])
+
+    def test_bulk_invalid(self):
+        url = reverse('book-relation-bulk')
+        self.client.force_login(self.user_1)
+        response = self.client.post(url, data=[{'book': self.book_1.id}, {'book': self.book_1.id, 'like': True}],
+                                    format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.post(url, data=[{'book': self.book_1.id + 100, 'like': True}], format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual([f'Книги не найдены: {self.book_1.id + 100}.'], response.data)
+        self.assertFalse(UserBookRelation.objects.exists())
+
+    def test_bulk_max_items(self):
+        url = reverse('book-relation-bulk')
+        self.client.force_login(self.user_1)
+        # слишком длинный список отклоняется до проверки элементов
+        with mock.patch.object(s.UserBookRelationBulkSerializer, 'run_validation') as run_validation:
+            response = self.client.post(url, data=[{'book': 'x'}] * 1001, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'non_field_errors': ['Не больше 1000 книг за один запрос.']}, response.data)
+        run_validation.assert_not_called()
+
+    @override_settings(BOOKS_COUNTERS={'CONSISTENCY': 'deferred'})
+    def test_bulk_deferred(self):
+        url = reverse('book-relation-bulk')
+        self.client.force_login(self.user_1)
+        response = self.client.post(url, data=[{'book': self.book_1.id, 'like': True}], format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(0, Books.objects.get(pk=self.book_1.id).likes)
+        flush_book_counters()
+        self.assertEqual(1, Books.objects.get(pk=self.book_1.id).likes)
 
 
 class MyOffersViewSetTestCase(APITestCase):
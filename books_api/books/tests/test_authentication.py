@@ -0,0 +1,133 @@
+import base64
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.functional import SimpleLazyObject
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from books.authentication import (
+    CachedBasicAuthentication, CachedSessionAuthentication, CachedTokenAuthentication,
+    _credentials
+)
+from books.cache import get_version
+from books.models import User
+
+
+@override_settings(BOOKS_AUTH_CACHE={'ENABLED': True}, BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': True})
+class CredentialCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        _credentials.clear()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='User1', password='password')
+
+    def tearDown(self):
+        cache.clear()
+        _credentials.clear()
+
+    def basic(self, username='User1', password='password'):
+        credentials = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        request = Request(self.factory.get('/', HTTP_AUTHORIZATION=f'Basic {credentials}'))
+        return CachedBasicAuthentication().authenticate(request)
+
+    def token(self, key):
+        request = Request(self.factory.get('/', HTTP_AUTHORIZATION=f'Token {key}'))
+        return CachedTokenAuthentication().authenticate(request)
+
+    def session(self, session_key):
+        request = self.factory.get('/')
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        return CachedSessionAuthentication().authenticate(Request(request))
+
+    def test_basic_hit(self):
+        self.assertEqual(self.user, self.basic()[0])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user, self.basic()[0])
+        with self.assertRaises(AuthenticationFailed):
+            self.basic(password='wrong')
+
+    def test_passwords_not_stored(self):
+        self.basic()
+        self.assertNotIn('password', str(list(_credentials.entries)))
+        self.assertEqual(1, len(_credentials.entries))
+
+    def test_password_change(self):
+        self.basic()
+        self.user.set_password('new-password')
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.basic()
+        self.assertEqual(self.user, self.basic(password='new-password')[0])
+
+    def test_is_active_change(self):
+        self.basic()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.basic()
+
+    def test_token_deleted(self):
+        token = Token.objects.create(user=self.user)
+        self.assertEqual((self.user, token), self.token(token.key))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user, self.token(token.key)[0])
+        token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.token(token.key)
+
+    def test_session_hit(self):
+        self.client.force_login(self.user)
+        session_key = self.client.session.session_key
+        self.assertEqual(self.user, self.session(session_key)[0])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.user, self.session(session_key)[0])
+        self.assertFalse([query for query in queries if 'auth_user' in query['sql']])
+
+    def test_logout(self):
+        self.client.force_login(self.user)
+        session_key = self.client.session.session_key
+        self.session(session_key)
+        version = get_version('auth', self.user.pk)
+        self.client.logout()
+        self.assertNotEqual(version, get_version('auth', self.user.pk))
+        self.assertIsNone(self.session(session_key))
+
+    @override_settings(BOOKS_AUTH_CACHE={'ENABLED': True, 'TIMEOUT': 0})
+    def test_timeout(self):
+        self.basic()
+        with CaptureQueriesContext(connection) as queries:
+            self.basic()
+        self.assertTrue(queries)
+
+    @override_settings(BOOKS_AUTH_CACHE={'ENABLED': True, 'MAX_SIZE': 1})
+    def test_max_size(self):
+        User.objects.create_user(username='User2', password='password')
+        self.basic()
+        self.basic(username='User2')
+        self.assertEqual(1, len(_credentials.entries))
+        with self.assertNumQueries(0):
+            self.basic(username='User2')
+        with CaptureQueriesContext(connection) as queries:
+            self.basic()
+        self.assertTrue(queries)
+
+    @override_settings(BOOKS_AUTH_CACHE={'ENABLED': False})
+    def test_disabled(self):
+        self.basic()
+        self.assertFalse(_credentials.entries)
+
+    @override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': False})
+    def test_local_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.basic()
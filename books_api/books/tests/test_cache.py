@@ -0,0 +1,146 @@
+import datetime
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from books.cache import get_book_detail, get_version, bump_book_versions, is_cache_shared
+from books.models import (
+    Authors, Books, Libraries,
+    BookLibraryAvailable, User, UserBookRelation,
+    UserBookSession
+)
+from books.services import set_book_values
+
+
+@override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': True})
+class BookDetailCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().get('/')
+        self.calls = 0
+
+    def tearDown(self):
+        cache.clear()
+
+    def compute(self, value='data'):
+        self.calls += 1
+        return value
+
+    def test_hit(self):
+        self.assertEqual('data', get_book_detail(1, self.request, self.compute))
+        self.assertEqual('data', get_book_detail(1, self.request, self.compute))
+        self.assertEqual(1, self.calls)
+
+    def test_version_bump(self):
+        get_book_detail(1, self.request, self.compute)
+        version = get_version('book', 1)
+        bump_book_versions([1])
+        self.assertNotEqual(version, get_version('book', 1))
+        self.assertEqual('new', get_book_detail(1, self.request, lambda: self.compute('new')))
+        self.assertEqual(2, self.calls)
+
+    def test_stale_while_revalidate(self):
+        get_book_detail(1, self.request, self.compute)
+        bump_book_versions([1])
+        cache.add(f'books:detail:1:{self.lock_suffix()}:lock', 1)
+        self.assertEqual('data', get_book_detail(1, self.request, lambda: self.compute('new')))
+        self.assertEqual(1, self.calls)
+
+    @override_settings(BOOKS_DETAIL_CACHE={'STALE_WHILE_REVALIDATE': 0, 'WAIT_TIMEOUT': 0.1, 'SINGLE_PROCESS': True})
+    def test_wait_timeout(self):
+        get_book_detail(1, self.request, self.compute)
+        bump_book_versions([1])
+        time.sleep(0.01)
+        cache.add(f'books:detail:1:{self.lock_suffix()}:lock', 1)
+        self.assertEqual('new', get_book_detail(1, self.request, lambda: self.compute('new')))
+        self.assertEqual(2, self.calls)
+
+    @override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': False})
+    def test_local_cache(self):
+        self.assertFalse(is_cache_shared())
+        get_book_detail(1, self.request, self.compute)
+        get_book_detail(1, self.request, self.compute)
+        self.assertEqual(2, self.calls)
+
+    def test_single_flight(self):
+        results = []
+
+        def slow_compute():
+            time.sleep(0.2)
+            return self.compute()
+
+        def worker():
+            results.append(get_book_detail(1, self.request, slow_compute))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['data'] * 5, results)
+        self.assertEqual(1, self.calls)
+
+    def lock_suffix(self):
+        return hashlib.md5(self.request.build_absolute_uri('/').encode()).hexdigest()
+
+
+@override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': True})
+class BookDetailCacheInvalidationTestCase(APITestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        self.book_1 = Books.objects.create(title='Book 1', description='Desc1', author=self.author_1)
+        self.url = reverse('book-detail', kwargs={'pk': self.book_1.id})
+
+    def test_relation_changed(self):
+        self.assertEqual(0, self.client.get(self.url).data['likes'])
+        self.client.force_login(self.user_1)
+        self.client.patch(reverse('book-relation-detail', kwargs={'book': self.book_1.id}),
+                          data={'like': True}, format='json')
+        self.assertEqual(1, self.client.get(self.url).data['likes'])
+
+    def test_available_changed(self):
+        self.assertEqual([], self.client.get(self.url).data['lib_available'])
+        BookLibraryAvailable.objects.create(book=self.book_1, library=self.library_1, available=True)
+        self.assertEqual('Lib 1', self.client.get(self.url).data['lib_available'][0]['library'])
+        self.library_1.title = 'Lib 2'
+        self.library_1.save()
+        self.assertEqual('Lib 2', self.client.get(self.url).data['lib_available'][0]['library'])
+
+    def test_author_changed(self):
+        self.client.get(self.url)
+        self.author_1.last_name = 'Author 2'
+        self.author_1.save()
+        self.assertEqual('Test Author 2', self.client.get(self.url).data['author']['full_name'])
+
+    def test_session_changed(self):
+        self.client.get(self.url)
+        session = UserBookSession.objects.create(user=self.user_1, library=self.library_1,
+                                                 start_date=datetime.date.today(),
+                                                 end_date=datetime.date.today() + datetime.timedelta(days=7),
+                                                 is_accepted=True)
+        version = get_version('book', self.book_1.id)
+        session.books.add(self.book_1)
+        self.assertNotEqual(version, get_version('book', self.book_1.id))
+        version = get_version('book', self.book_1.id)
+        session.delete()
+        self.assertNotEqual(version, get_version('book', self.book_1.id))
+
+    def test_relation_deleted(self):
+        relation = UserBookRelation.objects.create(user=self.user_1, book=self.book_1, like=True)
+        set_book_values(relation)
+        version = get_version('book', self.book_1.id)
+        relation.delete()
+        self.assertNotEqual(version, get_version('book', self.book_1.id))
+
+    def test_not_found(self):
+        response = self.client.get(reverse('book-detail', kwargs={'pk': 0}))
+        self.assertEqual(404, response.status_code)
@@ -0,0 +1,104 @@
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from books.models import (
+    Authors, Books, Categories,
+    Libraries, BookLibraryAvailable, User,
+    UserBookRelation
+)
+from books.services import set_book_values
+
+
+@override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': True})
+class ConditionalGetTestCase(APITestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.category_1 = Categories.objects.create(title='Category 1')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        self.book_1 = Books.objects.create(title='Book 1', description='Desc 1', author=self.author_1)
+        self.book_1.categories.add(self.category_1)
+        BookLibraryAvailable.objects.create(book=self.book_1, library=self.library_1, available=True)
+
+    def assertNotModified(self, url, response, **params):
+        with self.assertNumQueries(0):
+            conditional = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, conditional.status_code)
+        self.assertEqual(response['ETag'], conditional['ETag'])
+
+    def assertModified(self, url, response, **params):
+        conditional = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(status.HTTP_200_OK, conditional.status_code)
+        self.assertNotEqual(response['ETag'], conditional['ETag'])
+        return conditional
+
+    def test_book_list(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        self.assertNotModified(url, response)
+        self.assertModified(url, response, ordering='likes')
+        relation = UserBookRelation.objects.create(user=self.user_1, book=self.book_1, like=True)
+        set_book_values(relation)
+        response = self.assertModified(url, response)
+        self.assertNotModified(url, response)
+
+    def test_book_detail(self):
+        url = reverse('book-detail', kwargs={'pk': self.book_1.id})
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+        self.library_1.title = 'Lib 2'
+        self.library_1.save()
+        response = self.assertModified(url, response)
+        self.assertEqual('Lib 2', response.data['lib_available'][0]['library'])
+
+    def test_if_modified_since(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        conditional = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, conditional.status_code)
+
+    def test_tables(self):
+        for name, instance in (('author', self.author_1), ('category', self.category_1),
+                               ('library', self.library_1)):
+            with self.subTest(name):
+                urls = [reverse(f'{name}-list'), reverse(f'{name}-detail', kwargs={'pk': instance.id}),
+                        reverse(f'{name}-books', kwargs={'pk': instance.id})]
+                responses = [self.client.get(url) for url in urls]
+                for url, response in zip(urls, responses):
+                    self.assertNotModified(url, response)
+                instance.title = 'New title'
+                instance.last_name = 'New name'
+                instance.save()
+                for url, response in zip(urls, responses):
+                    self.assertModified(url, response)
+
+    def test_format(self):
+        url = reverse('author-list')
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        conditional = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_ACCEPT='text/html')
+        self.assertEqual(status.HTTP_200_OK, conditional.status_code)
+
+    @override_settings(ALLOWED_HOSTS=['example.com', 'testserver'])
+    def test_host(self):
+        url = reverse('author-list')
+        response = self.client.get(url)
+        conditional = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_HOST='example.com')
+        self.assertEqual(status.HTTP_200_OK, conditional.status_code)
+
+    def test_not_conditional(self):
+        self.client.force_login(self.user_1)
+        response = self.client.get(reverse('my-session-list'))
+        self.assertNotIn('ETag', response)
+        self.author_1.delete()
+        self.assertEqual(status.HTTP_404_NOT_FOUND, self.client.get(
+            reverse('author-detail', kwargs={'pk': self.author_1.id})).status_code)
+
+    @override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': False})
+    def test_local_cache(self):
+        response = self.client.get(reverse('book-list'))
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
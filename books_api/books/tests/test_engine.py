@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from books.engine import CatalogEngine, get_catalog_engine
+from books.models import Authors, Books, Categories, Libraries, BookLibraryAvailable, BookCatalog
+
+
+class EngineTestMixin:
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'catalog.bin')
+        self.engine_settings = {'ENABLED': True, 'PATH': self.path, 'COMPACT_ROWS': 1000}
+
+    def get(self, params, enabled=True):
+        with self.settings(BOOKS_CATALOG_ENGINE={**self.engine_settings, 'ENABLED': enabled}):
+            return self.client.get(reverse('book-list'), data=params)
+
+    def walk(self, params, enabled=True):
+        """Проход курсором вперёд до конца и назад до начала, возвращает id книг страниц"""
+        with self.settings(BOOKS_CATALOG_ENGINE={**self.engine_settings, 'ENABLED': enabled}):
+            response = self.client.get(reverse('book-list'), data={**params, 'cursor': ''})
+            pages = []
+            for link in ('next', 'previous'):
+                while True:
+                    self.assertEqual(status.HTTP_200_OK, response.status_code)
+                    pages.append([item['url'] for item in response.data['results']])
+                    if not response.data[link]:
+                        break
+                    response = self.client.get(response.data[link])
+        return pages
+
+
+class CatalogEngineTestCase(EngineTestMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authors = [Authors.objects.create(first_name='Test', last_name=f'Author {i}') for i in range(2)]
+        self.categories = [Categories.objects.create(title=f'Category {i}') for i in range(3)]
+        self.libraries = [Libraries.objects.create(title=f'Lib {i}', location='Loc', phone='Phone') for i in range(2)]
+        ratings = [None, Decimal('4.50'), Decimal('3.00'), None, Decimal('4.50'), Decimal('5.00'), Decimal('3.00'),
+                   None, Decimal('4.50'), Decimal('1.00'), None, Decimal('4.50'), Decimal('2.00'), None,
+                   Decimal('4.50'), Decimal('3.00'), None, Decimal('5.00'), Decimal('4.50'), None, Decimal('2.50')]
+        self.books = []
+        for number, rating in enumerate(ratings):
+            book = Books.objects.create(title=f'Book {number}', description='Desc', author=self.authors[number % 2],
+                                        rating=rating, likes=number % 4)
+            book.categories.add(self.categories[number % 3])
+            BookLibraryAvailable.objects.create(book=book, library=self.libraries[number % 2],
+                                                available=number % 7 != 0)
+            self.books.append(book)
+        self.params = [
+            {}, {'ordering': 'rating'}, {'ordering': '-rating'}, {'ordering': 'likes'}, {'ordering': '-likes'},
+            {'categories': [self.categories[0].pk, self.categories[1].pk]}, {'author': self.authors[1].pk},
+            {'lib_available__library': self.libraries[0].pk, 'ordering': 'rating'},
+            {'author': self.authors[0].pk, 'categories': [self.categories[2].pk], 'ordering': '-rating'},
+            {'page': 2}, {'page': 3, 'ordering': 'rating'},
+        ]
+
+    def assertSameAsDatabase(self):
+        for params in self.params:
+            response, expected = self.get(params), self.get(params, enabled=False)
+            self.assertEqual(expected.status_code, response.status_code, msg=params)
+            self.assertEqual(expected.data, response.data, msg=params)
+            self.assertEqual(self.walk(params, enabled=False), self.walk(params), msg=params)
+
+    def test_facets(self):
+        for params in self.params[:9]:
+            responses = []
+            for enabled in (True, False):
+                with self.settings(BOOKS_CATALOG_ENGINE={**self.engine_settings, 'ENABLED': enabled}):
+                    cache.clear()
+                    responses.append(self.client.get(reverse('book-facets'), data=params))
+            self.assertEqual(status.HTTP_200_OK, responses[0].status_code, msg=params)
+            self.assertEqual(responses[1].data, responses[0].data, msg=params)
+
+    def test_same_as_database(self):
+        self.assertSameAsDatabase()
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_invalid_filter(self):
+        # некорректные параметры обрабатываются обычным путём
+        response = self.get({'author': 0})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_update(self):
+        engine = CatalogEngine(self.path)
+        engine.build()
+        Books.objects.filter(pk=self.books[1].pk).update(likes=10)
+        BookCatalog.objects.filter(pk=self.books[1].pk).update(likes=10)
+        BookLibraryAvailable.objects.filter(book=self.books[2]).update(available=False)
+        BookCatalog.objects.filter(pk=self.books[2].pk).update(available=False)
+        self.books[3].categories.add(self.categories[1])
+        deleted_pk = self.books[4].pk
+        self.books[4].delete()
+        engine.update([self.books[1].pk, self.books[2].pk, self.books[3].pk, deleted_pk])
+        self.assertTrue(os.path.exists(self.path + '.delta'))
+        self.assertSameAsDatabase()
+
+    def test_compact(self):
+        engine = CatalogEngine(self.path, compact_rows=1)
+        engine.build()
+        for book in self.books[1:4]:
+            Books.objects.filter(pk=book.pk).update(likes=20)
+            BookCatalog.objects.filter(pk=book.pk).update(likes=20)
+            engine.update([book.pk])
+        self.assertTrue(os.path.exists(self.path + '.delta'))
+        # при втором изменении дельта превышает COMPACT_ROWS и сливается в новый снимок
+        self.assertEqual(1, len(engine.state().delta))
+        self.assertSameAsDatabase()
+
+    def test_shared_snapshot(self):
+        # процесс, обновивший снимок, и процесс, читающий его, видят одни и те же данные
+        reader, writer = CatalogEngine(self.path), CatalogEngine(self.path)
+        reader.state()
+        Books.objects.filter(pk=self.books[5].pk).update(likes=100)
+        BookCatalog.objects.filter(pk=self.books[5].pk).update(likes=100)
+        writer.update([self.books[5].pk])
+        state = reader.state()
+        self.assertEqual(self.books[5].pk, state.page({}, 'likes', True, 0, 1)[0])
+        self.assertEqual(state.count({}), BookCatalog.objects.filter(available=True).count())
+
+
+class CatalogEngineSignalsTestCase(EngineTestMixin, TransactionTestCase):
+
+    def test_signals(self):
+        author = Authors.objects.create(first_name='Test', last_name='Author')
+        library = Libraries.objects.create(title='Lib', location='Loc', phone='Phone')
+        book = Books.objects.create(title='Book 1', description='Desc', author=author)
+        BookLibraryAvailable.objects.create(book=book, library=library, available=True)
+        with self.settings(BOOKS_CATALOG_ENGINE=self.engine_settings):
+            get_catalog_engine().build()
+            new_book = Books.objects.create(title='Book 2', description='Desc', author=author)
+            BookLibraryAvailable.objects.create(book=new_book, library=library, available=True)
+            self.assertEqual(2, get_catalog_engine().state().count({'library': library.pk}))
+            book.delete()
+            self.assertEqual([new_book.pk], get_catalog_engine().state().page({}, 'created_at', True, 0, 10))
@@ -0,0 +1,93 @@
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from books.exporters import ExportError, export_catalog, file_sha256, get_shard_ranges
+from books.models import Authors, Books, Categories, Libraries, BookLibraryAvailable
+
+
+class ExportCatalogTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.category_1 = Categories.objects.create(title='Cat 1')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        self.books = [Books.objects.create(title=f'Book {i}', description='-', author=self.author_1)
+                      for i in range(5)]
+        self.books[0].categories.add(self.category_1)
+        BookLibraryAvailable.objects.create(book=self.books[0], library=self.library_1, available=True, copies=2)
+
+    def read_ndjson(self, manifest):
+        records = []
+        for shard in manifest['shards']:
+            with gzip.open(os.path.join(self.directory, shard['file']), 'rt', encoding='utf-8') as file:
+                records.extend(json.loads(line) for line in file)
+        return records
+
+    def test_shard_ranges(self):
+        ranges = get_shard_ranges(2)
+        self.assertEqual(2, len(ranges))
+        self.assertEqual((None, self.books[2].id), ranges[0])
+        self.assertEqual((self.books[2].id, None), ranges[1])
+        # шардов не больше, чем книг
+        self.assertEqual(5, len(get_shard_ranges(10)))
+
+    def test_ndjson(self):
+        manifest = export_catalog(self.directory, shards=2, chunk_size=2)
+        self.assertEqual(5, manifest['rows'])
+        self.assertEqual([2, 3], [shard['rows'] for shard in manifest['shards']])
+        with open(os.path.join(self.directory, 'manifest.json'), encoding='utf-8') as file:
+            self.assertEqual(manifest['rows'], json.load(file)['rows'])
+        for shard in manifest['shards']:
+            self.assertEqual(shard['sha256'], file_sha256(os.path.join(self.directory, shard['file'])))
+        records = self.read_ndjson(manifest)
+        self.assertEqual([book.id for book in self.books], [record['id'] for record in records])
+        self.assertEqual('T. Author 1', records[0]['author'])
+        self.assertEqual(['Cat 1'], records[0]['categories'])
+        self.assertTrue(records[0]['available'])
+        self.assertEqual([{'library': self.library_1.id, 'title': 'Lib 1', 'available': True, 'copies': 2,
+                           'reserved': 0}], records[0]['libraries'])
+        self.assertEqual([], records[1]['libraries'])
+
+    def test_csv(self):
+        manifest = export_catalog(self.directory, fmt='csv', compression='none')
+        self.assertEqual(['catalog-0000.csv'], [shard['file'] for shard in manifest['shards']])
+        with open(os.path.join(self.directory, 'catalog-0000.csv'), encoding='utf-8', newline='') as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual(5, len(rows))
+        self.assertEqual(['Cat 1'], json.loads(rows[0]['categories']))
+        self.assertEqual(self.books[0].created_at.isoformat()[:19], rows[0]['created_at'][:19])
+
+    def test_zstd_not_installed(self):
+        with mock.patch.dict('sys.modules', {'zstandard': None}):
+            with self.assertRaises(ExportError):
+                export_catalog(self.directory, compression='zstd')
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'manifest.json')))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Уровень изоляции выгрузки задаётся только в PostgreSQL')
+class ExportSnapshotTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        author = Authors.objects.create(first_name='Test', last_name='Author 1')
+        Books.objects.bulk_create([Books(title=f'Book {i}', description='-', author=author) for i in range(4)])
+
+    def test_shards_in_one_process(self):
+        with CaptureQueriesContext(connection) as context:
+            manifest = export_catalog(self.directory, shards=2)
+        self.assertEqual([2, 2], [shard['rows'] for shard in manifest['shards']])
+        queries = [query['sql'] for query in context.captured_queries]
+        self.assertIn('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ', queries[0])
+        self.assertFalse([sql for sql in queries if 'pg_export_snapshot' in sql])
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APIRequestFactory
+
+from books.fields import HyperlinkedIdentityField
+from books.models import Authors
+
+
+@override_settings(ALLOWED_HOSTS=['example.com', 'other.com'])
+class HyperlinkedIdentityFieldTestCase(TestCase):
+
+    def setUp(self):
+        self.authors = [Authors.objects.create(first_name='Test', last_name=f'Author {i}') for i in range(3)]
+        self.request = Request(APIRequestFactory().get('/', HTTP_HOST='example.com'))
+
+    def represent(self, field_class, obj, request, view_name='author-books', format=None):
+        field = field_class(view_name=view_name)
+        field.bind('url', serializers.Serializer(context={'request': request, 'format': format}))
+        return field.to_representation(obj)
+
+    def test_same_urls(self):
+        for view_name in ('author-detail', 'author-books'):
+            for format in (None, 'json'):
+                for author in self.authors:
+                    expected = self.represent(serializers.HyperlinkedIdentityField, author, self.request,
+                                              view_name, format)
+                    self.assertEqual(expected, self.represent(HyperlinkedIdentityField, author, self.request,
+                                                              view_name, format))
+        self.assertEqual(f'http://example.com/api/v1/authors/{self.authors[0].id}/books/',
+                         self.represent(HyperlinkedIdentityField, self.authors[0], self.request))
+
+    def test_reverse_once_per_request(self):
+        with mock.patch('rest_framework.relations.reverse', wraps=reverse) as reverse_mock:
+            for author in self.authors:
+                self.represent(HyperlinkedIdentityField, author, self.request)
+            self.assertEqual(1, reverse_mock.call_count)
+            request = Request(APIRequestFactory().get('/', HTTP_HOST='other.com'))
+            url = self.represent(HyperlinkedIdentityField, self.authors[0], request)
+            self.assertEqual(2, reverse_mock.call_count)
+        self.assertEqual(f'http://other.com/api/v1/authors/{self.authors[0].id}/books/', url)
+
+    def test_without_request(self):
+        self.assertEqual(f'/api/v1/authors/{self.authors[0].id}/books/',
+                         self.represent(HyperlinkedIdentityField, self.authors[0], None))
+
+    def test_not_int(self):
+        field = HyperlinkedIdentityField(view_name='author-detail')
+        self.assertEqual('http://example.com/api/v1/authors/a%20b/',
+                         field.format_url('a b', 'author-detail', self.request, None))
@@ -0,0 +1,64 @@
+import datetime
+import random
+from collections import Counter
+
+from django.test import TestCase
+
+from books.generators import ZipfSampler, GenerationError, book_libraries, generate_data, generate_rows, get_counts
+from books.models import Authors, Books, BookLibraryAvailable, Libraries, User, UserBookRelation, UserBookSession
+
+
+class ZipfSamplerTestCase(TestCase):
+
+    def test_skew(self):
+        rng = random.Random(1)
+        sampler = ZipfSampler(1000, 1.1)
+        counts = Counter(sampler.sample(rng) for _ in range(20000))
+        self.assertLessEqual(set(counts), set(range(1000)))
+        # первое место встречается чаще десятого, десятое - чаще сотого
+        self.assertGreater(counts[0], counts[9] * 3)
+        self.assertGreater(sum(counts[i] for i in range(10)), sum(counts[i] for i in range(500, 1000)))
+
+
+class GenerateDataTestCase(TestCase):
+
+    def setUp(self):
+        self.counts = get_counts(200, authors=10, categories=20, libraries=5, users=30, relations=300, sessions=20)
+
+    def test_counts(self):
+        with self.assertRaises(GenerationError):
+            get_counts(0)
+        self.assertEqual({'books': 1000, 'authors': 50, 'categories': 20, 'libraries': 5, 'users': 500,
+                          'relations': 10000, 'sessions': 250}, get_counts(1000))
+
+    def test_rows_are_deterministic(self):
+        first_ids = dict.fromkeys(('authors', 'categories', 'libraries', 'users', 'books', 'sessions'), 1)
+        spec = {'counts': self.counts, 'seed': 5, 'chunk_size': 50, 'date': datetime.date(2021, 1, 1),
+                'first_ids': first_ids}
+        self.assertEqual(generate_rows(spec, 'books', 1), generate_rows(spec, 'books', 1))
+        self.assertNotEqual(generate_rows(spec, 'books', 0), generate_rows(spec, 'books', 1))
+
+    def test_generate(self):
+        totals = generate_data(self.counts, seed=3, chunk_size=64)
+        self.assertEqual(200, Books.objects.count())
+        self.assertEqual(10, Authors.objects.count())
+        self.assertEqual(30, User.objects.count())
+        self.assertEqual(20, UserBookSession.objects.count())
+        self.assertEqual(totals['relations'], UserBookRelation.objects.count())
+        self.assertGreater(totals['relations'], 100)
+        # у каждой книги есть наличие, книги сессий есть в библиотеке сессии
+        self.assertFalse(Books.objects.filter(lib_available__isnull=True).exists())
+        for session in UserBookSession.objects.prefetch_related('books'):
+            for book in session.books.all():
+                self.assertTrue(BookLibraryAvailable.objects.filter(book=book, library=session.library_id).exists())
+        # после загрузки новые записи получают следующие id
+        author = Authors.objects.create(first_name='New', last_name='Author')
+        self.assertEqual(Authors.objects.exclude(pk=author.pk).order_by('-pk').first().pk + 1, author.pk)
+
+    def test_book_libraries_match_availability(self):
+        generate_data(self.counts, seed=4, chunk_size=1000)
+        spec = {'seed': 4, 'counts': self.counts,
+                'first_ids': {'libraries': Libraries.objects.order_by('pk').first().pk}}
+        book = Books.objects.order_by('pk').first()
+        self.assertEqual(sorted(book.lib_available.values_list('library_id', flat=True)),
+                         book_libraries(spec, book.pk))
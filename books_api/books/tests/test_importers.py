@@ -0,0 +1,71 @@
+import io
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from books.importers import AvailabilityImport, iter_lines, read_csv, read_ndjson
+from books.models import Authors, Books, Libraries, BookLibraryAvailable, BookCatalog
+
+
+class AvailabilityImportTestCase(TestCase):
+
+    def setUp(self):
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.books = [Books.objects.create(title=f'Book {i}', description='-', author=self.author_1)
+                      for i in range(5)]
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+
+    def run_csv(self, text, chunk_size=2):
+        lines = iter_lines(io.BytesIO(text.encode()))
+        return AvailabilityImport(chunk_size=chunk_size).run(read_csv(lines))
+
+    def test_chunks(self):
+        rows = ''.join(f'{book.id},{self.library_1.id},1\n' for book in self.books)
+        report = self.run_csv('book,library,available\n' + rows)
+        self.assertEqual({'rows': 5, 'created': 5, 'updated': 0, 'unchanged': 0, 'errors': []}, report)
+        self.assertEqual(5, BookLibraryAvailable.objects.filter(available=True).count())
+        # каталог обновляется без сигналов bulk-операций
+        self.assertEqual(5, BookCatalog.objects.filter(available=True).count())
+
+    def test_num_queries(self):
+        # количество запросов на часть не зависит от количества строк в ней
+        def import_books(books):
+            with CaptureQueriesContext(connection) as context:
+                self.run_csv('book,library,available\n' + ''.join(
+                    f'{book.id},{self.library_1.id},1\n' for book in books), chunk_size=10)
+            return len(context.captured_queries)
+
+        self.assertEqual(import_books(self.books[:1]), import_books(self.books[1:]))
+
+    def test_last_row_wins(self):
+        book = self.books[0]
+        report = self.run_csv(f'book,library,available\n{book.id},{self.library_1.id},1\n'
+                              f'{book.id},{self.library_1.id},0\n')
+        self.assertEqual(1, report['created'])
+        self.assertFalse(BookLibraryAvailable.objects.get(book=book).available)
+
+    def test_reserved_copies(self):
+        entry = BookLibraryAvailable.objects.create(book=self.books[0], library=self.library_1, available=True,
+                                                    copies=3, reserved=2)
+        report = self.run_csv(f'book,library,available,copies\n{self.books[0].id},{self.library_1.id},1,1\n'
+                              f'{self.books[1].id},{self.library_1.id},1,1\n')
+        self.assertEqual([{'line': 2, 'errors': {'copies': ['Зарезервировано 2 экземпляров.']}}], report['errors'])
+        self.assertEqual(1, report['created'])
+        entry.refresh_from_db()
+        self.assertEqual(3, entry.copies)
+
+    def test_invalid_values(self):
+        report = self.run_csv('book,library,available,copies\nx,,true,-1\n')
+        self.assertEqual([{'line': 2, 'errors': {
+            'book': ['Ожидается id.'], 'library': ['Ожидается id.'],
+            'copies': ['Ожидается неотрицательное целое число.'],
+        }}], report['errors'])
+
+    def test_read_ndjson(self):
+        lines = iter_lines(io.BytesIO(b'{"book": 1}\n\n[1]\n\xff\n'))
+        self.assertEqual([
+            (1, {'book': 1}, None),
+            (3, None, 'Ожидается объект JSON.'),
+            (4, None, 'Некорректный JSON.'),
+        ], list(read_ndjson(lines)))
@@ -0,0 +1,178 @@
+import random
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from books import leaderboards
+from books.leaderboards import METRICS, flush_leaderboards, rebuild_leaderboards, top_books, update_leaderboards
+from books.models import (
+    Authors, Books, Categories, Libraries, BookLibraryAvailable, Leaderboard, LeaderboardEntry, LeaderboardQueue
+)
+from books.services import upsert_relation
+
+
+def get_boards():
+    """Содержимое всех непустых таблиц: {(scope, scope_id, metric): [(id книги, значение), ...]}"""
+    boards = {}
+    for board in Leaderboard.objects.all():
+        entries = list(board.entries.values_list('book_id', 'score'))
+        if entries:
+            boards[board.scope, board.scope_id, board.metric] = entries
+    return boards
+
+
+@override_settings(BOOKS_LEADERBOARDS={'SIZE': 3, 'PRIOR_VOTES': 10, 'PRIOR_MEAN': 3})
+class LeaderboardsTestCase(TestCase):
+
+    def setUp(self):
+        author = Authors.objects.create(first_name='Test', last_name='Author')
+        self.categories = [Categories.objects.create(title=f'Category {i}') for i in range(2)]
+        self.libraries = [Libraries.objects.create(title=f'Lib {i}', location='Loc', phone='Phone') for i in range(2)]
+        self.random = random.Random(1)
+        self.books = []
+        for number in range(10):
+            book = Books.objects.create(title=f'Book {number}', description='Desc', author=author)
+            book.categories.add(self.categories[number % 2])
+            BookLibraryAvailable.objects.create(book=book, library=self.libraries[number % 2], available=True)
+            self.set_counters(book)
+            self.books.append(book)
+
+    def set_counters(self, book):
+        rating_count = self.random.randint(0, 30)
+        Books.objects.filter(pk=book.pk).update(rating_count=rating_count, likes=self.random.randint(0, 5),
+                                                rating_sum=rating_count * self.random.randint(1, 5))
+
+    def expected(self):
+        boards = {}
+        scopes = [('all', 0), *(('category', item.pk) for item in self.categories),
+                  *(('library', item.pk) for item in self.libraries)]
+        for scope, scope_id in scopes:
+            for metric in METRICS:
+                items = top_books(scope, scope_id, metric, 3)
+                if items:
+                    boards[scope, scope_id, metric] = items
+        return boards
+
+    def test_bayesian_average(self):
+        one_vote, many_votes = self.books[:2]
+        Books.objects.filter(pk=one_vote.pk).update(rating_sum=5, rating_count=1, likes=0)
+        Books.objects.filter(pk=many_votes.pk).update(rating_sum=450, rating_count=100, likes=0)
+        Books.objects.exclude(pk__in=[one_vote.pk, many_votes.pk]).update(rating_sum=0, rating_count=0)
+        self.assertEqual(10, rebuild_leaderboards())
+        board = get_boards()['all', 0, 'rating']
+        self.assertEqual([many_votes.pk, one_vote.pk], [book_id for book_id, _ in board])
+        self.assertAlmostEqual((30 + 450) / 110, board[0][1])
+        self.assertAlmostEqual((30 + 5) / 11, board[1][1])
+
+    def test_update(self):
+        rebuild_leaderboards()
+        self.assertEqual(self.expected(), get_boards())
+        for step in range(30):
+            book = self.random.choice(self.books)
+            action = step % 5
+            if action == 0:
+                book.categories.set([self.random.choice(self.categories)])
+            elif action == 1:
+                BookLibraryAvailable.objects.filter(book=book).update(available=self.random.random() < 0.5)
+            else:
+                self.set_counters(book)
+            update_leaderboards([book.pk])
+            self.assertEqual(self.expected(), get_boards(), msg=step)
+        # освободившееся место удалённой книги занимает книга не из таблицы
+        deleted_pk = get_boards()['all', 0, 'likes'][0][0]
+        Books.objects.filter(pk=deleted_pk).delete()
+        update_leaderboards([deleted_pk])
+        self.assertEqual(self.expected(), get_boards())
+
+    def test_new_scope(self):
+        rebuild_leaderboards()
+        category = Categories.objects.create(title='New')
+        self.categories.append(category)
+        for book in self.books[:5]:
+            book.categories.add(category)
+        update_leaderboards([self.books[0].pk])
+        # таблица новой категории заполняется всеми её книгами, а не только изменённой
+        self.assertEqual(3, Leaderboard.objects.get(scope='category', scope_id=category.pk, metric='rating').size)
+        self.assertEqual(self.expected(), get_boards())
+
+    def test_short_board(self):
+        rebuild_leaderboards()
+        category = Categories.objects.create(title='Short')
+        self.categories.append(category)
+        self.books[0].categories.add(category)
+        update_leaderboards([self.books[0].pk])
+        # в неполной таблице уже есть все книги области: изменения переносятся без запроса лучших книг
+        Books.objects.filter(pk=self.books[0].pk).update(likes=100, rating_sum=50, rating_count=10)
+        with mock.patch.object(leaderboards, 'top_books', wraps=top_books) as top:
+            update_leaderboards([self.books[0].pk])
+        self.assertFalse([call for call in top.call_args_list if call.args[:2] == ('category', category.pk)])
+        self.assertEqual(self.expected(), get_boards())
+
+
+class LeaderboardAPITestCase(APITestCase):
+
+    def setUp(self):
+        author = Authors.objects.create(first_name='Test', last_name='Author')
+        self.category = Categories.objects.create(title='Category')
+        self.books = []
+        for number in range(12):
+            book = Books.objects.create(title=f'Book {number}', description='Desc', author=author, likes=number + 1,
+                                        rating_sum=5 * (number % 3), rating_count=number % 3)
+            if number < 3:
+                book.categories.add(self.category)
+            self.books.append(book)
+        rebuild_leaderboards()
+
+    def test_pages(self):
+        url = reverse('book-leaderboard')
+        with self.assertNumQueries(2):
+            response = self.client.get(url, data={'metric': 'likes'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(12, response.data['count'])
+        self.assertEqual([f'Book {number}' for number in range(11, 1, -1)],
+                         [item['title'] for item in response.data['results']])
+        self.assertEqual(list(range(1, 11)), [item['rank'] for item in response.data['results']])
+        self.assertIsNone(response.data['previous'])
+        with self.assertNumQueries(2):
+            response = self.client.get(response.data['next'])
+        self.assertEqual([(11, 'Book 1'), (12, 'Book 0')],
+                         [(item['rank'], item['title']) for item in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+    def test_scope(self):
+        response = self.client.get(reverse('book-leaderboard'), data={'category': self.category.pk})
+        # книги категории с оценками: 2 оценки 5 выше одной
+        self.assertEqual(['Book 2', 'Book 1'], [item['title'] for item in response.data['results']])
+        response = self.client.get(reverse('book-leaderboard'), data={'category': 0})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.get(reverse('book-leaderboard'), data={'category': 1, 'library': 1})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.get(reverse('book-leaderboard'), data={'library': 100})
+        self.assertEqual({'count': 0, 'next': None, 'previous': None, 'results': []}, response.data)
+
+
+class LeaderboardSignalsTestCase(TransactionTestCase):
+
+    def test_relation_changes(self):
+        author = Authors.objects.create(first_name='Test', last_name='Author')
+        books = [Books.objects.create(title=f'Book {i}', description='Desc', author=author) for i in range(2)]
+        user = User.objects.create(username='user')
+        rebuild_leaderboards()
+        upsert_relation(user, books[1].pk, {'like': True, 'rate': 4})
+        # таблицы обновляет обработчик очереди, а не запрос, изменивший книгу
+        self.assertNotIn(('all', 0, 'likes'), get_boards())
+        self.assertIn(books[1].pk, LeaderboardQueue.objects.values_list('book_id', flat=True))
+        flush_leaderboards()
+        self.assertFalse(LeaderboardQueue.objects.exists())
+        self.assertEqual([(books[1].pk, 1.0)], get_boards()['all', 0, 'likes'])
+        upsert_relation(user, books[0].pk, {'rate': 5})
+        flush_leaderboards()
+        self.assertEqual([books[0].pk, books[1].pk], [book_id for book_id, _ in get_boards()['all', 0, 'rating']])
+        books[0].delete()
+        flush_leaderboards()
+        self.assertEqual([books[1].pk], [book_id for book_id, _ in get_boards()['all', 0, 'rating']])
+        self.assertFalse(LeaderboardEntry.objects.filter(book_id=books[0].pk).exists())
@@ -0,0 +1,69 @@
+import random
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from rest_framework.settings import api_settings
+
+from books.loadtest import (
+    InProcessTransport, LoadTestData, MIX, seed, cleanup,
+    run, summarize, compare_reports, anonymous_book_list
+)
+from books.models import Books, User
+
+
+class LoadTestRunTestCase(TransactionTestCase):
+    """Прогон смеси запросов несколькими потоками: данные должны быть видны потокам, поэтому без общей транзакции"""
+
+    def test_run(self):
+        data = seed(1, 7)
+        # SQLite не допускает одновременных транзакций записи (database is locked)
+        clients = 1 if connection.vendor == 'sqlite' else 2
+        results, elapsed = run(data, InProcessTransport, clients=clients, requests=60, seed_value=7)
+        report = summarize(results, elapsed, {'seed': 7})
+        self.assertEqual(60, report['total']['requests'])
+        self.assertEqual(0, report['total']['errors'], report['routes'])
+        self.assertLessEqual(set(report['routes']), {'GET /books/', 'GET /books/{id}/', 'PUT /book-relation/{book}/',
+                                                     'GET /my-sessions/', 'PATCH /user-sessions/{id}/',
+                                                     'GET /user-sessions/'})
+        cleanup(data)
+        self.assertFalse(Books.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+    def test_seed_is_deterministic(self):
+        first = seed(1, 3)
+        relations = sorted(Books.objects.values_list('author__last_name', 'likes', 'bookmarks', 'rating_count'))
+        cleanup(first)
+        seed(1, 3)
+        self.assertEqual(relations, sorted(Books.objects.values_list('author__last_name', 'likes', 'bookmarks',
+                                                                     'rating_count')))
+
+
+class LoadTestReportTestCase(TestCase):
+
+    def test_summarize(self):
+        results = [('GET /books/', 200, timing) for timing in range(1, 101)] + [('GET /my-sessions/', 500, 5.0)]
+        report = summarize(results, 2.0, {'seed': 1})
+        books = report['routes']['GET /books/']
+        self.assertEqual((100, 50.0, 0), (books['requests'], books['throughput'], books['errors']))
+        self.assertEqual((50.5, 95.05, 99.01, 100), (books['p50'], books['p95'], books['p99'], books['max']))
+        self.assertEqual({'200': 100, '500': 1}, report['total']['statuses'])
+        self.assertEqual(1, report['total']['errors'])
+
+    def test_compare_reports(self):
+        old = summarize([('GET /books/', 200, 10.0), ('GET /books/', 200, 20.0)], 1.0, {'seed': 1})
+        new = summarize([('GET /books/', 200, 5.0), ('GET /books/', 200, 10.0)], 1.0, {'seed': 1})
+        rows = {(route, key): (before, after, change) for route, key, before, after, change in compare_reports(old, new)}
+        self.assertEqual((15.0, 7.5, -50.0), rows[('GET /books/', 'p50')])
+        self.assertEqual((2.0, 2.0, 0.0), rows[('total', 'throughput')])
+
+    def test_mix_weights(self):
+        self.assertEqual(100, sum(weight for _, weight in MIX))
+
+    def test_book_list_pages_exist(self):
+        data = LoadTestData('-', list(range(api_settings.PAGE_SIZE * 3)), {1: 1, 2: api_settings.PAGE_SIZE * 2},
+                            [], [], None)
+        rng = random.Random(1)
+        for _ in range(200):
+            params = anonymous_book_list(rng, data, {})[4]
+            count = data.category_books[params['categories']] if 'categories' in params else len(data.book_ids)
+            self.assertLessEqual((params['page'] - 1) * api_settings.PAGE_SIZE, max(count - 1, 0))
@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from books.models import Authors, Books, Categories, Libraries, BookLibraryAvailable, BookCatalog
+
+
+class BooksListPaginationTestCase(APITestCase):
+
+    def setUp(self):
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.category_1 = Categories.objects.create(title='Category 1')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        ratings = [None, Decimal('4.50'), Decimal('3.00'), None, Decimal('4.50'), Decimal('5.00'), Decimal('3.00'),
+                   None, Decimal('4.50'), Decimal('1.00'), None, Decimal('4.50'), Decimal('2.00'), None,
+                   Decimal('4.50'), Decimal('3.00'), None, Decimal('5.00'), Decimal('4.50'), None, Decimal('2.50'),
+                   Decimal('4.50'), None, Decimal('3.00'), Decimal('4.50')]
+        for number, rating in enumerate(ratings):
+            book = Books.objects.create(title=f'Book {number}', description='Desc', author=self.author_1,
+                                        rating=rating, likes=number % 3)
+            book.categories.add(self.category_1)
+            BookLibraryAvailable.objects.create(book=book, library=self.library_1, available=True)
+
+    def walk(self, url, params):
+        """Проход по всем страницам вперёд, возвращает id книг и ссылки на страницы"""
+        response = self.client.get(url, data={**params, 'cursor': ''})
+        pages, ids = [], []
+        while True:
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertNotIn('count', response.data)
+            pages.append(response)
+            ids += [int(item['url'].rstrip('/').split('/')[-1]) for item in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        return ids, pages
+
+    def expected_ids(self, *order_by):
+        return list(BookCatalog.objects.filter(available=True).order_by(*order_by).values_list('pk', flat=True))
+
+    def test_default_ordering(self):
+        ids, pages = self.walk(reverse('book-list'), {})
+        self.assertEqual(3, len(pages))
+        self.assertEqual(self.expected_ids('-created_at', '-pk'), ids)
+
+    def test_nullable_ordering(self):
+        for ordering in ('rating', '-rating'):
+            ids, _ = self.walk(reverse('book-list'), {'ordering': ordering})
+            not_null = list(BookCatalog.objects.filter(rating__isnull=False).order_by(
+                ordering, ordering.replace('rating', 'pk')).values_list('pk', flat=True))
+            nulls = list(BookCatalog.objects.filter(rating__isnull=True).order_by(
+                ordering.replace('rating', 'pk')).values_list('pk', flat=True))
+            self.assertEqual(not_null + nulls, ids, msg=ordering)
+
+    def test_ties_ordering(self):
+        ids, _ = self.walk(reverse('book-list'), {'ordering': '-likes'})
+        self.assertEqual(self.expected_ids('-likes', '-pk'), ids)
+
+    def test_previous(self):
+        ids, pages = self.walk(reverse('book-list'), {'ordering': 'rating'})
+        response = self.client.get(pages[-1].data['previous'])
+        self.assertEqual(pages[-2].data['results'], response.data['results'])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(pages[0].data['results'], response.data['results'])
+        self.assertIsNone(response.data['previous'])
+
+    def test_get_books(self):
+        ids, _ = self.walk(reverse('category-books', kwargs={'pk': self.category_1.id}), {})
+        self.assertEqual(self.expected_ids('-created_at', '-pk'), ids)
+
+    def test_ordering_changed(self):
+        response = self.client.get(reverse('book-list'), data={'cursor': ''})
+        next_url = response.data['next'].replace('cursor=', 'ordering=likes&cursor=')
+        response = self.client.get(next_url)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('book-list'), data={'cursor': 'invalid'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_page_number_mode(self):
+        response = self.client.get(reverse('book-list'), data={'page': 2})
+        self.assertEqual(25, response.data['count'])
+        self.assertEqual(10, len(response.data['results']))
@@ -0,0 +1,33 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from books.cache import get_version
+from books.query_budget import ENDPOINTS, count_queries, get_routes
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Количество запросов к базе каждого маршрута books/urls.py не должно расти с количеством связанных записей:
+    запросы выполняются при заполнении N и 10N записями (books.query_budget)
+    """
+    sizes = (3, 30)
+
+    def test_all_routes_measured(self):
+        measured = {(endpoint.name, endpoint.method) for endpoint in ENDPOINTS}
+        self.assertEqual(set(), get_routes() - measured)
+
+    def test_queries_do_not_grow(self):
+        small, large = (count_queries(size) for size in self.sizes)
+        for endpoint in ENDPOINTS:
+            with self.subTest(endpoint=str(endpoint)):
+                self.assertEqual(small[endpoint][1], large[endpoint][1])
+                self.assertLess(small[endpoint][1], 400)
+                self.assertLessEqual(large[endpoint][0], small[endpoint][0])
+
+    def test_caches_not_touched(self):
+        cache.set('books:query-budget-test', 1)
+        version = get_version('books')
+        count_queries(1, [endpoint for endpoint in ENDPOINTS if endpoint.name == 'book-list'])
+        self.assertEqual(1, cache.get('books:query-budget-test'))
+        self.assertEqual(version, get_version('books'))
+        cache.delete('books:query-budget-test')
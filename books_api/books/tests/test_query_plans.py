@@ -0,0 +1,208 @@
+import datetime
+import io
+import unittest
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from books.cache import get_table_ids
+from books.leaderboards import rebuild_leaderboards
+from books.models import (
+    Authors, Books, Categories, Libraries, BookLibraryAvailable, BookCatalog, GinIndex,
+    UserBookOffer, UserBookRelation, UserBookSession
+)
+from books.recommendations import build_similar_books
+from books.services import refresh_book_catalog
+
+
+# Узлы, после которых порядок строк больше не важен (сортировка, хеширование, группировка)
+ORDER_CONSUMERS = ('Sort', 'Incremental Sort', 'Hash', 'Aggregate', 'HashAggregate', 'Unique', 'Materialize')
+
+
+def iter_full_scans(node, ordered=False):
+    """
+    Чтение таблицы целиком: последовательное или по индексу без условия, если индекс не даёт порядок для LIMIT.
+    Подсчёт всех строк списка (COUNT(*) постраничной пагинации) без условия по-другому не выполнить,
+    поэтому полное чтение под простой агрегацией допускается
+    """
+    node_type = node['Node Type']
+    if node_type == 'Aggregate' and node.get('Strategy') == 'Plain':
+        return
+    if node_type == 'Seq Scan' or (node_type in ('Index Scan', 'Index Only Scan')
+                                   and 'Index Cond' not in node and not ordered):
+        yield node['Relation Name']
+    if node_type == 'Limit':
+        ordered = True
+    elif node_type in ORDER_CONSUMERS:
+        ordered = False
+    for position, child in enumerate(node.get('Plans', ())):
+        # порядок соединения задаёт внешняя (первая) ветвь, при слиянии обе ветви читаются по порядку до LIMIT
+        yield from iter_full_scans(child, ordered and (position == 0 or node_type == 'Merge Join'))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Планы запросов проверяются только в PostgreSQL')
+class QueryPlansTestCase(APITestCase):
+    """
+    Запросы каждого списка и экземпляра API выполняются через EXPLAIN с enable_seqscan = off
+    на тестовых данных объёмом в тысячи строк со статистикой, собранной перед каждым тестом (ANALYZE): при таком объёме планировщик
+    читает таблицу целиком, только если подходящего индекса нет. Ни одна таблица не должна читаться целиком
+    (iter_full_scans)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', password='password')
+        cls.admin = User.objects.create_superuser(username='admin', password='password')
+        users = User.objects.bulk_create([User(username=f'user_{number}') for number in range(200)])
+        authors = Authors.objects.bulk_create([
+            Authors(first_name='Test', last_name=f'Author {number}') for number in range(100)])
+        categories = Categories.objects.bulk_create([Categories(title=f'Category {number}') for number in range(30)])
+        libraries = Libraries.objects.bulk_create([
+            Libraries(title=f'Lib {number}', location='Loc', phone='Phone') for number in range(30)])
+        books = Books.objects.bulk_create([
+            Books(title=f'Book {number}', description='Desc', author=authors[number % len(authors)],
+                  likes=number % 7, rating_sum=number % 20, rating_count=number % 5)
+            for number in range(3000)])
+        Books.categories.through.objects.bulk_create([
+            Books.categories.through(books=book, categories=categories[number % len(categories)])
+            for number, book in enumerate(books)])
+        BookLibraryAvailable.objects.bulk_create([
+            BookLibraryAvailable(book=book, library=libraries[number % len(libraries)], available=number % 3 > 0)
+            for number, book in enumerate(books)])
+        UserBookRelation.objects.bulk_create([
+            UserBookRelation(user=users[number % len(users)], book=books[number * 7 % len(books)],
+                             in_bookmarks=number % 2 == 0, like=number % 3 == 0)
+            for number in range(3000)])
+        today = datetime.date.today()
+        UserBookSession.objects.bulk_create([
+            UserBookSession(user=users[number % len(users)], library=libraries[number % len(libraries)],
+                            start_date=today, end_date=today, is_closed=number % 2 == 0)
+            for number in range(3000)])
+        UserBookOffer.objects.bulk_create([
+            UserBookOffer(user=users[number % len(users)], library=libraries[number % len(libraries)],
+                          quantity=1, books_description='Books', is_closed=number % 2 == 0)
+            for number in range(3000)])
+        cls.author, cls.category, cls.library, cls.book = authors[0], categories[0], libraries[0], books[0]
+        UserBookRelation.objects.create(user=cls.user, book=cls.book, in_bookmarks=True, like=True)
+        session = UserBookSession.objects.create(user=cls.user, library=cls.library, start_date=today, end_date=today)
+        session.books.add(cls.book)
+        UserBookOffer.objects.create(user=cls.user, library=cls.library, quantity=1, books_description='Books')
+        refresh_book_catalog([book.pk for book in books], create=True)
+        build_similar_books()
+        rebuild_leaderboards()
+
+    def setUp(self):
+        # статистика собирается в транзакции теста по уже созданным данным, чтобы план не зависел
+        # от autovacuum и порядка тестов
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        # множества id для проверки фильтров читают таблицы целиком намеренно и кэшируются заранее
+        get_table_ids('categories', Categories.objects.all())
+        get_table_ids('authors', Authors.objects.all())
+        get_table_ids('libraries', Libraries.objects.all())
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                return cursor.fetchone()[0][0]['Plan']
+            finally:
+                cursor.execute('RESET enable_seqscan')
+
+    def assertIndexed(self, url, user=None, data=None):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data=data)
+        self.assertEqual(status.HTTP_200_OK, response.status_code, msg=url)
+        for query in context.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            scans = list(iter_full_scans(self.explain(query['sql'])))
+            self.assertEqual([], scans, msg=f'{url} {data}: {query["sql"]}')
+
+    def test_books(self):
+        for data in ({}, {'ordering': '-rating'}, {'ordering': 'likes'}, {'cursor': ''}, {'search': 'Book'},
+                     {'categories': self.category.pk}, {'author': self.author.pk},
+                     {'lib_available__library': self.library.pk}):
+            self.assertIndexed(reverse('book-list'), data=data)
+        self.assertIndexed(reverse('book-detail', args=(self.book.pk,)))
+        self.assertIndexed(reverse('book-similar', args=(self.book.pk,)))
+        self.assertIndexed(reverse('book-leaderboard'), data={'category': self.category.pk})
+
+    def test_catalog(self):
+        for name, pk in (('author', self.author.pk), ('category', self.category.pk), ('library', self.library.pk)):
+            self.assertIndexed(reverse(f'{name}-list'))
+            self.assertIndexed(reverse(f'{name}-detail', args=(pk,)))
+            self.assertIndexed(reverse(f'{name}-books', args=(pk,)))
+
+    def test_user_lists(self):
+        for name in ('my-session', 'my-offer', 'my-bookmark'):
+            self.assertIndexed(reverse(f'{name}-list'), self.user)
+        self.assertIndexed(reverse('my-bookmark-detail', args=(self.book.pk,)), self.user)
+
+    def test_admin_lists(self):
+        self.assertIndexed(reverse('available-list'), self.admin)
+        self.assertIndexed(reverse('available-list'), self.admin, {'library': self.library.pk})
+        for name in ('user-session', 'user-offer'):
+            self.assertIndexed(reverse(f'{name}-list'), self.admin)
+            self.assertIndexed(reverse(f'{name}-list'), self.admin, {'is_closed': False})
+
+
+class CatalogBooksQueriesTestCase(APITestCase):
+    """
+    Книги категории и библиотеки выбираются по массивам id записи каталога (category_ids, library_ids)
+    без соединения с таблицами связей. Проверяется на любой базе, в отличие от планов QueryPlansTestCase
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = Authors.objects.create(first_name='Test', last_name='Author')
+        cls.category = Categories.objects.create(title='Category')
+        cls.library = Libraries.objects.create(title='Lib', location='Loc', phone='Phone')
+        cls.book = Books.objects.create(title='Book', description='Desc', author=author)
+        cls.book.categories.add(cls.category)
+        BookLibraryAvailable.objects.create(book=cls.book, library=cls.library, available=True)
+        refresh_book_catalog([cls.book.pk], create=True)
+
+    def test_no_joins(self):
+        for name, pk, field in (('category', self.category.pk, 'category_ids'),
+                                ('library', self.library.pk, 'library_ids')):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse(f'{name}-books', args=(pk,)))
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(['Book'], [book['title'] for book in response.data['results']])
+            queries = [query['sql'] for query in context.captured_queries if field in query['sql']]
+            self.assertTrue(queries)
+            for sql in queries:
+                self.assertNotIn(Books.categories.through._meta.db_table, sql)
+                self.assertNotIn(BookLibraryAvailable._meta.db_table, sql)
+
+    def test_gin_indexes(self):
+        indexes = {index.name: index for index in BookCatalog._meta.indexes}
+        for name, field in (('catalog_category_ids_idx', 'category_ids'), ('catalog_library_ids_idx', 'library_ids')):
+            self.assertIsInstance(indexes[name], GinIndex)
+            self.assertEqual([field], indexes[name].fields)
+
+
+class CreateIndexesTestCase(TransactionTestCase):
+
+    def test_create_missing(self):
+        index = UserBookRelation._meta.indexes[-1]
+        with connection.schema_editor() as editor:
+            editor.remove_index(UserBookRelation, index)
+        out = io.StringIO()
+        call_command('create_indexes', '--dry-run', stdout=out)
+        self.assertIn(index.name, out.getvalue())
+        call_command('create_indexes', stdout=io.StringIO())
+        with connection.cursor() as cursor:
+            self.assertIn(index.name, connection.introspection.get_constraints(cursor, UserBookRelation._meta.db_table))
+        out = io.StringIO()
+        call_command('create_indexes', stdout=out)
+        self.assertIn('Создано индексов: 0', out.getvalue())
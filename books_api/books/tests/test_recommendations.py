@@ -0,0 +1,91 @@
+import math
+import unittest
+
+from django.contrib.auth.models import User
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from books.models import Authors, Books, Libraries, BookLibraryAvailable, BookSimilarity, BookSimilarityQueue
+from books.recommendations import (
+    NumpySimilarity, PythonSimilarity, build_similar_books, flush_similar_books
+)
+from books.services import bulk_update_relations, upsert_relation
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+
+class SimilarBooksTestCase(APITestCase):
+
+    def setUp(self):
+        author = Authors.objects.create(first_name='Test', last_name='Author')
+        library = Libraries.objects.create(title='Lib', location='Loc', phone='Phone')
+        self.books = [Books.objects.create(title=f'Book {i}', description='Desc', author=author) for i in range(4)]
+        for book in self.books:
+            BookLibraryAvailable.objects.create(book=book, library=library, available=True)
+        self.users = [User.objects.create(username=f'user_{i}') for i in range(3)]
+        # книги 0 и 1 нравятся двум пользователям, книга 2 - одному из них, оценка 3 не считается положительной
+        for user in self.users[:2]:
+            upsert_relation(user, self.books[0].pk, {'like': True})
+            upsert_relation(user, self.books[1].pk, {'in_bookmarks': True})
+        upsert_relation(self.users[0], self.books[2].pk, {'rate': 5})
+        upsert_relation(self.users[2], self.books[3].pk, {'rate': 3})
+        upsert_relation(self.users[2], self.books[0].pk, {'rate': 3})
+
+    def similar(self, book):
+        return list(BookSimilarity.objects.filter(book=book).values_list('similar_id', flat=True))
+
+    def test_build(self):
+        self.assertEqual(3, build_similar_books())
+        self.assertEqual([self.books[1].pk, self.books[2].pk], self.similar(self.books[0]))
+        scores = BookSimilarity.objects.filter(book=self.books[0]).values_list('score', flat=True)
+        self.assertEqual([1.0, 1 / math.sqrt(2)], list(scores))
+        self.assertEqual([], self.similar(self.books[3]))
+
+    def test_queue(self):
+        build_similar_books()
+        BookSimilarityQueue.objects.all().delete()
+        # оценка 3 -> 4 делает отношение положительным, изменение лайка при закладке - нет
+        upsert_relation(self.users[2], self.books[3].pk, {'rate': 4})
+        bulk_update_relations(self.users[2], [{'book': self.books[0].pk, 'like': True},
+                                              {'book': self.books[2].pk, 'rate': 2}])
+        upsert_relation(self.users[0], self.books[1].pk, {'like': True})
+        self.assertEqual({(self.users[2].pk, self.books[3].pk), (self.users[2].pk, self.books[0].pk)},
+                         set(BookSimilarityQueue.objects.values_list('user_id', 'book_id')))
+        self.assertEqual(2, flush_similar_books())
+        self.assertFalse(BookSimilarityQueue.objects.exists())
+        self.assertEqual([self.books[0].pk], self.similar(self.books[3]))
+        self.assertEqual([self.books[1].pk, self.books[2].pk, self.books[3].pk], self.similar(self.books[0]))
+        # удаление положительного отношения тоже попадает в очередь
+        self.books[3].userbookrelation_set.all().delete()
+        flush_similar_books()
+        self.assertEqual([], self.similar(self.books[3]))
+        self.assertEqual([self.books[1].pk, self.books[2].pk], self.similar(self.books[0]))
+
+    @unittest.skipIf(numpy is None, 'numpy и scipy не установлены')
+    def test_numpy(self):
+        pairs = [(1, 10), (1, 11), (2, 10), (2, 11), (2, 12), (3, 12), (3, 13), (4, 10), (4, 13)]
+        counts = {10: 3, 11: 2, 12: 2, 13: 2}
+        book_ids = [10, 11, 12, 13, 14]
+        for top_k in (1, 2, 10):
+            self.assertEqual(PythonSimilarity(pairs, counts).neighbours(book_ids, top_k),
+                             NumpySimilarity(pairs, counts).neighbours(book_ids, top_k))
+
+    def test_api(self):
+        build_similar_books()
+        BookLibraryAvailable.objects.filter(book=self.books[2]).update(available=False)
+        self.books[2].catalog.available = False
+        self.books[2].catalog.save()
+        url = reverse('book-similar', args=(self.books[0].pk,))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(['Book 1'], [item['title'] for item in response.data])
+        response = self.client.get(reverse('book-similar', args=(self.books[3].pk,)))
+        self.assertEqual([], response.data)
+        response = self.client.get(reverse('book-similar', args=('abc',)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
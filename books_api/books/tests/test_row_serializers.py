@@ -0,0 +1,71 @@
+import datetime
+
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+import books.serializers as s
+from books.models import (
+    Authors, Books, Categories,
+    Libraries, BookLibraryAvailable, BookCatalog,
+    User, UserBookSession, UserBookOffer
+)
+from books.row_serializers import get_row_serializer
+
+
+class RowSerializerTestCase(TestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.author_1 = Authors.objects.create(first_name='Test', middle_name='Middle', last_name='Author 1')
+        self.author_2 = Authors.objects.create(first_name='Test', last_name='Author 2')
+        self.category_1 = Categories.objects.create(title='Category B')
+        self.category_2 = Categories.objects.create(title='Category A')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        self.book_1 = Books.objects.create(title='Book 1', description='Desc 1', author=self.author_1)
+        self.book_1.categories.add(self.category_1, self.category_2)
+        self.book_2 = Books.objects.create(title='Book 2', description='Desc 2', author=self.author_2)
+        BookLibraryAvailable.objects.create(book=self.book_1, library=self.library_1, available=True)
+        today = datetime.date.today()
+        UserBookSession.objects.create(user=self.user_1, library=self.library_1, start_date=today, end_date=today)
+        UserBookOffer.objects.create(user=self.user_1, library=self.library_1, quantity=2,
+                                     books_description='Desc', is_accepted=True)
+        self.context = {'request': Request(APIRequestFactory().get('/', format='json')), 'format': None}
+
+    def assertSameData(self, serializer_class, queryset):
+        row_serializer = get_row_serializer(serializer_class)
+        self.assertIsNotNone(row_serializer)
+        expected_data = serializer_class(queryset, many=True, context=self.context).data
+        data = row_serializer.serialize(row_serializer.prepare(queryset), self.context)
+        self.assertEqual(expected_data, data)
+        self.assertEqual([list(item) for item in expected_data], [list(item) for item in data])
+
+    def test_same_data(self):
+        cases = [
+            (s.BooksListSerializer, Books.objects.all()),
+            (s.BookCatalogListSerializer, BookCatalog.objects.all()),
+            (s.AuthorsListSerializer, Authors.objects.all()),
+            (s.CategoriesListSerializer, Categories.objects.all()),
+            (s.LibrariesListSerializer, Libraries.objects.all()),
+            (s.MyBooksSessionsListSerializer, UserBookSession.objects.all()),
+            (s.UserBooksSessionsListSerializer, UserBookSession.objects.all()),
+            (s.BooksLibrariesAvailableListSerializer, BookLibraryAvailable.objects.all()),
+            (s.MyBooksOffersListSerializer, UserBookOffer.objects.all()),
+            (s.UserBooksOffersListSerializer, UserBookOffer.objects.all()),
+        ]
+        for serializer_class, queryset in cases:
+            with self.subTest(serializer_class.__name__):
+                self.assertSameData(serializer_class, queryset)
+
+    def test_queries(self):
+        row_serializer = get_row_serializer(s.BooksListSerializer)
+        with self.assertNumQueries(2):
+            data = row_serializer.serialize(row_serializer.prepare(Books.objects.all()), self.context)
+        self.assertEqual(['Category A', 'Category B'], data[1]['categories'])
+        with self.assertNumQueries(1):
+            self.assertEqual([], row_serializer.serialize(row_serializer.prepare(Books.objects.filter(title='-')),
+                                                          self.context))
+
+    def test_unsupported(self):
+        self.assertIsNone(get_row_serializer(s.BooksDetailSerializer))
+        self.assertIsNone(get_row_serializer(s.MyBooksSessionDetailSerializer))
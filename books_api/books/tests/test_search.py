@@ -0,0 +1,126 @@
+import datetime
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from books.models import (
+    Authors, Books, BookCatalog, Categories,
+    Libraries, BookLibraryAvailable, User,
+    UserBookSession, UserBookOffer
+)
+from books.search import LocalSearchIndex, get_search_backend
+
+
+class LocalSearchIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.author_1 = Authors.objects.create(first_name='Лев', last_name='Толстой')
+        self.book_1 = Books.objects.create(title='Война и мир', description='Desc', author=self.author_1)
+        self.book_2 = Books.objects.create(title='Анна Каренина', description='Desc', author=self.author_1)
+        self.index = LocalSearchIndex(BookCatalog, ('title',))
+
+    def test_search(self):
+        self.assertEqual({self.book_1.id}, self.index.search(['войн']))
+        self.assertEqual({self.book_2.id}, self.index.search(['анна', 'карен']))
+        self.assertEqual(set(), self.index.search(['анна', 'мир']))
+
+    def test_update_remove(self):
+        self.index.build()
+        BookCatalog.objects.filter(pk=self.book_1.id).update(title='Воскресение')
+        self.index.update([self.book_1.id])
+        self.assertEqual(set(), self.index.search(['война']))
+        self.assertEqual({self.book_1.id}, self.index.search(['воскресение']))
+        self.index.remove([self.book_1.id])
+        self.assertEqual(set(), self.index.search(['воскресение']))
+
+
+class FullTextSearchFilterTestCase(APITestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.user_staff = User.objects.create_user(username='StaffUser', password='password', is_staff=True)
+        self.author_1 = Authors.objects.create(first_name='Лев', last_name='Толстой')
+        self.author_2 = Authors.objects.create(first_name='Фёдор', last_name='Достоевский')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        self.book_1 = Books.objects.create(title='Война и мир', description='Desc', author=self.author_1)
+        self.book_2 = Books.objects.create(title='Анна Каренина', description='Desc', author=self.author_1)
+        self.book_3 = Books.objects.create(title='Идиот', description='Desc', author=self.author_2)
+        for book in (self.book_1, self.book_2, self.book_3):
+            BookLibraryAvailable.objects.create(book=book, library=self.library_1, available=True)
+        self.session_1 = UserBookSession.objects.create(user=self.user_1, library=self.library_1,
+                                                        start_date=datetime.date.today(),
+                                                        end_date=datetime.date.today() + datetime.timedelta(days=7))
+        self.session_1.books.add(self.book_1, self.book_2)
+        self.session_2 = UserBookSession.objects.create(user=self.user_1, library=self.library_1,
+                                                        start_date=datetime.date.today(),
+                                                        end_date=datetime.date.today() + datetime.timedelta(days=7))
+        self.session_2.books.add(self.book_3)
+        self.offer_1 = UserBookOffer.objects.create(user=self.user_1, library=self.library_1, quantity=1,
+                                                    books_description='Сборник стихов Пушкина')
+
+    def test_books_list(self):
+        response = self.client.get(reverse('book-list'), data={'search': 'война'})
+        self.assertEqual(['Война и мир'], [item['title'] for item in response.data['results']])
+
+    def test_books_list_after_rename(self):
+        self.book_3.title = 'Бесы'
+        self.book_3.save()
+        response = self.client.get(reverse('book-list'), data={'search': 'бесы'})
+        self.assertEqual(['Бесы'], [item['title'] for item in response.data['results']])
+        response = self.client.get(reverse('book-list'), data={'search': 'идиот'})
+        self.assertEqual([], response.data['results'])
+
+    def test_authors(self):
+        response = self.client.get(reverse('author-list'), data={'search': 'Достоевский'})
+        self.assertEqual(['Фёдор Достоевский'], [item['full_name'] for item in response.data['results']])
+
+    def test_categories_and_libraries(self):
+        Categories.objects.create(title='Русская классика')
+        Categories.objects.create(title='Поэзия')
+        Libraries.objects.create(title='Городская библиотека', location='Loc 2', phone='Phone 2')
+        response = self.client.get(reverse('category-list'), data={'search': 'классика'})
+        self.assertEqual(['Русская классика'], [item['title'] for item in response.data['results']])
+        response = self.client.get(reverse('library-list'), data={'search': 'городская'})
+        self.assertEqual(['Городская библиотека'], [item['title'] for item in response.data['results']])
+
+    def test_get_books(self):
+        response = self.client.get(reverse('author-books', kwargs={'pk': self.author_1.id}),
+                                   data={'search': 'анна'})
+        self.assertEqual(['Анна Каренина'], [item['title'] for item in response.data['results']])
+
+    def test_user_sessions(self):
+        self.client.force_login(self.user_staff)
+        response = self.client.get(reverse('user-session-list'), data={'search': 'Каренина'})
+        self.assertEqual(1, len(response.data['results']))
+        self.assertTrue(response.data['results'][0]['url'].endswith(f'/{self.session_1.id}/'))
+        response = self.client.get(reverse('user-session-list'), data={'search': 'Lib 1'})
+        self.assertEqual(2, len(response.data['results']))
+
+    def test_user_offers(self):
+        self.client.force_login(self.user_staff)
+        response = self.client.get(reverse('user-offer-list'), data={'search': 'стихов'})
+        self.assertEqual(1, len(response.data['results']))
+
+    def test_prefix(self):
+        # оба бэкенда ищут слова по началу, но не по середине слова
+        response = self.client.get(reverse('author-list'), data={'search': 'Толс'})
+        self.assertEqual(['Лев Толстой'], [item['full_name'] for item in response.data['results']])
+        response = self.client.get(reverse('book-list'), data={'search': 'анна карен'})
+        self.assertEqual(['Анна Каренина'], [item['title'] for item in response.data['results']])
+        response = self.client.get(reverse('author-list'), data={'search': 'олстой'})
+        self.assertEqual([], response.data['results'])
+        response = self.client.get(reverse('book-list'), data={'search': "' & !"})
+        self.assertEqual([], response.data['results'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Стемминг и ранжирование доступны только в PostgreSQL')
+    def test_postgres_stemming_and_rank(self):
+        self.assertEqual('PostgresSearchBackend', type(get_search_backend()).__name__)
+        Books.objects.create(title='Война миров', description='Desc', author=self.author_2)
+        book = Books.objects.create(title='Война войной, война и мир', description='Desc', author=self.author_2)
+        BookLibraryAvailable.objects.create(book=book, library=self.library_1, available=True)
+        response = self.client.get(reverse('book-list'), data={'search': 'войны'})
+        self.assertEqual(['Война войной, война и мир', 'Война и мир'],
+                         [item['title'] for item in response.data['results']])
@@ -1,4 +1,3 @@
-from django.db.models import Case, When, Count
 from django.test import TestCase
 from rest_framework.exceptions import ValidationError
 
@@ -230,6 +229,7 @@ class BooksDetailSerializerTestCase(TestCase):
             'rating': None,
             'likes': 0,
             'bookmarks': 0,
+            'reading_now': 1,
             'lib_available': [
                 {
                     'library': 'Test Library 1',
@@ -241,18 +241,10 @@ class BooksDetailSerializerTestCase(TestCase):
                 },
             ]
         }
+        self.book_1.refresh_from_db()
         data = BooksDetailSerializer(self.book_1, context={'request': None}).data
         self.assertEqual(expected_data, data, msg=data)
 
-    def test_annotated_reading_now(self):
-        books = Books.objects.all().annotate(
-            reading_now=Count(Case(When(session_books__is_accepted=True,
-                                        session_books__is_closed=False,
-                                        then=1)))
-        )
-        data = BooksDetailSerializer(books, many=True, context={'request': None}).data
-        self.assertEqual(1, data[0]['reading_now'], msg=data)
-
 
 class BookCreateSerializerTestCase(TestCase):
 
@@ -1011,6 +1003,8 @@ class BooksLibrariesAvailableDetailSerializerTestCase(TestCase):
             'book': 'Test book 1',
             'library': 'Test Library 1',
             'available': True,
+            'copies': 1,
+            'reserved': 0,
         }
         data = BooksLibrariesAvailableDetailSerializer(self.book_library_1).data
         self.assertEqual(expected_data, data, msg=data)
@@ -1045,6 +1039,8 @@ class BooksLibrariesAvailableEditSerializerTestCase(TestCase):
             'book': self.book_1.id,
             'library': self.library_1.id,
             'available': True,
+            'copies': 1,
+            'reserved': 0,
         }
         data = BooksLibrariesAvailableEditSerializer(self.book_library_1).data
         self.assertEqual(expected_data, data, msg=data)
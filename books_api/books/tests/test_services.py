@@ -1,11 +1,31 @@
-from django.test import TestCase
+import datetime
+from io import StringIO
+from unittest import mock, skipUnless
 
-from books.models import Authors, Books, UserBookRelation, User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from books.cache import get_table_ids
+from books.models import (
+    Authors, Books, UserBookRelation,
+    User, Categories, Libraries,
+    BookLibraryAvailable, BookCatalog, UserBookSession,
+    BookCounterQueue
+)
 from books.serializers import UserBookRelationSerializer
-from books.services import set_rating, set_likes, set_bookmarks, set_book_values
+from books.services import (
+    set_book_values, refresh_book_catalog,
+    recount_reading_now, get_relation_values, recount_book_values,
+    flush_book_counters, bulk_update_relations, upsert_relation,
+    reserve_books, release_books, reserve_session, recount_reservations,
+    ReservationError, BooksNotFoundError, create_relations, get_missing_pks
+)
 
 
-class SetRatingTestCase(TestCase):
+class RecountBookValuesTestCase(TestCase):
 
     def setUp(self):
         self.user_1 = User.objects.create_user(username='User1', password='password')
@@ -21,68 +41,52 @@ class SetRatingTestCase(TestCase):
             description='Test description 1',
             author=self.author_1,
         )
-        self.book_relation_1 = UserBookRelation.objects.create(user=self.user_1, book=self.book_1, rate=5)
-        UserBookRelation.objects.create(user=self.user_2, book=self.book_1, rate=3)
-        UserBookRelation.objects.create(user=self.user_3, book=self.book_1, rate=4)
-        UserBookRelation.objects.create(user=self.user_4, book=self.book_1)
-
-    def test_ok(self):
-        set_rating(self.book_1)
-        self.book_1.refresh_from_db()
-        self.assertEqual('4.00', str(self.book_1.rating))
-
-    def test_change_rate(self):
-        set_rating(self.book_1)
-        self.book_1.refresh_from_db()
-        self.book_relation_1.rate = 4
-        self.book_relation_1.save()
-        self.book_relation_1.refresh_from_db()
-        set_rating(self.book_1)
-        self.book_1.refresh_from_db()
-        self.assertEqual('3.67', str(self.book_1.rating))
-
-
-class SetLikesTestCase(TestCase):
-
-    def setUp(self):
-        self.user_1 = User.objects.create_user(username='User1', password='password')
-        self.user_2 = User.objects.create_user(username='User2', password='password')
-        self.user_3 = User.objects.create_user(username='User3', password='password')
-        self.author_1 = Authors.objects.create(
-            first_name='Test',
-            last_name='Author 1'
-        )
-        self.book_1 = Books.objects.create(
-            title='Test book 1',
-            description='Test description 1',
+        self.book_2 = Books.objects.create(
+            title='Test book 2',
+            description='Test description 2',
             author=self.author_1,
         )
-        self.book_relation_1 = UserBookRelation.objects.create(user=self.user_1, book=self.book_1, like=True)
-        UserBookRelation.objects.create(user=self.user_2, book=self.book_1, like=True)
-        UserBookRelation.objects.create(user=self.user_3, book=self.book_1, rate=4)
+        self.book_relation_1 = UserBookRelation.objects.create(
+            user=self.user_1, book=self.book_1, rate=5, like=True, in_bookmarks=True)
+        UserBookRelation.objects.create(user=self.user_2, book=self.book_1, rate=3, like=True)
+        self.book_relation_3 = UserBookRelation.objects.create(user=self.user_3, book=self.book_1, rate=4)
+        UserBookRelation.objects.create(user=self.user_4, book=self.book_1, in_bookmarks=True)
 
     def test_ok(self):
-        set_likes(self.book_1)
+        self.assertEqual(1, recount_book_values([self.book_1.id]))
         self.book_1.refresh_from_db()
+        self.assertEqual('4.00', str(self.book_1.rating))
+        self.assertEqual(12, self.book_1.rating_sum)
+        self.assertEqual(3, self.book_1.rating_count)
         self.assertEqual(2, self.book_1.likes)
+        self.assertEqual(2, self.book_1.bookmarks)
 
-    def test_change_like(self):
-        set_likes(self.book_1)
-        self.book_1.refresh_from_db()
-        self.book_relation_1.like = False
-        self.book_relation_1.save()
-        self.book_relation_1.refresh_from_db()
-        set_likes(self.book_1)
+    def test_changed(self):
+        recount_book_values([self.book_1.id])
+        UserBookRelation.objects.filter(pk=self.book_relation_1.pk).update(rate=4, like=False)
+        UserBookRelation.objects.filter(pk=self.book_relation_3.pk).update(in_bookmarks=True)
+        recount_book_values([self.book_1.id])
         self.book_1.refresh_from_db()
+        self.assertEqual('3.67', str(self.book_1.rating))
         self.assertEqual(1, self.book_1.likes)
+        self.assertEqual(3, self.book_1.bookmarks)
+
+    def test_no_relations(self):
+        Books.objects.filter(pk=self.book_2.pk).update(likes=5, bookmarks=5, rating_sum=5, rating_count=1)
+        self.assertEqual(2, recount_book_values())
+        self.book_2.refresh_from_db()
+        self.assertIsNone(self.book_2.rating)
+        self.assertEqual(0, self.book_2.rating_sum)
+        self.assertEqual(0, self.book_2.rating_count)
+        self.assertEqual(0, self.book_2.likes)
+        self.assertEqual(0, self.book_2.bookmarks)
 
 
-class SetBookmarksTestCase(TestCase):
+class SetBookValuesTestCase(TestCase):
 
     def setUp(self):
         self.user_1 = User.objects.create_user(username='User1', password='password')
         self.user_2 = User.objects.create_user(username='User2', password='password')
-        self.user_3 = User.objects.create_user(username='User3', password='password')
         self.author_1 = Authors.objects.create(
             first_name='Test',
             last_name='Author 1'
@@ -92,45 +96,18 @@ class SetBookmarksTestCase(TestCase):
             description='Test description 1',
             author=self.author_1,
         )
-        UserBookRelation.objects.create(user=self.user_1, book=self.book_1, in_bookmarks=True)
-        UserBookRelation.objects.create(user=self.user_2, book=self.book_1, like=True, in_bookmarks=True)
-        self.book_relation_3 = UserBookRelation.objects.create(user=self.user_3, book=self.book_1, rate=4)
-
-    def test_ok(self):
-        set_bookmarks(self.book_1)
-        self.book_1.refresh_from_db()
-        self.assertEqual(2, self.book_1.bookmarks)
+        self.relation_1 = UserBookRelation.objects.create(user=self.user_1, book=self.book_1, in_bookmarks=True)
+        set_book_values(self.relation_1)
 
-    def test_change_bookmarks(self):
-        set_bookmarks(self.book_1)
+    def update(self, relation, data, partial=True):
+        old_values = get_relation_values(relation)
+        serializer = UserBookRelationSerializer(instance=relation, data=data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        set_book_values(relation, old_values)
         self.book_1.refresh_from_db()
-        self.book_relation_3.in_bookmarks = True
-        self.book_relation_3.save()
-        self.book_relation_3.refresh_from_db()
-        set_bookmarks(self.book_1)
-        self.book_1.refresh_from_db()
-        self.assertEqual(3, self.book_1.bookmarks)
-
-
-class SetBookValuesTestCase(TestCase):
-
-    def setUp(self):
-        self.user_1 = User.objects.create_user(username='User1', password='password')
-        self.author_1 = Authors.objects.create(
-            first_name='Test',
-            last_name='Author 1'
-        )
-        self.book_1 = Books.objects.create(
-            title='Test book 1',
-            description='Test description 1',
-            author=self.author_1,
-        )
-        self.relation_1, self.created = UserBookRelation.objects.get_or_create(user=self.user_1, book=self.book_1,
-                                                                               in_bookmarks=True)
 
     def test_ok_create(self):
-        serializer = UserBookRelationSerializer(self.relation_1)
-        set_book_values(serializer, self.created)
         self.book_1.refresh_from_db()
         self.assertEqual(None, self.book_1.rating)
         self.assertEqual(0, self.book_1.likes)
@@ -142,11 +119,7 @@ class SetBookValuesTestCase(TestCase):
             'in_bookmarks': False,
             'rate': 5
         }
-        serializer = UserBookRelationSerializer(instance=self.relation_1, data=data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
-        set_book_values(serializer, False)
-        self.book_1.refresh_from_db()
+        self.update(self.relation_1, data)
         self.assertEqual('5.00', str(self.book_1.rating))
         self.assertEqual(1, self.book_1.likes)
         self.assertEqual(0, self.book_1.bookmarks)
@@ -158,11 +131,424 @@ class SetBookValuesTestCase(TestCase):
             'in_bookmarks': True,
             'rate': 3
         }
-        serializer = UserBookRelationSerializer(instance=self.relation_1, data=data)
-        if serializer.is_valid():
-            serializer.save()
-        set_book_values(serializer, False)
-        self.book_1.refresh_from_db()
+        self.update(self.relation_1, data, partial=False)
         self.assertEqual('3.00', str(self.book_1.rating))
         self.assertEqual(1, self.book_1.likes)
         self.assertEqual(1, self.book_1.bookmarks)
+
+    def test_rating(self):
+        relation_2 = UserBookRelation.objects.create(user=self.user_2, book=self.book_1, rate=4)
+        set_book_values(relation_2)
+        self.update(self.relation_1, {'rate': 3})
+        self.assertEqual('3.50', str(self.book_1.rating))
+        self.update(relation_2, {'rate': 5})
+        self.assertEqual('4.00', str(self.book_1.rating))
+        self.update(self.relation_1, {'rate': None})
+        self.assertEqual('5.00', str(self.book_1.rating))
+        self.assertEqual((5, 1), (self.book_1.rating_sum, self.book_1.rating_count))
+        relation_2.delete()
+        self.book_1.refresh_from_db()
+        self.assertEqual((None, 0, 0), (self.book_1.rating, self.book_1.rating_sum, self.book_1.rating_count))
+        self.assertEqual(None, BookCatalog.objects.get(pk=self.book_1.id).rating)
+
+    def test_only_changed_columns(self):
+        Books.objects.filter(pk=self.book_1.id).update(likes=10)
+        self.update(self.relation_1, {'in_bookmarks': False, 'rate': 2})
+        self.assertEqual((10, 0, '2.00'), (self.book_1.likes, self.book_1.bookmarks, str(self.book_1.rating)))
+
+    def test_recount(self):
+        Books.objects.update(likes=3, bookmarks=0, rating_sum=7, rating_count=1)
+        UserBookRelation.objects.create(user=self.user_2, book=self.book_1, rate=4, like=True)
+        self.assertEqual(1, recount_book_values())
+        self.book_1.refresh_from_db()
+        self.assertEqual((1, 1, '4.00', 4, 1), (self.book_1.likes, self.book_1.bookmarks, str(self.book_1.rating),
+                                                 self.book_1.rating_sum, self.book_1.rating_count))
+        self.assertEqual(1, BookCatalog.objects.get(pk=self.book_1.id).likes)
+
+
+class UpsertRelationTestCase(TestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.book_1 = Books.objects.create(title='Test book 1', description='-', author=self.author_1)
+
+    def test_create_and_update(self):
+        relation = upsert_relation(self.user_1, self.book_1.id, {'like': True, 'rate': 4})
+        self.assertEqual(relation, UserBookRelation.objects.get(user=self.user_1, book=self.book_1))
+        relation = upsert_relation(self.user_1, self.book_1.id, {'rate': 2})
+        self.assertEqual((True, False, 2), (relation.like, relation.in_bookmarks, relation.rate))
+        self.book_1.refresh_from_db()
+        self.assertEqual((1, '2.00', 2, 1), (self.book_1.likes, str(self.book_1.rating),
+                                             self.book_1.rating_sum, self.book_1.rating_count))
+
+    def test_book_not_found(self):
+        self.assertIsNone(upsert_relation(self.user_1, self.book_1.id + 100, {'like': True}))
+        self.assertFalse(UserBookRelation.objects.exists())
+
+    @skipUnless(connection.vendor == 'postgresql', 'INSERT ... ON CONFLICT ... RETURNING используется в PostgreSQL')
+    def test_single_statement(self):
+        upsert_relation(self.user_1, self.book_1.id, {'like': True})
+        with CaptureQueriesContext(connection) as context:
+            upsert_relation(self.user_1, self.book_1.id, {'like': False})
+        table = UserBookRelation._meta.db_table
+        self.assertEqual(1, len([query for query in context.captured_queries if table in query['sql']]))
+        self.book_1.refresh_from_db()
+        self.assertEqual(0, self.book_1.likes)
+
+
+class BulkUpdateRelationsTestCase(TestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.user_2 = User.objects.create_user(username='User2', password='password')
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.books = [Books.objects.create(title=f'Test book {i}', description='-', author=self.author_1)
+                      for i in range(3)]
+        bulk_update_relations(self.user_2, [{'book': book.pk, 'like': True, 'rate': 3} for book in self.books])
+
+    def test_counters_match_recount(self):
+        bulk_update_relations(self.user_1, [{'book': book.pk, 'like': True, 'rate': 5} for book in self.books])
+        bulk_update_relations(self.user_1, [
+            {'book': self.books[0].pk, 'like': False},
+            {'book': self.books[1].pk, 'rate': None, 'in_bookmarks': True},
+            {'book': self.books[2].pk, 'rate': 4},
+        ])
+        fields = ('likes', 'bookmarks', 'rating_sum', 'rating_count', 'rating')
+        counters = list(Books.objects.order_by('pk').values_list(*fields))
+        self.assertEqual([(1, 0, 8, 2), (2, 1, 3, 1), (2, 0, 7, 2)], [row[:4] for row in counters])
+        recount_book_values()
+        self.assertEqual(counters, list(Books.objects.order_by('pk').values_list(*fields)))
+
+    def test_num_queries(self):
+        items = [{'book': book.pk, 'in_bookmarks': True} for book in self.books]
+        # блокировка отношений, проверка книг, INSERT новых отношений, их блокировка, UPDATE отношений,
+        # INSERT в очередь похожих книг (отношения стали положительными), UPDATE книг и SAVEPOINT/RELEASE транзакции;
+        # в PostgreSQL ещё проверка внешних ключей (SET CONSTRAINTS) в своей точке сохранения
+        with self.assertNumQueries(13 if connection.vendor == 'postgresql' else 9):
+            bulk_update_relations(self.user_1, items)
+        # то же с UPDATE отношений вместо INSERT, UPDATE каталога и INSERT в очередь рейтинговых таблиц из-за лайков
+        with self.assertNumQueries(7):
+            bulk_update_relations(self.user_1, [{**item, 'like': True} for item in items])
+
+    def test_created_concurrently(self):
+        # отношение, созданное параллельным запросом после чтения существующих, не нарушает unique_together:
+        # вставка его пропускает, а прежние значения берутся из строки
+        def create_concurrently(user, book_ids):
+            UserBookRelation.objects.create(user=self.user_1, book=self.books[0], like=True)
+            Books.objects.filter(pk=self.books[0].pk).update(likes=F('likes') + 1)
+            create_relations(user, book_ids)
+
+        with mock.patch('books.services.create_relations', side_effect=create_concurrently):
+            bulk_update_relations(self.user_1, [{'book': self.books[0].pk, 'rate': 5}])
+        relation = UserBookRelation.objects.get(user=self.user_1, book=self.books[0])
+        self.assertEqual((True, 5), (relation.like, relation.rate))
+        self.assertEqual((2, 8, 2), Books.objects.filter(pk=self.books[0].pk).values_list(
+            'likes', 'rating_sum', 'rating_count').get())
+
+    def test_book_not_found(self):
+        missing_pk = self.books[-1].pk + 100
+        with self.assertRaises(BooksNotFoundError) as context:
+            bulk_update_relations(self.user_1, [{'book': self.books[0].pk, 'like': True},
+                                                {'book': missing_pk, 'like': True}])
+        self.assertEqual([missing_pk], context.exception.book_ids)
+        self.assertFalse(UserBookRelation.objects.filter(user=self.user_1).exists())
+        self.assertEqual(1, Books.objects.get(pk=self.books[0].pk).likes)
+
+
+@override_settings(BOOKS_COUNTERS={'CONSISTENCY': 'deferred'})
+class DeferredBookValuesTestCase(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'User{i}', password='password') for i in range(3)]
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.book_1 = Books.objects.create(title='Test book 1', description='Desc 1', author=self.author_1)
+        self.book_2 = Books.objects.create(title='Test book 2', description='Desc 2', author=self.author_1)
+
+    def test_coalesced(self):
+        for user in self.users:
+            set_book_values(UserBookRelation.objects.create(user=user, book=self.book_1, like=True, rate=4))
+        set_book_values(UserBookRelation.objects.create(user=self.users[0], book=self.book_2, in_bookmarks=True))
+        self.assertEqual(0, Books.objects.get(pk=self.book_1.id).likes)
+        self.assertEqual(4, BookCounterQueue.objects.count())
+        self.assertEqual(2, flush_book_counters())
+        self.assertFalse(BookCounterQueue.objects.exists())
+        book_1, book_2 = Books.objects.get(pk=self.book_1.id), Books.objects.get(pk=self.book_2.id)
+        self.assertEqual((3, '4.00', 12, 3), (book_1.likes, str(book_1.rating), book_1.rating_sum, book_1.rating_count))
+        self.assertEqual(1, book_2.bookmarks)
+        self.assertEqual(3, BookCatalog.objects.get(pk=self.book_1.id).likes)
+        self.assertEqual(0, flush_book_counters())
+
+    def test_deleted(self):
+        relation = UserBookRelation.objects.create(user=self.users[0], book=self.book_1, like=True)
+        set_book_values(relation)
+        flush_book_counters()
+        relation.delete()
+        self.assertEqual(1, Books.objects.get(pk=self.book_1.id).likes)
+        call_command('flush_book_counters', once=True, batch_size=1, stdout=StringIO())
+        self.assertEqual(0, Books.objects.get(pk=self.book_1.id).likes)
+
+
+class BookCatalogTestCase(TestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.author_1 = Authors.objects.create(first_name='Test', middle_name='Middle', last_name='Author 1')
+        self.category_1 = Categories.objects.create(title='Category B')
+        self.category_2 = Categories.objects.create(title='Category A')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        self.book_1 = Books.objects.create(title='Test book 1', description='Test description 1',
+                                           author=self.author_1)
+        self.book_1.categories.add(self.category_1, self.category_2)
+
+    def test_create(self):
+        catalog = BookCatalog.objects.get(pk=self.book_1.id)
+        self.assertEqual('Test book 1', catalog.title)
+        self.assertEqual('T. M. Author 1', catalog.author_name)
+        self.assertEqual(['Category A', 'Category B'], catalog.categories)
+        self.assertFalse(catalog.available)
+        self.assertEqual(self.book_1.created_at, catalog.created_at)
+
+    def test_available(self):
+        available = BookLibraryAvailable.objects.create(book=self.book_1, library=self.library_1, available=True)
+        self.assertTrue(BookCatalog.objects.get(pk=self.book_1.id).available)
+        available.available = False
+        available.save()
+        self.assertFalse(BookCatalog.objects.get(pk=self.book_1.id).available)
+        available.available = True
+        available.save()
+        available.delete()
+        self.assertFalse(BookCatalog.objects.get(pk=self.book_1.id).available)
+
+    def test_categories_changed(self):
+        self.book_1.categories.remove(self.category_1)
+        self.assertEqual(['Category A'], BookCatalog.objects.get(pk=self.book_1.id).categories)
+        self.category_1.cat_books.add(self.book_1)
+        self.category_1.title = 'Category C'
+        self.category_1.save()
+        self.assertEqual(['Category A', 'Category C'], BookCatalog.objects.get(pk=self.book_1.id).categories)
+        self.category_2.cat_books.clear()
+        self.assertEqual(['Category C'], BookCatalog.objects.get(pk=self.book_1.id).categories)
+        self.category_1.delete()
+        self.assertEqual([], BookCatalog.objects.get(pk=self.book_1.id).categories)
+
+    def test_category_and_library_ids(self):
+        catalog = BookCatalog.objects.get(pk=self.book_1.id)
+        self.assertEqual(sorted([self.category_1.id, self.category_2.id]), catalog.category_ids)
+        self.assertEqual([], catalog.library_ids)
+        available = BookLibraryAvailable.objects.create(book=self.book_1, library=self.library_1, available=False)
+        self.book_1.categories.remove(self.category_1)
+        catalog = BookCatalog.objects.get(pk=self.book_1.id)
+        self.assertEqual([self.category_2.id], catalog.category_ids)
+        self.assertEqual([self.library_1.id], catalog.library_ids)
+        self.assertEqual([self.book_1.id], list(BookCatalog.objects.filter(
+            category_ids__overlap=[self.category_1.id, self.category_2.id]).values_list('pk', flat=True)))
+        self.assertFalse(BookCatalog.objects.filter(category_ids__overlap=[self.category_1.id]).exists())
+        available.delete()
+        self.assertEqual([], BookCatalog.objects.get(pk=self.book_1.id).library_ids)
+
+    def test_book_and_author_changed(self):
+        self.book_1.title = 'New title'
+        self.book_1.save()
+        self.author_1.middle_name = None
+        self.author_1.save()
+        catalog = BookCatalog.objects.get(pk=self.book_1.id)
+        self.assertEqual('New title', catalog.title)
+        self.assertEqual('T. Author 1', catalog.author_name)
+
+    def test_counters(self):
+        UserBookRelation.objects.create(user=self.user_1, book=self.book_1, like=True, rate=4)
+        recount_book_values([self.book_1.id])
+        catalog = BookCatalog.objects.get(pk=self.book_1.id)
+        self.assertEqual(1, catalog.likes)
+        self.assertEqual('4.00', str(catalog.rating))
+
+    def test_book_deleted(self):
+        BookLibraryAvailable.objects.create(book=self.book_1, library=self.library_1, available=True)
+        self.book_1.delete()
+        self.assertFalse(BookCatalog.objects.exists())
+
+    def test_refresh(self):
+        BookCatalog.objects.all().delete()
+        refresh_book_catalog([self.book_1.id])
+        self.assertFalse(BookCatalog.objects.exists())
+        refresh_book_catalog([self.book_1.id], create=True)
+        self.assertEqual(['Category A', 'Category B'], BookCatalog.objects.get(pk=self.book_1.id).categories)
+
+
+class ReadingNowTestCase(TestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        self.book_1 = Books.objects.create(title='Test book 1', description='Desc 1', author=self.author_1)
+        self.book_2 = Books.objects.create(title='Test book 2', description='Desc 2', author=self.author_1)
+        self.session_1 = self.create_session()
+        self.session_1.books.add(self.book_1, self.book_2)
+
+    def create_session(self, **kwargs):
+        today = datetime.date.today()
+        return UserBookSession.objects.create(user=self.user_1, library=self.library_1, start_date=today,
+                                              end_date=today + datetime.timedelta(days=7), **kwargs)
+
+    def assertReadingNow(self, book_1, book_2):
+        self.assertEqual([book_1, book_2], [Books.objects.get(pk=self.book_1.pk).reading_now,
+                                            Books.objects.get(pk=self.book_2.pk).reading_now])
+
+    def test_accepted_and_closed(self):
+        self.assertReadingNow(0, 0)
+        self.session_1.is_accepted = True
+        self.session_1.save()
+        self.assertReadingNow(1, 1)
+        self.session_1.save()
+        self.assertReadingNow(1, 1)
+        self.session_1.is_closed = True
+        self.session_1.save()
+        self.assertReadingNow(0, 0)
+
+    def test_books_changed(self):
+        session = self.create_session(is_accepted=True)
+        session.books.add(self.book_1)
+        session.books.add(self.book_1)
+        self.assertReadingNow(1, 0)
+        session.books.remove(self.book_1, self.book_2)
+        self.assertReadingNow(0, 0)
+        session.books.set([self.book_1, self.book_2])
+        self.book_2.session_books.remove(session)
+        self.assertReadingNow(1, 0)
+        self.book_1.session_books.clear()
+        self.assertReadingNow(0, 0)
+        self.book_2.session_books.add(session, self.session_1)
+        session.books.clear()
+        self.assertReadingNow(0, 0)
+
+    def test_deleted(self):
+        session = self.create_session(is_accepted=True)
+        session.books.add(self.book_1)
+        self.create_session(is_accepted=True).books.add(self.book_1)
+        self.assertReadingNow(2, 0)
+        session.delete()
+        self.assertReadingNow(1, 0)
+        self.user_1.delete()
+        self.assertReadingNow(0, 0)
+
+    def test_recount(self):
+        self.create_session(is_accepted=True).books.add(self.book_2)
+        Books.objects.update(reading_now=5)
+        self.assertEqual(2, recount_reading_now())
+        self.assertReadingNow(0, 1)
+
+
+class ReservationTestCase(TestCase):
+
+    def setUp(self):
+        self.user_1 = User.objects.create_user(username='User1', password='password')
+        self.author_1 = Authors.objects.create(first_name='Test', last_name='Author 1')
+        self.library_1 = Libraries.objects.create(title='Lib 1', location='Loc 1', phone='Phone 1')
+        self.library_2 = Libraries.objects.create(title='Lib 2', location='Loc 2', phone='Phone 2')
+        self.book_1 = Books.objects.create(title='Test book 1', description='Desc 1', author=self.author_1)
+        self.book_2 = Books.objects.create(title='Test book 2', description='Desc 2', author=self.author_1)
+        for library in (self.library_1, self.library_2):
+            BookLibraryAvailable.objects.create(book=self.book_1, library=library, available=True, copies=2)
+            BookLibraryAvailable.objects.create(book=self.book_2, library=library, available=True, copies=1)
+
+    def create_session(self, *books, library=None):
+        today = datetime.date.today()
+        session = UserBookSession.objects.create(user=self.user_1, library=library or self.library_1,
+                                                 start_date=today, end_date=today + datetime.timedelta(days=7))
+        session.books.add(*books)
+        reserve_session(session)
+        return session
+
+    def assertReserved(self, book_1, book_2, library=None):
+        reserved = BookLibraryAvailable.objects.filter(library=library or self.library_1).order_by('book_id')
+        self.assertEqual([book_1, book_2], list(reserved.values_list('reserved', flat=True)))
+
+    def test_reserve_and_release(self):
+        reserve_books(self.library_1.id, [self.book_1.id, self.book_2.id])
+        self.assertReserved(1, 1)
+        with self.assertRaises(ReservationError):
+            reserve_books(self.library_1.id, [self.book_1.id, self.book_2.id])
+        # резервирование первой книги откатывается вместе с неудавшимся вторым
+        self.assertReserved(1, 1)
+        release_books(self.library_1.id, [self.book_1.id, self.book_2.id])
+        release_books(self.library_1.id, [self.book_2.id])
+        self.assertReserved(0, 0)
+
+    def test_not_available(self):
+        BookLibraryAvailable.objects.filter(book=self.book_1).update(available=False)
+        with self.assertRaises(ReservationError):
+            reserve_books(self.library_1.id, [self.book_1.id])
+        self.assertReserved(0, 0)
+
+    def test_session_closed_and_reopened(self):
+        session = self.create_session(self.book_1, self.book_2)
+        self.assertReserved(1, 1)
+        session.is_closed = True
+        session.save()
+        self.assertReserved(0, 0)
+        session.is_closed = False
+        session.save()
+        self.assertReserved(1, 1)
+
+    def test_session_changed(self):
+        session = self.create_session(self.book_1)
+        session.books.add(self.book_2)
+        self.assertReserved(1, 1)
+        session.library = self.library_2
+        session.save()
+        self.assertReserved(0, 0)
+        self.assertReserved(1, 1, library=self.library_2)
+        self.book_1.session_books.remove(session)
+        self.assertReserved(0, 1, library=self.library_2)
+        session.delete()
+        self.assertReserved(0, 0, library=self.library_2)
+
+    def test_session_without_reservation(self):
+        today = datetime.date.today()
+        session = UserBookSession.objects.create(user=self.user_1, library=self.library_1,
+                                                 start_date=today, end_date=today)
+        session.books.add(self.book_1)
+        session.is_closed = True
+        session.save()
+        self.assertReserved(0, 0)
+
+    def test_recount(self):
+        self.create_session(self.book_1, self.book_2)
+        closed = self.create_session(self.book_1)
+        closed.is_closed = True
+        closed.save()
+        UserBookSession.objects.create(user=self.user_1, library=self.library_1, start_date=closed.start_date,
+                                       end_date=closed.end_date).books.add(self.book_1)
+        BookLibraryAvailable.objects.update(reserved=0)
+        self.assertEqual(4, recount_reservations())
+        self.assertReserved(1, 1)
+
+
+class MissingPksTestCase(TestCase):
+
+    def setUp(self):
+        self.category_1 = Categories.objects.create(title='Category 1')
+        self.category_2 = Categories.objects.create(title='Category 2')
+
+    def delete_without_signals(self, category):
+        """Удаление записи так, как его увидел бы процесс, не получивший инвалидацию"""
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Categories._meta.db_table} WHERE id = %s', [category.pk])
+
+    @override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': False})
+    def test_local_cache(self):
+        get_table_ids('categories', Categories.objects.all())
+        self.delete_without_signals(self.category_2)
+        self.assertEqual({self.category_2.pk, 0}, get_missing_pks(
+            'categories', Categories.objects.all(), [self.category_1.pk, self.category_2.pk, 0]))
+
+    @override_settings(BOOKS_DETAIL_CACHE={'SINGLE_PROCESS': True})
+    def test_shared_cache(self):
+        get_table_ids('categories', Categories.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(set(), get_missing_pks('categories', Categories.objects.all(), [self.category_1.pk]))
+        self.category_2.delete()
+        self.assertEqual({self.category_2.pk}, get_missing_pks(
+            'categories', Categories.objects.all(), [self.category_1.pk, self.category_2.pk]))
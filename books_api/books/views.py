@@ -1,75 +1,202 @@
-from django.db.models import Count, Case, When
+import codecs
+
+from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, permissions, mixins
 from rest_framework.decorators import action
-from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.exceptions import NotFound, ValidationError, UnsupportedMediaType, ParseError
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 from books.models import (
     Books, Authors, Categories,
     Libraries, UserBookSession, UserBookRelation,
-    BookLibraryAvailable, UserBookOffer
+    BookLibraryAvailable, UserBookOffer, BookCatalog, Leaderboard
 )
 import books.serializers as s
-from books.services import UserBookOfferFilter, UserBookSessionFilter, BooksListFilter, set_book_values
+from books.cache import get_book_detail, get_books_facets
+from books.conditional import ConditionalGetMixin
+from books.engine import get_catalog_engine, get_catalog_engine_settings, get_engine_filters
+from books.importers import AvailabilityImport, READERS, iter_lines
+from books.pagination import BooksListPagination
+from books.row_serializers import RowListMixin, get_row_serializer
+from books.search import FullTextSearchFilter
+from books.services import (
+    UserBookOfferFilter, UserBookSessionFilter, BooksListFilter,
+    BookCatalogFilter, bulk_update_relations, upsert_relation,
+    ReservationError, BooksNotFoundError, get_book_facets, build_facets,
+    delete_cascade
+)
 
 
-class BooksViewSet(viewsets.ModelViewSet):
+class BooksViewSet(ConditionalGetMixin, RowListMixin, viewsets.ModelViewSet):
     """
     Набор представлений для следующих действий:
     --- Доступно всем пользователям ---
-    1. Получение списка книг в наличии с возможностью поиска по названию книги,
-    фильтрации через BooksListFilter и упорядочивания по рейтингу или лайкам.
-    2. Получение экземпляра книги (с дополнительным аннотированным полем 'reading_now',
-    подсчитывающим количество активных сессий с книгой).
+    1. Получение списка книг в наличии (из каталога BookCatalog) с возможностью поиска по названию книги,
+    фильтрации через BookCatalogFilter и упорядочивания по рейтингу или лайкам
+    (постраничная или курсорная пагинация через BooksListPagination).
+    2. Получение экземпляра книги (с полем 'reading_now' - количеством активных сессий с книгой,
+    поддерживаемым сигналами сессий) через кэш с версией книги (books.cache).
+    Для списка и экземпляра поддерживаются условные запросы (ETag, Last-Modified) через ConditionalGetMixin.
+    Список без поиска может отдаваться по снимку каталога в памяти (books.engine, BOOKS_CATALOG_ENGINE).
+    Для списка доступны фасеты (действие facets): количество книг по категориям, авторам, библиотекам и рейтингу.
+    3. Получение похожих книг в наличии (действие similar, books.recommendations)
+    и рейтинговых таблиц книг по байесовскому среднему оценок или лайкам (действие leaderboard, books.leaderboards).
     --- Доступно администраторам ---
-    3. Создание, обновление и удаление экземпляра книги.
+    4. Создание, обновление и удаление экземпляра книги.
     """
-    filter_backends = [SearchFilter, DjangoFilterBackend, OrderingFilter]
-    search_fields = ['title', ]
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend, OrderingFilter]
     ordering_fields = ['rating', 'likes']
-    filterset_class = BooksListFilter
+    pagination_class = BooksListPagination
+
+    @property
+    def search_vector_field(self):
+        if self.action in ('list', 'facets'):
+            return 'search_vector'
+        return 'catalog__search_vector'
+
+    @property
+    def filterset_class(self):
+        if self.action in ('list', 'facets'):
+            return BookCatalogFilter
+        return BooksListFilter
 
     def get_queryset(self):
-        if self.action == 'list':
-            return Books.objects.filter(lib_available__available=True).select_related('author').prefetch_related(
-                'categories').distinct()
-        elif self.action == 'retrieve':
-            return Books.objects.all().annotate(
-                reading_now=Count(Case(When(session_books__is_accepted=True,
-                                            session_books__is_closed=False,
-                                            then=1))),
-            ).select_related('author').prefetch_related('categories', 'lib_available__library')
+        if self.action in ('list', 'facets'):
+            return BookCatalog.objects.filter(available=True)
         else:
             return Books.objects.all().select_related('author').prefetch_related('categories', 'lib_available__library')
 
     def get_serializer_class(self):
-        if self.action == 'list':
-            return s.BooksListSerializer
+        if self.action in ('list', 'similar', 'leaderboard'):
+            return s.BookCatalogListSerializer
         elif self.action == 'retrieve':
             return s.BooksDetailSerializer
         else:
             return s.BookCreateSerializer
 
     def get_permissions(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'facets', 'similar', 'leaderboard'):
             return (permissions.AllowAny(),)
         return (permissions.IsAdminUser(),)
 
-
-class AuthorsViewSet(viewsets.ModelViewSet):
+    def get_version_keys(self):
+        if self.action in ('list', 'facets'):
+            return [('books',)]
+        elif self.action == 'retrieve':
+            return [('book', self.kwargs['pk'])]
+        elif self.action == 'similar':
+            return [('similar', self.kwargs['pk']), ('books',)]
+        elif self.action == 'leaderboard':
+            return [('leaderboards',), ('books',)]
+
+    def list(self, request, *args, **kwargs):
+        """
+        Получение списка книг: при включённом снимке каталога (BOOKS_CATALOG_ENGINE) фильтрация,
+        упорядочивание и пагинация выполняются по снимку, а из базы читаются только книги страницы
+        """
+        row_serializer = get_row_serializer(self.get_serializer_class())
+        filters = None
+        if get_catalog_engine_settings()['ENABLED'] and row_serializer is not None:
+            filters = get_engine_filters(self, request)
+        if filters is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.get_queryset()
+        queryset = row_serializer.prepare(queryset, self.get_ordering_columns(queryset))
+        page = self.paginator.paginate_engine(get_catalog_engine().state(), filters, queryset, request, view=self)
+        return self.get_paginated_response(row_serializer.serialize(page, self.get_serializer_context()))
+
+    @action(detail=False, url_path='facets', url_name='facets')
+    def facets(self, request):
+        """
+        Количество книг списка (с теми же поиском и фильтрами) по категориям, авторам, библиотекам
+        и целой части рейтинга: по снимку каталога, если он включён и нет поиска, иначе одним запросом.
+        Результат кэшируется по нормализованным параметрам до изменения книг
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        filterset = self.filterset_class(request.query_params, queryset=queryset, request=request)
+        filterset.is_valid()
+        filters = filterset.get_values()
+        search = ' '.join(FullTextSearchFilter().get_search_terms(request)).lower()
+
+        def compute():
+            if not search and get_catalog_engine_settings()['ENABLED']:
+                return build_facets(get_catalog_engine().state().facets(filters))
+            return build_facets(get_book_facets(queryset))
+
+        return Response(get_books_facets({'filters': filters, 'search': search}, compute))
+
+    @action(detail=True, url_path='similar', url_name='similar', pagination_class=None)
+    def similar(self, request, pk=None):
+        """
+        Похожие книги в наличии по убыванию сходства: соседи книги, заранее построенные
+        командой refresh_similar_books, читаются одним запросом по индексу (книга, место)
+        """
+        if not str(pk).isdigit():
+            raise NotFound
+        queryset = BookCatalog.objects.filter(available=True, book__similar_for__book_id=pk)
+        return self.row_list(queryset.order_by('book__similar_for__rank'))
+
+    @action(detail=False, url_path='leaderboard', url_name='leaderboard', pagination_class=None)
+    def leaderboard(self, request):
+        """
+        Страница рейтинговой таблицы книг (всех, категории или библиотеки), построенной заранее
+        командой rebuild_leaderboards и обновляемой при изменении счётчиков книг: запрос таблицы
+        и запрос книг по диапазону мест, поэтому любая страница стоит столько же, сколько первая
+        """
+        params = s.LeaderboardQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+        scope = next((scope for scope in ('category', 'library') if scope in params), 'all')
+        board = Leaderboard.objects.filter(scope=scope, scope_id=params.get(scope, 0), metric=params['metric']).values(
+            'pk', 'size').first() or {'pk': None, 'size': 0}
+        page_size = api_settings.PAGE_SIZE
+        start = (params['page'] - 1) * page_size
+        queryset = BookCatalog.objects.filter(book__leaderboard_entries__leaderboard=board['pk'],
+                                              book__leaderboard_entries__rank__gt=start,
+                                              book__leaderboard_entries__rank__lte=start + page_size)
+        results = self.row_list(queryset.order_by('book__leaderboard_entries__rank')).data
+        for rank, item in enumerate(results, start + 1):
+            item['rank'] = rank
+        url = request.build_absolute_uri()
+        return Response({
+            'count': board['size'],
+            'next': replace_query_param(url, 'page', params['page'] + 1) if start + page_size < board['size'] else None,
+            'previous': replace_query_param(url, 'page', params['page'] - 1) if params['page'] > 1 else None,
+            'results': results,
+        })
+
+    def perform_destroy(self, instance):
+        # работа сигналов удаления связанных записей выполняется одним вызовом на всё удаление
+        delete_cascade(instance)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Получение экземпляра книги из кэша, при промахе - сериализация BooksDetailSerializer"""
+        pk = str(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if not pk.isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        data = get_book_detail(int(pk), request, lambda: self.get_serializer(self.get_object()).data)
+        return Response(data)
+
+
+class AuthorsViewSet(ConditionalGetMixin, RowListMixin, viewsets.ModelViewSet):
     """
     Набор представлений для следующих действий:
     --- Доступно всем пользователям ---
     1. Получение списка авторов с возможностью поиска по фамилии и имени.
     2. Получение экземпляра автора.
-    3. Получение списка всех книг определенного автора с возможностью поиска по названию.
+    3. Получение списка всех книг определенного автора с возможностью поиска по названию
+    (постраничная или курсорная пагинация через BooksListPagination).
+    Для действий 1-3 поддерживаются условные запросы (ETag, Last-Modified) через ConditionalGetMixin.
     --- Доступно администраторам ---
     4. Создание, обновление и удаление экземпляра автора.
     """
     queryset = Authors.objects.all()
-    filter_backends = [SearchFilter, ]
-    search_fields = ['first_name', 'last_name']
+    filter_backends = [FullTextSearchFilter, ]
+    search_vector_field = 'search_vector'
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -77,7 +204,7 @@ class AuthorsViewSet(viewsets.ModelViewSet):
         elif self.action == 'retrieve':
             return s.AuthorDetailSerializer
         elif self.action == 'get_books':
-            return s.BooksListSerializer
+            return s.BookCatalogListSerializer
         else:
             return s.AuthorCreateSerializer
 
@@ -86,40 +213,45 @@ class AuthorsViewSet(viewsets.ModelViewSet):
             return (permissions.AllowAny(),)
         return (permissions.IsAdminUser(),)
 
+    def get_version_keys(self):
+        if self.action == 'list':
+            return [('authors',)]
+        elif self.action == 'retrieve':
+            return [('author', self.kwargs['pk'])]
+        elif self.action == 'get_books':
+            return [('books',)]
+
+    def perform_destroy(self, instance):
+        delete_cascade(instance)
+
     @action(
         detail=True,
         url_name='books',
         url_path='books',
-        queryset=Books.objects.all(),
-        search_fields=['title', ]
+        queryset=BookCatalog.objects.all(),
+        pagination_class=BooksListPagination
     )
     def get_books(self, request, pk=None):
         """Создание кастомного действия для просмотра списка книг автора"""
-        books_by_author = Books.objects.filter(author=self.kwargs['pk']).select_related('author').prefetch_related(
-            'categories')
-        queryset = self.filter_queryset(books_by_author)
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        books_by_author = BookCatalog.objects.filter(author=self.kwargs['pk'])
+        return self.row_list(self.filter_queryset(books_by_author))
 
 
-class CategoriesViewSet(viewsets.ModelViewSet):
+class CategoriesViewSet(ConditionalGetMixin, RowListMixin, viewsets.ModelViewSet):
     """
     Набор представлений для следующих действий:
     --- Доступно всем пользователям ---
     1. Получение списка категорий с возможностью поиска по названию.
     2. Получение экземпляра категории.
-    3. Получение списка всех книг определенной категории с возможностью поиска по названию.
+    3. Получение списка всех книг определенной категории с возможностью поиска по названию
+    (постраничная или курсорная пагинация через BooksListPagination).
+    Для действий 1-3 поддерживаются условные запросы (ETag, Last-Modified) через ConditionalGetMixin.
     --- Доступно администраторам ---
     4. Создание, обновление и удаление экземпляра категории.
     """
     queryset = Categories.objects.all()
-    filter_backends = [SearchFilter, ]
-    search_fields = ['title', ]
+    filter_backends = [FullTextSearchFilter, ]
+    search_vector_field = 'search_vector'
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -127,7 +259,7 @@ class CategoriesViewSet(viewsets.ModelViewSet):
         elif self.action == 'retrieve':
             return s.CategoryDetailSerializer
         elif self.action == 'get_books':
-            return s.BooksListSerializer
+            return s.BookCatalogListSerializer
         else:
             return s.CategoryCreateSerializer
 
@@ -136,39 +268,42 @@ class CategoriesViewSet(viewsets.ModelViewSet):
             return (permissions.AllowAny(),)
         return (permissions.IsAdminUser(),)
 
+    def get_version_keys(self):
+        if self.action == 'list':
+            return [('categories',)]
+        elif self.action == 'retrieve':
+            return [('category', self.kwargs['pk'])]
+        elif self.action == 'get_books':
+            return [('books',)]
+
     @action(
         detail=True,
         url_name='books',
         url_path='books',
-        queryset=Books.objects.all()
+        queryset=BookCatalog.objects.all(),
+        pagination_class=BooksListPagination
     )
     def get_books(self, request, pk=None):
         """Создание кастомного действия для просмотра списка книг категории"""
-        books_by_author = Books.objects.filter(categories=self.kwargs['pk']).select_related('author').prefetch_related(
-            'categories')
-        queryset = self.filter_queryset(books_by_author)
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        books_by_category = BookCatalog.objects.filter(category_ids__overlap=[self.kwargs['pk']])
+        return self.row_list(self.filter_queryset(books_by_category))
 
 
-class LibrariesViewSet(viewsets.ModelViewSet):
+class LibrariesViewSet(ConditionalGetMixin, RowListMixin, viewsets.ModelViewSet):
     """
     Набор представлений для следующих действий:
     --- Доступно всем пользователям ---
     1. Получение списка библиотек с возможностью поиска по названию.
     2. Получение экземпляра библиотеки.
-    3. Получение списка всех доступных книг в определенной библиотеке с возможностью поиска по названию.
+    3. Получение списка всех доступных книг в определенной библиотеке с возможностью поиска по названию
+    (постраничная или курсорная пагинация через BooksListPagination).
+    Для действий 1-3 поддерживаются условные запросы (ETag, Last-Modified) через ConditionalGetMixin.
     --- Доступно администраторам ---
     4. Создание, обновление и удаление экземпляра библиотеки.
     """
     queryset = Libraries.objects.all()
-    filter_backends = [SearchFilter, ]
-    search_fields = ['title', ]
+    filter_backends = [FullTextSearchFilter, ]
+    search_vector_field = 'search_vector'
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -176,7 +311,7 @@ class LibrariesViewSet(viewsets.ModelViewSet):
         elif self.action == 'retrieve':
             return s.LibraryDetailSerializer
         elif self.action == 'get_books':
-            return s.BooksListSerializer
+            return s.BookCatalogListSerializer
         else:
             return s.LibraryCreateSerializer
 
@@ -186,27 +321,32 @@ class LibrariesViewSet(viewsets.ModelViewSet):
         else:
             return (permissions.IsAdminUser(), )
 
+    def get_version_keys(self):
+        if self.action == 'list':
+            return [('libraries',)]
+        elif self.action == 'retrieve':
+            return [('library', self.kwargs['pk'])]
+        elif self.action == 'get_books':
+            return [('books',)]
+
+    def perform_destroy(self, instance):
+        delete_cascade(instance)
+
     @action(
         detail=True,
         url_name='books',
         url_path='books',
-        queryset=Books.objects.all(),
+        queryset=BookCatalog.objects.all(),
+        pagination_class=BooksListPagination
     )
     def get_books(self, request, pk=None):
         """Создание кастомного действия для просмотра списка книг доступных в определенной библиотеке"""
-        books_by_author = Books.objects.filter(lib_available__library=self.kwargs['pk']).select_related(
-            'author').prefetch_related('categories')
-        queryset = self.filter_queryset(books_by_author)
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        books_by_library = BookCatalog.objects.filter(library_ids__overlap=[self.kwargs['pk']])
+        return self.row_list(self.filter_queryset(books_by_library))
 
 
-class MySessionsViewSet(mixins.CreateModelMixin,
+class MySessionsViewSet(RowListMixin,
+                        mixins.CreateModelMixin,
                         mixins.RetrieveModelMixin,
                         mixins.ListModelMixin,
                         viewsets.GenericViewSet):
@@ -215,7 +355,7 @@ class MySessionsViewSet(mixins.CreateModelMixin,
     --- Доступно авторизованным пользователям ---
     1. Получение списка своих сессий с возможностью фильтрации по закрытым и принятым сессиям.
     2. Получение экземпляра своей сессии.
-    3. Создание экземпляра сессии.
+    3. Создание экземпляра сессии с резервированием экземпляров книг в библиотеке.
     """
     permission_classes = (permissions.IsAuthenticated, )
     filter_backends = [DjangoFilterBackend, ]
@@ -230,13 +370,15 @@ class MySessionsViewSet(mixins.CreateModelMixin,
             return s.BooksSessionCreateSerializer
 
     def get_queryset(self):
-        return UserBookSession.objects.filter(user=self.request.user).select_related('user', 'library')
+        return UserBookSession.objects.filter(user=self.request.user).select_related(
+            'user', 'library').prefetch_related('books')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class UserSessionsViewSet(mixins.UpdateModelMixin,
+class UserSessionsViewSet(RowListMixin,
+                          mixins.UpdateModelMixin,
                           mixins.RetrieveModelMixin,
                           mixins.ListModelMixin,
                           mixins.DestroyModelMixin,
@@ -247,12 +389,13 @@ class UserSessionsViewSet(mixins.UpdateModelMixin,
     1. Получение списка пользовательских сессий с возможностью поиска по названию книги,
     имени пользователя и названию библиотеки и фильтрации через UserBookSessionFilter.
     2. Получение экземпляра сессии.
-    3. Обновление и удаление экземпляра сессии.
+    3. Обновление и удаление экземпляра сессии (закрытие или удаление освобождает зарезервированные экземпляры).
     """
     queryset = UserBookSession.objects.all().select_related('user', 'library').prefetch_related('books')
     permission_classes = (permissions.IsAdminUser, )
-    filter_backends = [SearchFilter, DjangoFilterBackend]
-    search_fields = ['books__title', 'user__username', 'library__title']
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
+    search_fields = ['user__username', 'library__title']
+    search_vector_field = 'books__catalog__search_vector'
     filterset_class = UserBookSessionFilter
 
     def get_serializer_class(self):
@@ -263,14 +406,27 @@ class UserSessionsViewSet(mixins.UpdateModelMixin,
         else:
             return s.UserBooksSessionsEditSerializer
 
+    def perform_update(self, serializer):
+        # счётчик reading_now книг и резервирование экземпляров меняются сигналами в той же транзакции, что и сессия
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except ReservationError as error:
+            raise ValidationError(str(error))
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
 
-class BooksLibrariesAvailableViewSet(viewsets.ModelViewSet):
+
+class BooksLibrariesAvailableViewSet(RowListMixin, viewsets.ModelViewSet):
     """
     Набор представлений для следующих действий:
     --- Доступно администраторам ---
     1. Получение списка экземпляров BookLibraryAvailable с возможностью фильтрации по книге и библиотеке.
     2. Получение экземпляра BookLibraryAvailable.
     3. Создание, обновление и удаление экземпляра BookLibraryAvailable.
+    4. Массовый импорт наличия из потока CSV или NDJSON (import) с отчётом об ошибках по строкам.
     """
     queryset = BookLibraryAvailable.objects.all().select_related('book', 'library')
     permission_classes = (permissions.IsAdminUser, )
@@ -285,6 +441,24 @@ class BooksLibrariesAvailableViewSet(viewsets.ModelViewSet):
         else:
             return s.BooksLibrariesAvailableEditSerializer
 
+    @action(detail=False, methods=['post'], url_path='import', url_name='import')
+    def import_rows(self, request):
+        """
+        Тело запроса (text/csv с заголовком book,library,available[,copies] или application/x-ndjson)
+        не разбирается парсерами DRF, а читается построчно и применяется частями через AvailabilityImport
+        """
+        media_type, *params = [part.strip() for part in request.content_type.split(';')]
+        reader = READERS.get(media_type.lower())
+        if reader is None:
+            raise UnsupportedMediaType(media_type)
+        charset = dict(param.split('=', 1) for param in params if '=' in param).get('charset', 'utf-8')
+        try:
+            codecs.lookup(charset)
+        except LookupError:
+            raise ParseError(f'Неизвестная кодировка {charset}')
+        report = AvailabilityImport().run(reader(iter_lines(request._request, charset)))
+        return Response(report)
+
 
 class UserBookRelationViewSet(mixins.UpdateModelMixin,
                               viewsets.GenericViewSet):
@@ -293,23 +467,60 @@ class UserBookRelationViewSet(mixins.UpdateModelMixin,
     --- Доступно авторизованным пользователям ---
     1. Создание своего экземпляра отношения пользователя к книги.
     2. Обновление своего экземпляра отношения пользователя к книги.
+    3. Создание и обновление своих отношений к нескольким книгам одним запросом (bulk).
     """
     permission_classes = (permissions.IsAuthenticated, )
     queryset = UserBookRelation.objects.all()
     serializer_class = s.UserBookRelationSerializer
     lookup_field = 'book'
 
-    def get_object(self):
-        obj, self.created = UserBookRelation.objects.get_or_create(user=self.request.user, book_id=self.kwargs['book'])
-        return obj
+    def get_serializer_class(self):
+        if self.action == 'bulk':
+            return s.UserBookRelationBulkSerializer
+        return s.UserBookRelationSerializer
+
+    def update(self, request, *args, **kwargs):
+        """
+        Отношение создаётся или изменяется только после проверки данных,
+        одним запросом upsert_relation вместо get_or_create и сохранения
+        """
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data)
 
     def perform_update(self, serializer):
-        """Обновления полей рейтинга, лайков и закладок книги"""
-        serializer.save()
-        set_book_values(serializer, self.created)
-
-
-class MyOffersViewSet(mixins.CreateModelMixin,
+        """
+        Обновления полей рейтинга, лайков и закладок книги на разницу между прежним и новым состоянием отношения,
+        прежнее состояние возвращает тот же запрос, который записывает новое
+        """
+        try:
+            book_id = int(self.kwargs['book'])
+        except ValueError:
+            raise NotFound
+        relation = upsert_relation(self.request.user, book_id, serializer.validated_data)
+        if relation is None:
+            raise NotFound
+        serializer.instance = relation
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Принимает список элементов {book, like, in_bookmarks, rate} и применяет их в одной транзакции
+        (bulk_update_relations), возвращает итоговые отношения в порядке запроса
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            relations = bulk_update_relations(request.user, serializer.validated_data)
+        except BooksNotFoundError as error:
+            raise ValidationError(str(error))
+        return Response(s.UserBookRelationSerializer(relations, many=True).data)
+
+
+class MyOffersViewSet(RowListMixin,
+                      mixins.CreateModelMixin,
                       mixins.RetrieveModelMixin,
                       mixins.ListModelMixin,
                       viewsets.GenericViewSet):
@@ -339,7 +550,8 @@ class MyOffersViewSet(mixins.CreateModelMixin,
         serializer.save(user=self.request.user)
 
 
-class UserOffersViewSet(mixins.UpdateModelMixin,
+class UserOffersViewSet(RowListMixin,
+                        mixins.UpdateModelMixin,
                         mixins.RetrieveModelMixin,
                         mixins.ListModelMixin,
                         mixins.DestroyModelMixin,
@@ -354,8 +566,9 @@ class UserOffersViewSet(mixins.UpdateModelMixin,
     """
     queryset = UserBookOffer.objects.all().select_related('user', 'library')
     permission_classes = (permissions.IsAdminUser, )
-    filter_backends = [SearchFilter, DjangoFilterBackend]
-    search_fields = ['books_description', 'user__username', 'library__title']
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
+    search_fields = ['user__username', 'library__title']
+    search_vector_field = 'search_vector'
     filterset_class = UserBookOfferFilter
 
     def get_serializer_class(self):
@@ -367,7 +580,8 @@ class UserOffersViewSet(mixins.UpdateModelMixin,
             return s.UserBooksOfferEditSerializer
 
 
-class MyBookmarksViewSet(mixins.RetrieveModelMixin,
+class MyBookmarksViewSet(RowListMixin,
+                         mixins.RetrieveModelMixin,
                          mixins.ListModelMixin,
                          viewsets.GenericViewSet):
     """
@@ -377,8 +591,8 @@ class MyBookmarksViewSet(mixins.RetrieveModelMixin,
     2. Получение экземпляра книги из закладок.
     """
     permission_classes = (permissions.IsAuthenticated, )
-    filter_backends = [SearchFilter, ]
-    search_fields = ['title', ]
+    filter_backends = [FullTextSearchFilter, ]
+    search_vector_field = 'catalog__search_vector'
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -388,4 +602,4 @@ class MyBookmarksViewSet(mixins.RetrieveModelMixin,
     def get_queryset(self):
         return Books.objects.filter(userbookrelation__user=self.request.user,
                                     userbookrelation__in_bookmarks=True).select_related(
-            'author').prefetch_related('categories')
+            'author').prefetch_related('categories', 'lib_available__library')
@@ -44,7 +44,7 @@ INSTALLED_APPS = [
     'django_filters',
     'debug_toolbar',
 
-    'books',
+    'books.apps.BooksConfig',
 ]
 
 MIDDLEWARE = [
@@ -139,11 +139,98 @@ INTERNAL_IPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'books.authentication.CachedBasicAuthentication',
+        'books.authentication.CachedSessionAuthentication',
+        'books.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend', ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
+
+# Полнотекстовый поиск: 'auto' - tsvector с GIN-индексом в PostgreSQL,
+# для остальных СУБД локальный индекс в памяти процесса (books.search.LocalSearchBackend)
+BOOKS_SEARCH = {
+    'BACKEND': 'auto',
+    'CONFIG': 'russian',
+}
+
+# Для нескольких процессов нужен общий кэш (например, Redis или Memcached):
+# 'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': '127.0.0.1:11211'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Кэш экземпляров книг (books.cache): время жизни записи, окно отдачи устаревших данных
+# во время пересчёта, время жизни блокировки пересчёта и время ожидания чужого пересчёта (в секундах).
+# Версии для инвалидации хранятся в кэше CACHE, поэтому с кэшем в памяти процесса (LocMemCache)
+# кэширование отключается, если проект не запущен одним процессом (SINGLE_PROCESS = True).
+# Сервер разработки (runserver при DEBUG) - один процесс; при нескольких процессах (gunicorn, uWSGI)
+# SINGLE_PROCESS должен быть False, а в CACHES - общий кэш
+BOOKS_DETAIL_CACHE = {
+    'CACHE': 'default',
+    'TIMEOUT': 300,
+    'STALE_WHILE_REVALIDATE': 5,
+    'LOCK_TIMEOUT': 10,
+    'WAIT_TIMEOUT': 3,
+    'SINGLE_PROCESS': DEBUG,
+}
+
+# Счётчики книг (рейтинг, лайки, закладки) при изменении отношений пользователей:
+# 'sync' - сразу атомарным UPDATE строки книги, 'deferred' - книга помечается в очереди BookCounterQueue,
+# а команда flush_book_counters пересчитывает каждую помеченную книгу раз в FLUSH_INTERVAL секунд
+BOOKS_COUNTERS = {
+    'CONSISTENCY': 'sync',
+    'FLUSH_INTERVAL': 1,
+    'BATCH_SIZE': 1000,
+}
+
+# Снимок каталога для списка книг (books.engine): файл, общий для всех процессов через mmap
+# (None - во временной директории), изменения книг копятся в дельте и при COMPACT_ROWS изменений
+# сливаются в новый снимок
+BOOKS_CATALOG_ENGINE = {
+    'ENABLED': False,
+    'PATH': None,
+    'COMPACT_ROWS': 1000,
+}
+
+# Рейтинговые таблицы книг (books.leaderboards): SIZE лучших книг всего каталога, каждой категории
+# и каждой библиотеки по байесовскому среднему оценок (PRIOR_VOTES оценок PRIOR_MEAN в дополнение к оценкам книги)
+# и по лайкам. Строятся командой rebuild_leaderboards, а при ENABLED изменённые книги помечаются в очереди
+# LeaderboardQueue, и команда flush_leaderboards переносит их в таблицы раз в FLUSH_INTERVAL секунд
+BOOKS_LEADERBOARDS = {
+    'ENABLED': True,
+    'SIZE': 100,
+    'PRIOR_VOTES': 10,
+    'PRIOR_MEAN': 3,
+    'BATCH_SIZE': 1000,
+    'FLUSH_INTERVAL': 5,
+}
+
+# Похожие книги (books.recommendations) по совместным лайкам, закладкам и оценкам не ниже MIN_RATE:
+# до TOP_K соседей на книгу, BACKEND 'auto' - numpy/scipy при наличии, иначе 'python'.
+# Команда refresh_similar_books строит соседей полностью (--full) или обрабатывает очередь изменений
+# раз в FLUSH_INTERVAL секунд
+BOOKS_RECOMMENDATIONS = {
+    'BACKEND': 'auto',
+    'TOP_K': 20,
+    'MIN_RATE': 4,
+    'BATCH_SIZE': 1000,
+    'FLUSH_INTERVAL': 60,
+}
+
+# Кэш проверенных учётных данных (books.authentication): до MAX_SIZE записей в памяти процесса на TIMEOUT секунд,
+# ключ - HMAC пароля Basic, токена или ключа сессии. Записи пользователя инвалидируются при его изменении
+# (пароль, is_active), удалении токена и выходе через версии в кэше BOOKS_DETAIL_CACHE['CACHE'],
+# поэтому включается только с общим кэшем (или SINGLE_PROCESS)
+BOOKS_AUTH_CACHE = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,
+    'TIMEOUT': 300,
+}
+
+# Сессии: 'django.contrib.sessions.backends.cached_db' читает сессии из кэша без запроса к django_session
+# (запись - в кэш и базу), для нескольких процессов - только с общим кэшем
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'